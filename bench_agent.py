@@ -0,0 +1,255 @@
+"""Offline benchmark of the agent loop in talk2mcp-2.py
+
+Runs the real loop against the real calculator server (example2-3.py) and
+fake_gmail_server.py, with genai.Client swapped for a scripted fake model
+of configurable latency. Reports per-iteration phase timings and
+end-to-end wall time for one agent and for N concurrent agents, and saves
+everything as JSON so runs can be compared across changes.
+
+    python bench_agent.py --iterations 8 --agents 4 --latency 0.2 --output bench_results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from google import genai
+
+from fake_llm import FakeClient
+from latency import percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCH_QUERY = "Find the ASCII values of characters in INDIA, calculate the sum of exponentials of those values, and send the result as an email to bench@example.com."
+
+# The INDIA -> exponential sum -> email pipeline the real prompt asks for
+PIPELINE = [
+    'FUNCTION_CALL: {"function": "show_reasoning", "parameters": {"steps": ["1. Convert INDIA to ASCII values. Type of reasoning: Entity lookup", "2. Sum of exponentials. Type of reasoning: Arithmetic", "3. Email the result. Type of reasoning: Logical"]}}',
+    'FUNCTION_CALL: {"function": "strings_to_chars_to_int", "parameters": {"string": "INDIA"}}',
+    'FUNCTION_CALL: {"function": "verify", "parameters": {"expression": "[ord(\'I\'), ord(\'N\'), ord(\'D\'), ord(\'I\'), ord(\'A\')]", "expected": [73, 78, 68, 73, 65]}}',
+    'FUNCTION_CALL: {"function": "int_list_to_exponential_sum", "parameters": {"int_list": [73, 78, 68, 73, 65]}}',
+    'FUNCTION_CALL: {"function": "verify", "parameters": {"expression": "sum([math.exp(x) for x in [73, 78, 68, 73, 65]])", "expected": 7.59982224609308e+33}}',
+    'FUNCTION_CALL: {"function": "send_email", "parameters": {"recipient_id": "bench@example.com", "subject": "Result", "message": "7.59982224609308e+33"}}',
+]
+
+# The same pipeline as one plan-mode DAG
+PLAN = {
+    "steps": [
+        {"id": "ascii", "function": "strings_to_chars_to_int", "parameters": {"string": "INDIA"}},
+        {"id": "check_ascii", "function": "verify", "parameters": {"expression": "[ord(c) for c in 'INDIA']", "expected": "$ascii"}},
+        {"id": "total", "function": "int_list_to_exponential_sum", "parameters": {"int_list": "$ascii"}},
+        {"id": "check_total", "function": "verify", "parameters": {"expression": "sum([math.exp(x) for x in [73, 78, 68, 73, 65]])", "expected": "$total"}},
+        {"id": "email", "function": "send_email", "parameters": {"recipient_id": "bench@example.com", "subject": "Result", "message": "${total}"}},
+    ],
+    "final_answer": "$total",
+}
+
+PHASES = ["prompt_build", "queue_wait", "generation", "parse", "coerce", "tool_call", "format", "tools_wall"]
+
+
+def scripted_model(iterations):
+    """Fake model answering the pipeline so a run takes exactly `iterations` LLM calls"""
+    def respond(contents):
+        # The step is the number of model turns so far; each agent has its own contents
+        step = sum(1 for turn in contents if turn.get("role") == "model")
+        if step >= iterations - 1:
+            return "FINAL_ANSWER: [7.59982224609308e+33]"
+        if step < len(PIPELINE):
+            return PIPELINE[step]
+        # Pad longer runs with cheap arithmetic
+        return f'FUNCTION_CALL: {{"function": "add", "parameters": {{"a": {step}, "b": {step}}}}}'
+    return respond
+
+
+def planned_model():
+    """Fake model answering every plan-mode request with the pipeline DAG"""
+    return lambda contents: f"PLAN: {json.dumps(PLAN)}"
+
+
+def load_agent(fake_client):
+    """Import talk2mcp-2.py with genai.Client replaced by the fake client"""
+    real_client = genai.Client
+    genai.Client = lambda *args, **kwargs: fake_client
+    try:
+        spec = importlib.util.spec_from_file_location("talk2mcp", os.path.join(REPO_DIR, "talk2mcp-2.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        genai.Client = real_client
+    return module
+
+
+def configure_agent(agent, iterations, cache_dir, math_transport="stdio", math_pool=1):
+    """Point the agent at the local servers and keep caches out of the measurement"""
+    ServerConfig = agent.ServerConfig
+    agent.server_configs = [
+        ServerConfig("math", sys.executable, [os.path.join(REPO_DIR, "example2-3.py")], transport=math_transport,
+                     pool_size=math_pool, stateless_tools=agent.pure_tools),
+        ServerConfig("gmail", sys.executable, [os.path.join(REPO_DIR, "fake_gmail_server.py")]),
+    ]
+    agent.max_iterations = max(agent.max_iterations, iterations)
+    agent.llm_cache.mode = "off"
+    agent.use_catalog_cache = False
+    agent.catalog_cache.path = os.path.join(cache_dir, "tool_catalog.json")
+    agent.journal_dir = os.path.join(cache_dir, "runs")
+
+
+def summarize(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "max": ordered[-1],
+    }
+
+
+def phase_summary(states):
+    """Distribution of each phase across all iterations of the given agents"""
+    return {
+        phase: summarize([t[phase] for s in states for t in s.timings if phase in t])
+        for phase in PHASES
+    }
+
+
+async def bench_single(agent):
+    start = time.perf_counter()
+    state = await agent.main(BENCH_QUERY)
+    wall = time.perf_counter() - start
+    if state is None:
+        raise RuntimeError("Agent run failed, rerun with --verbose for details")
+    return {
+        "wall_time": wall,
+        "agent_time": state.elapsed,
+        "startup_time": wall - state.elapsed,
+        "iterations": state.iteration + 1,
+        "llm_calls": state.llm_calls,
+        "final_answer": state.final_answer,
+        "error": state.error,
+        "per_iteration": state.timings,
+        "phases": phase_summary([state]),
+    }
+
+
+async def bench_concurrent(agent, agents):
+    start = time.perf_counter()
+    states = await agent.run_batch([BENCH_QUERY] * agents, parallelism=agents)
+    wall = time.perf_counter() - start
+    return {
+        "agents": agents,
+        "wall_time": wall,
+        "throughput": agents / wall if wall > 0 else None,
+        "agent_time": summarize([s.elapsed for s in states if s.elapsed is not None]),
+        "answered": sum(1 for s in states if s.final_answer is not None),
+        "llm_calls": sum(s.llm_calls for s in states),
+        "phases": phase_summary(states),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    single = results["single"]
+    print("\n=== Agent Benchmark ===")
+    print(f"Revision: {results['revision']}  latency: {results['config']['latency']}s  "
+          f"iterations: {results['config']['iterations']}")
+    print(f"Single agent: {single['wall_time']:.3f}s wall ({single['startup_time']:.3f}s startup, "
+          f"{single['agent_time']:.3f}s loop, {single['llm_calls']} LLM calls)")
+    print(f"{'phase':<14}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for phase, stats in single["phases"].items():
+        if stats:
+            print(f"{phase:<14}{stats['mean'] * 1000:>10.2f}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}")
+    for line in results["models"]:
+        print(f"  {line}")
+    concurrent = results.get("concurrent")
+    if concurrent:
+        print(f"{concurrent['agents']} concurrent agents: {concurrent['wall_time']:.3f}s wall, "
+              f"{concurrent['throughput']:.2f} agents/s, {concurrent['answered']} answered")
+    print("=======================")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the MCP agent loop")
+    parser.add_argument("--iterations", type=int, default=7, help="LLM calls per agent run")
+    parser.add_argument("--agents", type=int, default=4, help="concurrent agents (0 to skip)")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake model latency per call, seconds")
+    parser.add_argument("--routine-model", help="route routine follow-up steps to this (fake) model")
+    parser.add_argument("--routine-latency", type=float, help="fake latency of the routine model, seconds")
+    parser.add_argument("--rpm", type=float, default=0, help="requests-per-minute limit for the agents (0 = none)")
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming generation path")
+    parser.add_argument("--in-process", action="store_true", help="serve the calculator in-process")
+    parser.add_argument("--math-pool", type=int, default=1, metavar="N", help="run N calculator server processes")
+    parser.add_argument("--plan", action="store_true", help="benchmark plan-then-execute mode")
+    parser.add_argument("--native-tools", action="store_true", help="benchmark native function calling")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--verbose", action="store_true", help="show the agent's own output")
+    args = parser.parse_args()
+
+    model = planned_model() if args.plan else scripted_model(args.iterations)
+    latency = args.latency
+    if args.routine_model:
+        latency = {"*": args.latency, args.routine_model: args.routine_latency if args.routine_latency is not None else args.latency}
+    fake_client = FakeClient(model, latency=latency)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        agent = load_agent(fake_client)
+        configure_agent(agent, args.iterations, cache_dir, "memory" if args.in_process else "stdio", args.math_pool)
+        agent.stream_responses = args.stream
+        agent.agent_mode = "plan" if args.plan else "loop"
+        agent.native_tools = args.native_tools
+        if args.rpm:
+            agent.scheduler = agent.llm.scheduler = agent.RequestScheduler(rpm=args.rpm)
+        if args.routine_model:
+            agent.router.routes["routine"].model = args.routine_model
+
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            single = asyncio.run(bench_single(agent))
+            concurrent = asyncio.run(bench_concurrent(agent, args.agents)) if args.agents > 0 else None
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "iterations": args.iterations,
+            "agents": args.agents,
+            "latency": args.latency,
+            "stream": args.stream,
+            "plan": args.plan,
+            "native_tools": args.native_tools,
+            "in_process": args.in_process,
+            "math_pool": args.math_pool,
+            "rpm": args.rpm,
+            "routine_model": args.routine_model,
+            "routine_latency": args.routine_latency,
+        },
+        "single": single,
+        "concurrent": concurrent,
+        "models": agent.router.report(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""On-disk cache of server tool catalogs and the rendered system prompt"""
+import hashlib
+import json
+import os
+from importlib import metadata
+
+from mcp import types
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "tool_catalog.json")
+
+
+def server_fingerprint(config) -> str:
+    """Fingerprint a server by its name, launch command and script contents"""
+    digest = hashlib.sha256()
+    digest.update(config.name.encode())
+    digest.update(config.command.encode())
+    try:
+        digest.update(metadata.version("mcp").encode())
+    except metadata.PackageNotFoundError:
+        pass
+    for arg in config.args:
+        digest.update(arg.encode())
+        if os.path.isfile(arg):
+            with open(arg, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def tools_equal(a, b) -> bool:
+    """Compare two tool lists by what ends up in the prompt and dispatch table"""
+    def key(tools):
+        return [(t.name, t.description, json.dumps(t.inputSchema, sort_keys=True)) for t in tools]
+    return key(a) == key(b)
+
+
+class CatalogCache:
+    """Tool catalogs keyed by server fingerprint, plus rendered prompts"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.data = {"catalogs": {}, "prompts": {}}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.data["catalogs"] = data.get("catalogs", {})
+            self.data["prompts"] = data.get("prompts", {})
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable catalog cache {self.path}: {e}")
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so a crash never leaves a torn cache behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def get_tools(self, fingerprint: str):
+        entry = self.data["catalogs"].get(fingerprint)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [types.Tool.model_validate(tool) for tool in entry]
+
+    def put_tools(self, fingerprint: str, tools) -> None:
+        self.data["catalogs"][fingerprint] = [tool.model_dump(mode="json") for tool in tools]
+
+    def get_prompt(self, key: str) -> str | None:
+        return self.data["prompts"].get(key)
+
+    def put_prompt(self, key: str, prompt: str) -> None:
+        self.data["prompts"][key] = prompt
+
+
+def prompt_key(fingerprints: list[str], template: str) -> str:
+    """Key for a system prompt rendered from a given set of server catalogs
+
+    `template` should be the prompt rendered without any tools, so editing
+    the prompt text invalidates cached prompts too.
+    """
+    return hashlib.sha256("|".join(fingerprints + [template]).encode()).hexdigest()
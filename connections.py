@@ -0,0 +1,225 @@
+"""Concurrent startup of all configured MCP server connections"""
+import asyncio
+import functools
+import importlib.util
+import os
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from mcp.shared.memory import create_client_server_memory_streams
+
+from server_pool import ServerPool
+
+TRANSPORTS = ("stdio", "memory")
+
+# FastMCP instances loaded for in-process use, by script path
+_loaded_servers = {}
+
+
+class ServerConfig:
+    """How to launch one MCP server
+
+    With transport="stdio" (the default) the script is run as a subprocess.
+    With transport="memory" the script is imported and its module-level
+    FastMCP instance (`mcp`) is served on this event loop over in-memory
+    streams, skipping process startup, pipes and JSON framing; its sync
+    tools run in a worker thread so they cannot block the loop. With
+    pool_size > 1 (stdio only) that many processes are started as a
+    server_pool.ServerPool; `stateless_tools` may go to any of them.
+    """
+
+    def __init__(self, name: str, command: str, args: list[str], env: dict | None = None, transport: str = "stdio",
+                 pool_size: int = 1, stateless_tools=()):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport for {name}: {transport} (expected one of {TRANSPORTS})")
+        self.name = name
+        self.command = command
+        self.args = args
+        self.env = env
+        self.transport = transport
+        self.pool_size = pool_size
+        self.stateless_tools = stateless_tools
+
+    @property
+    def pooled(self) -> bool:
+        return self.transport == "stdio" and self.pool_size > 1
+
+    def params(self) -> StdioServerParameters:
+        return StdioServerParameters(command=self.command, args=self.args, env=self.env)
+
+    def client(self):
+        """Transport context yielding the (read, write) streams for a ClientSession"""
+        if self.transport == "memory":
+            return memory_client(load_server(self.args[0]))
+        return stdio_client(self.params())
+
+
+def load_server(script: str):
+    """Import a server script once and return its FastMCP instance"""
+    path = os.path.abspath(script)
+    if path not in _loaded_servers:
+        module_name = "inprocess_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        run_sync_tools_in_thread(module.mcp)
+        _loaded_servers[path] = module.mcp
+    return _loaded_servers[path]
+
+
+def run_sync_tools_in_thread(server) -> None:
+    """Make a FastMCP server's sync tools run in a worker thread, one at a time
+
+    FastMCP calls sync tools directly on the event loop. In-process that loop is
+    the agent's, so a slow tool (factorial, fibonacci_numbers) would stall every
+    other agent, LLM timeouts and the daemon socket. The lock keeps the tools
+    serialized, as they are in a single-threaded stdio server.
+    """
+    lock = threading.Lock()
+    for tool in server._tool_manager.list_tools():
+        if not tool.is_async:
+            tool.fn = _threaded(tool.fn, lock)
+            tool.is_async = True
+
+
+def _threaded(fn, lock):
+    def locked(**kwargs):
+        with lock:
+            return fn(**kwargs)
+
+    @functools.wraps(fn)
+    async def run(**kwargs):
+        return await anyio.to_thread.run_sync(functools.partial(locked, **kwargs))
+    return run
+
+
+@asynccontextmanager
+async def memory_client(server):
+    """In-process counterpart of stdio_client: runs the FastMCP server as a task on this loop"""
+    async with create_client_server_memory_streams() as (client_streams, server_streams):
+        lowlevel = server._mcp_server
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(lambda: lowlevel.run(
+                server_streams[0],
+                server_streams[1],
+                lowlevel.create_initialization_options(),
+                raise_exceptions=False,
+            ))
+            try:
+                yield client_streams
+            finally:
+                tg.cancel_scope.cancel()
+
+
+class ServerConnection:
+    """A live, initialized session to one server plus its tool catalog"""
+
+    def __init__(self, config: ServerConfig, session: ClientSession, launched_at: float):
+        self.config = config
+        self.name = config.name
+        self.session = session
+        self.tools = []
+        self.launched_at = launched_at
+        self.initialize_time = None
+        self.list_tools_time = None
+        self.startup_time = None
+        # Set once initialize() and list_tools() have completed
+        self.ready = asyncio.Event()
+
+
+class ConnectionManager:
+    """Launch and initialize N servers concurrently and expose them as one registry
+
+    Processes are spawned and sessions opened in this task (the transports'
+    task groups must be entered and exited by the same task), then every
+    `initialize()` + `list_tools()` handshake runs concurrently, so startup
+    takes as long as the slowest server rather than the sum of all of them.
+    """
+
+    def __init__(self, configs: list[ServerConfig], wait_for_ready: bool = True):
+        self.configs = configs
+        # With wait_for_ready=False, entering returns as soon as the processes are
+        # spawned and the handshakes continue in the background (see wait_ready)
+        self.wait_for_ready = wait_for_ready
+        self.connections: dict[str, ServerConnection] = {}
+        self.startup_time = None
+        self._started_at = None
+        self._init_task = None
+        self._stack = AsyncExitStack()
+
+    async def __aenter__(self) -> "ConnectionManager":
+        self._started_at = time.perf_counter()
+        try:
+            for config in self.configs:
+                launched_at = time.perf_counter()
+                if config.pooled:
+                    print(f"Starting a pool of {config.pool_size} {config.name} MCP servers...")
+                    session = await self._stack.enter_async_context(
+                        ServerPool(config, config.pool_size, stateless_tools=config.stateless_tools)
+                    )
+                else:
+                    print(f"Establishing connection to {config.name} MCP server ({config.transport})...")
+                    read, write = await self._stack.enter_async_context(config.client())
+                    session = await self._stack.enter_async_context(ClientSession(read, write))
+                self.connections[config.name] = ServerConnection(config, session, launched_at)
+
+            print("Sessions created, initializing...")
+            self._init_task = asyncio.create_task(self._initialize_all())
+            if self.wait_for_ready:
+                await self.wait_ready()
+        except BaseException:
+            await self._cancel_init()
+            await self._stack.aclose()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._cancel_init()
+        return await self._stack.__aexit__(*exc_info)
+
+    async def _cancel_init(self) -> None:
+        if self._init_task is not None and not self._init_task.done():
+            self._init_task.cancel()
+            try:
+                await self._init_task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def _initialize_all(self) -> None:
+        await asyncio.gather(*(self._initialize(conn) for conn in self.connections.values()))
+        self.startup_time = time.perf_counter() - self._started_at
+
+    async def wait_ready(self) -> None:
+        """Wait until every server is initialized, re-raising any startup failure"""
+        await asyncio.shield(self._init_task)
+
+    async def _initialize(self, conn: ServerConnection) -> None:
+        await conn.session.initialize()
+        conn.initialize_time = time.perf_counter() - conn.launched_at
+        tools_result = await conn.session.list_tools()
+        conn.tools = tools_result.tools
+        conn.startup_time = time.perf_counter() - conn.launched_at
+        conn.list_tools_time = conn.startup_time - conn.initialize_time
+        conn.ready.set()
+        print(f"Successfully retrieved {len(conn.tools)} tools from {conn.name}")
+
+    def __getitem__(self, name: str) -> ServerConnection:
+        return self.connections[name]
+
+    def __iter__(self):
+        return iter(self.connections.values())
+
+    def print_report(self) -> None:
+        print("\n=== Server Startup ===")
+        for conn in self:
+            print(f"{conn.name}: {conn.startup_time:.2f}s "
+                  f"(initialize {conn.initialize_time:.2f}s, list_tools {conn.list_tools_time:.2f}s, "
+                  f"{len(conn.tools)} tools)")
+            if isinstance(conn.session, ServerPool):
+                print(f"  {conn.session.report()}")
+        print(f"Total: {self.startup_time:.2f}s")
+        print("======================\n")
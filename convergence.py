@@ -0,0 +1,100 @@
+"""Detect agent runs that go in circles or stop making progress"""
+import hashlib
+import json
+
+
+def call_fingerprint(function: str, arguments, result_text: str) -> str:
+    payload = json.dumps([function, arguments, result_text], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class Verdict:
+    """Why the monitor tripped: kind is "cycle" or "stall" """
+
+    def __init__(self, kind: str, detail: str):
+        self.kind = kind
+        self.detail = detail
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+class ConvergenceMonitor:
+    """Watches one run's iterations for repeats, short cycles and no-progress streaks
+
+    Each iteration is reduced to a fingerprint of its (tool, arguments, result)
+    tuples. An iteration makes no progress when its fingerprint was seen
+    before (the same calls returned the same results again) or when the model
+    produced no usable action. The monitor trips on `max_stall` such
+    iterations in a row, or when the latest iterations repeat with a period of
+    up to `max_period` for `min_repeats` rounds.
+    """
+
+    def __init__(self, max_stall: int = 3, max_period: int = 3, min_repeats: int = 2):
+        self.max_stall = max_stall
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.seen: set[str] = set()
+        # Recent iterations as (fingerprint or None for a stalled step, readable label)
+        self.window: list[tuple[str | None, str]] = []
+        self.streak = 0
+        self.cycles = 0
+        self.stalls = 0
+        self.hints = 0
+        self.switched = False
+        self.aborted = False
+        # LLM calls not spent because the run was stopped or rerouted early
+        self.calls_saved = 0
+
+    @property
+    def tripped(self) -> bool:
+        return bool(self.cycles or self.stalls)
+
+    def observe_calls(self, calls) -> Verdict | None:
+        """Record one iteration's (function, arguments, result text) calls"""
+        fingerprint = "|".join(sorted(call_fingerprint(*call) for call in calls))
+        label = " + ".join(f"{function}({json.dumps(arguments, default=str)[:60]})" for function, arguments, _ in calls)
+        repeat = fingerprint in self.seen
+        self.seen.add(fingerprint)
+        self._push(fingerprint, label, progress=not repeat)
+        cycle = self._cycle()
+        if cycle is not None:
+            self.cycles += 1
+            return Verdict("cycle", f"Repeating {' -> '.join(cycle)} with the same results")
+        return self._check_streak(f"{label} returned the same result as before")
+
+    def observe_stall(self, reason: str) -> Verdict | None:
+        """Record an iteration that produced no usable action"""
+        self._push(None, reason, progress=False)
+        return self._check_streak(reason)
+
+    def _push(self, fingerprint, label, progress: bool) -> None:
+        self.window.append((fingerprint, label))
+        del self.window[:-self.max_period * self.min_repeats]
+        self.streak = 0 if progress else self.streak + 1
+
+    def _check_streak(self, last: str) -> Verdict | None:
+        if self.streak < self.max_stall:
+            return None
+        self.stalls += 1
+        return Verdict("stall", f"{self.streak} iterations without progress (last: {last})")
+
+    def _cycle(self) -> list[str] | None:
+        for period in range(1, self.max_period + 1):
+            span = period * self.min_repeats
+            if len(self.window) < span:
+                break
+            recent = [fingerprint for fingerprint, _ in self.window[-span:]]
+            if None not in recent and recent == recent[:period] * self.min_repeats:
+                return [label for _, label in self.window[-period:]]
+        return None
+
+    def reset(self) -> None:
+        """Start a fresh window after a corrective hint; fingerprints already seen still count as repeats"""
+        self.window.clear()
+        self.streak = 0
+
+    def stats(self) -> str:
+        outcome = "switched to plan mode" if self.switched else "aborted" if self.aborted else "continued"
+        return (f"{self.cycles} cycles, {self.stalls} stalls, {self.hints} hints, {outcome}, "
+                f"{self.calls_saved} LLM calls saved")
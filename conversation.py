@@ -0,0 +1,113 @@
+"""Multi-turn conversation state for the agent loop"""
+
+# Rough characters-per-token ratio used for budgeting; good enough to decide
+# when to compact, we never need an exact count here
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for a piece of text"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class Turn:
+    """A single turn of the conversation, stored exactly once"""
+
+    def __init__(self, role: str, text: str, kind: str, summary: str | None = None,
+                 parts: list[dict] | None = None, summary_parts: list[dict] | None = None):
+        self.role = role          # "user" or "model", as the Gemini API expects
+        self.text = text
+        self.kind = kind          # "query", "model", "tool_result", "error" or "note"
+        self.summary = summary    # compact replacement used once the turn is compacted
+        # Native function_call / function_response parts sent instead of the text
+        # (the text still counts for token budgeting)
+        self.parts = parts
+        self.summary_parts = summary_parts
+        self.compacted = False
+        self.tokens = estimate_tokens(text)
+
+    def to_content(self) -> dict:
+        parts = self.summary_parts if self.compacted and self.summary_parts else self.parts
+        return {"role": self.role, "parts": parts or [{"text": self.text}]}
+
+
+class CompactionPolicy:
+    """Summarize, then drop, old tool results once a token budget is passed"""
+
+    def __init__(self, max_tokens: int = 6000, keep_recent: int = 4):
+        self.max_tokens = max_tokens
+        # Number of most recent turns that are never touched
+        self.keep_recent = keep_recent
+
+    def apply(self, conversation: "ConversationState") -> None:
+        if conversation.total_tokens <= self.max_tokens:
+            return
+
+        turns = conversation.turns
+        cutoff = max(1, len(turns) - self.keep_recent)
+
+        # First pass: replace old tool results with their summaries
+        for turn in turns[1:cutoff]:
+            if conversation.total_tokens <= self.max_tokens:
+                return
+            if turn.kind == "tool_result" and not turn.compacted and turn.summary is not None:
+                conversation.replace_text(turn, turn.summary)
+                turn.compacted = True
+
+        # Second pass: drop the oldest model/user exchanges, keeping the query
+        # turn first so the roles keep alternating
+        while conversation.total_tokens > self.max_tokens and len(turns) - 1 > self.keep_recent + 1:
+            for turn in turns[1:3]:
+                conversation.total_tokens -= turn.tokens
+            del turns[1:3]
+            conversation.dropped_turns += 2
+
+
+class ConversationState:
+    """Structured conversation history sent to the model as multi-turn contents"""
+
+    def __init__(self, system_prompt: str, query: str, compaction: CompactionPolicy | None = None):
+        self.system_prompt = system_prompt
+        self.compaction = compaction
+        self.turns: list[Turn] = []
+        self.total_tokens = estimate_tokens(system_prompt)
+        self.dropped_turns = 0
+        self._append(Turn("user", f"Query: {query}", "query"))
+
+    def _append(self, turn: Turn) -> None:
+        self.turns.append(turn)
+        self.total_tokens += turn.tokens
+        if self.compaction is not None:
+            self.compaction.apply(self)
+
+    def set_system_prompt(self, system_prompt: str) -> None:
+        """Swap the system prompt, e.g. when the tool list shown to the model changes"""
+        self.total_tokens += estimate_tokens(system_prompt) - estimate_tokens(self.system_prompt)
+        self.system_prompt = system_prompt
+
+    def replace_text(self, turn: Turn, text: str) -> None:
+        """Swap the text of a turn, keeping the token total in sync"""
+        self.total_tokens -= turn.tokens
+        turn.text = text
+        turn.tokens = estimate_tokens(text)
+        self.total_tokens += turn.tokens
+
+    def add_model_response(self, text: str, parts: list[dict] | None = None) -> None:
+        self._append(Turn("model", text, "model", parts=parts))
+
+    def add_tool_result(self, text: str, summary: str | None = None, parts: list[dict] | None = None,
+                        summary_parts: list[dict] | None = None) -> None:
+        self._append(Turn("user", text, "tool_result", summary=summary, parts=parts, summary_parts=summary_parts))
+
+    def add_error(self, text: str) -> None:
+        self._append(Turn("user", text, "error"))
+
+    def add_user_message(self, text: str, parts: list[dict] | None = None) -> None:
+        self._append(Turn("user", text, "note", parts=parts))
+
+    def to_contents(self) -> list[dict]:
+        """Return the history in the Gemini `contents` format"""
+        return [turn.to_content() for turn in self.turns]
+
+    def __len__(self) -> int:
+        return len(self.turns)
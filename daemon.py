@@ -0,0 +1,174 @@
+"""Long-lived agent daemon: one warm set of MCP sessions serving many queries
+
+The daemon listens on a Unix socket and speaks newline-delimited JSON. A
+client sends one request line and reads events until the final one:
+
+    {"query": "..."}       -> {"event": "accepted", ...}, {"event": "llm_response", ...},
+                              {"event": "tool_result", ...}, ..., {"event": "final", ...}
+    {"command": "health"}  -> {"event": "health", "status": "ok", "active": 1, "queued": 0, ...}
+
+Start it with `python talk2mcp-2.py --serve`, then query it with
+`python daemon.py "Add 2 and 3"` or `python daemon.py --health`.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+DEFAULT_SOCKET = os.getenv("AGENT_SOCKET", os.path.join(".cache", "agent.sock"))
+
+
+class AgentDaemon:
+    """Accepts queries over a Unix socket and runs each as an isolated agent
+
+    `run_query(query, agent_id, emit)` runs one agent, calling
+    `emit(event, **data)` as it progresses, and returns the final summary.
+    At most `max_concurrent` agents run at once; further queries wait in the
+    queue, and beyond `max_queue` waiting queries new ones are rejected.
+    """
+
+    def __init__(self, run_query, socket_path=DEFAULT_SOCKET, max_concurrent=4, max_queue=64, health=None):
+        self.run_query = run_query
+        self.socket_path = socket_path
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.health_info = health
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.ids = itertools.count(1)
+        self.started_at = time.time()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.server = None
+
+    def health(self) -> dict:
+        info = {
+            "status": "ok",
+            "uptime": time.time() - self.started_at,
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+        if self.health_info is not None:
+            info.update(self.health_info())
+        return info
+
+    async def serve_forever(self) -> None:
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"Agent daemon listening on {self.socket_path} (max {self.max_concurrent} concurrent agents)")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle(self, reader, writer) -> None:
+        def send(event, **data):
+            if not writer.is_closing():
+                writer.write((json.dumps({"event": event, **data}, default=str) + "\n").encode())
+
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                request = None
+            if not isinstance(request, dict):
+                send("error", error="Request must be one JSON object per line")
+            elif request.get("command") == "health":
+                send("health", **self.health())
+            elif isinstance(request.get("query"), str) and request["query"].strip():
+                await self._run(request["query"], send)
+            else:
+                send("error", error='Expected {"query": "..."} or {"command": "health"}')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _run(self, query, send) -> None:
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            send("error", error=f"Queue full ({self.queued} waiting)")
+            return
+        agent_id = f"agent-{next(self.ids)}"
+        send("accepted", agent_id=agent_id, queue_depth=self.queued, active=self.active)
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            send("started", agent_id=agent_id)
+            summary = await self.run_query(query, agent_id, send)
+            self.completed += 1
+            send("final", agent_id=agent_id, **summary)
+        except Exception as e:
+            # One failing agent must not take the daemon down
+            self.failed += 1
+            send("final", agent_id=agent_id, final_answer=None, error=str(e) or type(e).__name__)
+        finally:
+            self.active -= 1
+            self.slots.release()
+
+
+async def request(message: dict, socket_path=DEFAULT_SOCKET):
+    """Send one request to a running daemon and yield its events"""
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+        while line := await reader.readline():
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+async def client_main(args) -> int:
+    message = {"command": "health"} if args.health else {"query": " ".join(args.query)}
+    status = 0
+    async for event in request(message, args.socket):
+        if args.json:
+            print(json.dumps(event))
+        elif event["event"] == "health":
+            print(json.dumps(event, indent=2))
+        elif event["event"] == "llm_response":
+            print(f"[{event['iteration']}] {event['text']}")
+        elif event["event"] == "tool_result":
+            print(f"[{event['iteration']}]   -> {event['text']}")
+        elif event["event"] == "stall":
+            print(f"[{event['iteration']}] no progress: {event['detail']}")
+        elif event["event"] == "final":
+            print(f"FINAL_ANSWER: {event.get('final_answer')}" if event.get("final_answer") is not None
+                  else f"Failed: {event.get('error')}")
+            status = 0 if event.get("final_answer") is not None else 1
+        elif event["event"] == "error":
+            print(f"Error: {event['error']}")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a query to a running agent daemon")
+    parser.add_argument("query", nargs="*", help="the query to run")
+    parser.add_argument("--health", action="store_true", help="print daemon health and queue depth")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="daemon socket path (AGENT_SOCKET)")
+    parser.add_argument("--json", action="store_true", help="print raw JSON events")
+    args = parser.parse_args()
+    if not args.health and not args.query:
+        parser.error("give a query or --health")
+    sys.exit(asyncio.run(client_main(args)))
@@ -5,6 +5,8 @@ from mcp.types import TextContent
 from mcp import types
 from PIL import Image as PILImage
 import math
+import json
+import numpy as np
 import sys
 import subprocess
 import time
@@ -30,7 +32,7 @@ def add(a: int, b: int) -> int:
     return int(a + b)
 
 @mcp.tool()
-def add_list(l: list) -> int:
+def add_list(l: list[int]) -> int:
     """Add all numbers in a list"""
     print("CALLED: add(l: list) -> int:")
     return sum(l)
@@ -141,7 +143,7 @@ def strings_to_chars_to_int(string: str) -> list[int]:
     return [int(ord(char)) for char in string]
 
 @mcp.tool()
-def int_list_to_exponential_sum(int_list: list) -> float:
+def int_list_to_exponential_sum(int_list: list[int]) -> float:
     """Return sum of exponentials of numbers in a list"""
     print("CALLED: int_list_to_exponential_sum(int_list: list) -> float:")
     return sum(math.exp(i) for i in int_list)
@@ -157,6 +159,129 @@ def fibonacci_numbers(n: int) -> list:
         fib_sequence.append(fib_sequence[-1] + fib_sequence[-2])
     return fib_sequence[:n]
 
+# Element-wise operations for batch_apply: name -> (number of array arguments, numpy function)
+BATCH_OPERATIONS = {
+    "add": (2, np.add),
+    "subtract": (2, np.subtract),
+    "multiply": (2, np.multiply),
+    "divide": (2, np.true_divide),
+    "power": (2, np.power),
+    "remainder": (2, np.remainder),
+    "mine": (2, lambda a, b: a - b - b),
+    "sqrt": (1, np.sqrt),
+    "cbrt": (1, np.cbrt),
+    "log": (1, np.log),
+    "sin": (1, np.sin),
+    "cos": (1, np.cos),
+    "tan": (1, np.tan),
+    "exp": (1, np.exp),
+}
+# Operations that keep integers integral; their results are exact, beyond int64 if needed
+INTEGER_OPERATIONS = {"add", "subtract", "multiply", "power", "remainder", "mine"}
+# Exact integer powers with larger exponents are refused rather than left to run for minutes
+MAX_EXACT_EXPONENT = 10000
+
+def _batch_array(value, name):
+    array = np.atleast_1d(np.asarray(value if value is not None else [], dtype=object))
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in array):
+        raise ValueError(f"{name} must be a number or a list of numbers")
+    if all(isinstance(v, int) for v in array):
+        # Fits int64 unless some value is huge; those stay Python ints (object dtype)
+        try:
+            return array.astype(np.int64)
+        except OverflowError:
+            return array
+    return array.astype(np.float64)
+
+def _as_float(array):
+    """float64 copy of an input array, and a mask of integers too large for a float"""
+    too_large = np.zeros(array.shape, dtype=bool)
+    if array.dtype != object:
+        return array.astype(np.float64), too_large
+    values = np.ones(array.shape, dtype=np.float64)
+    for index, value in enumerate(array.flat):
+        try:
+            values.flat[index] = float(value)
+        except OverflowError:
+            too_large.flat[index] = True
+    return values, too_large
+
+@mcp.tool()
+def batch_apply(operation: str, a: Union[int, float, List[Union[int, float]]],
+                b: Union[int, float, List[Union[int, float]], None] = None) -> TextContent:
+    """Apply one operation element-wise over lists in one call: add, subtract, multiply, divide, power, remainder, mine (a, b) or sqrt, cbrt, log, sin, cos, tan, exp (a only). A single number is broadcast; failed elements are null in values and listed in errors"""
+    print("CALLED: batch_apply(operation: str, a: list, b: list) -> TextContent:")
+    if operation not in BATCH_OPERATIONS:
+        raise ValueError(f"Unknown operation {operation!r}; expected one of {', '.join(BATCH_OPERATIONS)}")
+    arity, func = BATCH_OPERATIONS[operation]
+    if arity == 2 and b is None:
+        raise ValueError(f"{operation} needs two arguments, a and b")
+    if arity == 1 and b is not None:
+        raise ValueError(f"{operation} takes only a")
+    arrays = [_batch_array(a, "a")] + ([_batch_array(b, "b")] if arity == 2 else [])
+    try:
+        arrays = list(np.broadcast_arrays(*arrays))
+    except ValueError:
+        raise ValueError(f"Cannot broadcast lists of lengths {[len(x) for x in arrays]}; "
+                         "use equal lengths or a single number")
+
+    integral = operation in INTEGER_OPERATIONS and all(x.dtype != np.float64 for x in arrays)
+    if integral and operation == "power" and (arrays[1] < 0).any():
+        integral = False
+
+    # Elements that cannot be computed are reported, then swapped for a harmless input;
+    # the first reason found for an element wins
+    errors = {}
+    invalid = np.zeros(arrays[0].shape, dtype=bool)
+
+    def fail(mask, message):
+        mask = np.asarray(mask, dtype=bool)
+        for index in np.flatnonzero(mask & ~invalid):
+            errors[int(index)] = message
+        invalid[mask] = True
+
+    if not integral:
+        converted = [_as_float(x) for x in arrays]
+        arrays = [values for values, _ in converted]
+        for _, too_large in converted:
+            fail(too_large, "integer too large to convert to float")
+        for x in arrays:
+            fail(~np.isfinite(x), "input is not a finite number")
+    x, y = arrays[0], arrays[-1]
+    if operation in ("divide", "remainder"):
+        fail(y == 0, "division by zero")
+    elif operation in ("log", "sqrt"):
+        fail(x <= 0 if operation == "log" else x < 0, "math domain error")
+    elif operation == "power" and integral:
+        fail(np.abs(y) > MAX_EXACT_EXPONENT, "exponent too large for an exact result")
+    elif operation == "power":
+        fail((x == 0) & (y < 0), "division by zero")
+        fail((x < 0) & (y != np.floor(y)), "math domain error")
+    if invalid.any():
+        arrays = [np.where(invalid, 1, x).astype(x.dtype) for x in arrays]
+
+    with np.errstate(all="ignore"):
+        values = func(*arrays)
+        if integral and values.dtype == np.int64:
+            # int64 wrapped around somewhere: redo the batch with exact Python integers
+            approx = func(*(x.astype(np.float64) for x in arrays))
+            if (np.abs(approx) >= 2.0 ** 62).any():
+                values = func(*(x.astype(object) for x in arrays))
+    if not integral:
+        # Inputs were checked above, so what is still not finite is a result too large for a float
+        fail(~np.isfinite(values), "overflow")
+
+    values = values.astype(object)
+    values[invalid] = None
+    result = {
+        "operation": operation,
+        "dtype": "int" if integral else "float",
+        "count": int(values.size),
+        "values": values.tolist(),
+        "errors": [{"index": index, "error": message} for index, message in sorted(errors.items())],
+    }
+    return TextContent(type="text", text=json.dumps(result, separators=(",", ":")))
+
 
 @mcp.tool()
 async def draw_rectangle(x1: int, y1: int, x2: int, y2: int) -> dict:
@@ -0,0 +1,47 @@
+"""Offline stand-in for server.py: same Gmail tools, no OAuth or network"""
+from mcp.server.fastmcp import FastMCP
+
+mcp = FastMCP("Gmail Assistant")
+
+# Messages "sent" during this process, newest last
+sent_messages = []
+
+@mcp.tool()
+async def send_email(recipient_id: str, subject: str, message: str) -> dict:
+    """Send an email to a recipient"""
+    sent_messages.append({"to": recipient_id, "subject": subject, "content": message})
+    return {"status": "success", "message_id": f"fake-{len(sent_messages)}"}
+
+@mcp.tool()
+async def get_unread_emails() -> list[dict[str, str]] | str:
+    """Get list of unread emails"""
+    return [{"id": "fake-unread-1", "threadId": "fake-thread-1"}]
+
+@mcp.tool()
+async def read_email(email_id: str) -> dict[str, str] | str:
+    """Read contents of a specific email"""
+    return {
+        "content": "This is a fake email.",
+        "subject": "Fake email",
+        "from": "sender@example.com",
+        "to": "me@example.com",
+        "date": "Thu, 1 Jan 2026 00:00:00 +0000",
+    }
+
+@mcp.tool()
+async def trash_email(email_id: str) -> str:
+    """Move an email to trash"""
+    return "Email moved to trash successfully."
+
+@mcp.tool()
+async def open_email(email_id: str) -> str:
+    """Open an email in the browser"""
+    return "Email opened in browser successfully."
+
+@mcp.tool()
+async def mark_email_as_read(email_id: str) -> str:
+    """Mark an email as read"""
+    return "Email marked as read."
+
+if __name__ == "__main__":
+    mcp.run()
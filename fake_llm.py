@@ -0,0 +1,101 @@
+"""Scripted stand-in for genai.Client, for running the agent offline"""
+import asyncio
+import time
+
+from function_calling import calls_to_text
+
+
+class FakeFunctionCall:
+    def __init__(self, name: str, args: dict | None = None):
+        self.name = name
+        self.args = args or {}
+
+
+class FakeResponse:
+    """Minimal generate_content response, with text or native function calls"""
+
+    def __init__(self, text: str | None, function_calls: list[FakeFunctionCall] | None = None):
+        self.text = text
+        self.function_calls = function_calls
+
+
+def _response(result) -> FakeResponse:
+    """Script results are text, or a list of {"name": ..., "args": {...}} native function calls"""
+    if isinstance(result, str):
+        return FakeResponse(result)
+    return FakeResponse(None, [FakeFunctionCall(call["name"], call.get("args")) for call in result])
+
+
+class FakeModels:
+    """Serves scripted responses through the sync and async model surfaces"""
+
+    def __init__(self, script, latency: float | dict = 0.0, chunk_size: int = 8, chunk_delay: float = 0.0):
+        # `script` is either a list of responses, served in order (the last one
+        # repeats), or a callable taking the request contents and returning one.
+        # A response is text, or a list of {"name", "args"} dicts for native calls.
+        # `latency` is seconds per call, or {model: seconds} with "*" as the fallback
+        self.script = script
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.calls_by_model = {}
+        self.requests = []
+        # generate_content configs, e.g. to check the function declarations sent
+        self.configs = []
+
+    def latency_for(self, model) -> float:
+        if isinstance(self.latency, dict):
+            return self.latency.get(model, self.latency.get("*", 0.0))
+        return self.latency
+
+    def _next_text(self, model, contents, config=None):
+        self.calls += 1
+        self.configs.append(config)
+        self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+        self.requests.append((model, contents))
+        if callable(self.script):
+            return self.script(contents)
+        return self.script[min(self.calls, len(self.script)) - 1]
+
+    def generate_content(self, *, model, contents, config=None):
+        time.sleep(self.latency_for(model))
+        return _response(self._next_text(model, contents, config))
+
+    async def agenerate_content(self, *, model, contents, config=None):
+        await asyncio.sleep(self.latency_for(model))
+        return _response(self._next_text(model, contents, config))
+
+    async def agenerate_content_stream(self, *, model, contents, config=None):
+        text = self._next_text(model, contents, config)
+        if not isinstance(text, str):
+            text = calls_to_text((call["name"], call.get("args", {})) for call in text)
+        # The first chunk pays the request latency, the rest only chunk_delay
+
+        async def chunks():
+            await asyncio.sleep(self.latency_for(model))
+            for i in range(0, len(text), self.chunk_size):
+                if i:
+                    await asyncio.sleep(self.chunk_delay)
+                yield FakeResponse(text[i:i + self.chunk_size])
+
+        return chunks()
+
+
+class FakeAsyncModels:
+    def __init__(self, models: FakeModels):
+        self.generate_content = models.agenerate_content
+        self.generate_content_stream = models.agenerate_content_stream
+
+
+class FakeAio:
+    def __init__(self, models: FakeModels):
+        self.models = FakeAsyncModels(models)
+
+
+class FakeClient:
+    """Drop-in for genai.Client exposing client.models and client.aio.models"""
+
+    def __init__(self, script, latency: float | dict = 0.0, chunk_size: int = 8, chunk_delay: float = 0.0):
+        self.models = FakeModels(script, latency, chunk_size, chunk_delay)
+        self.aio = FakeAio(self.models)
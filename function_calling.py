@@ -0,0 +1,119 @@
+"""Native function calling: MCP tool schemas as Gemini function declarations
+
+Tool calls come back as structured `function_call` parts instead of a
+FUNCTION_CALL: line the agent has to parse. They are normalized to canonical
+FUNCTION_CALL: lines (generated with json.dumps, so always valid JSON), which
+keeps the response cache, the run journal and loop detection working on text.
+The conversation itself sends the calls and their results back as
+`function_call` / `function_response` parts.
+"""
+import json
+
+# JSON Schema keywords Gemini's Schema understands, under their Gemini names
+_SCHEMA_KEYS = {
+    "description": "description",
+    "enum": "enum",
+    "format": "format",
+    "minimum": "minimum",
+    "maximum": "maximum",
+    "minItems": "min_items",
+    "maxItems": "max_items",
+    "nullable": "nullable",
+    "required": "required",
+}
+
+
+def gemini_schema(schema: dict) -> dict:
+    """Translate an MCP inputSchema (JSON Schema) into a Gemini Schema dict
+
+    Types are upper-cased, titles and defaults dropped, `["x", "null"]` types
+    become nullable, and items without a type (e.g. `list` parameters) are
+    taken as strings.
+    """
+    result = {}
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        types = [t for t in schema_type if t != "null"]
+        if len(types) < len(schema_type):
+            result["nullable"] = True
+        schema_type = types[0] if types else None
+    any_of = [option for option in schema.get("anyOf", []) if option.get("type") != "null"]
+    if len(any_of) < len(schema.get("anyOf", [])):
+        result["nullable"] = True
+    if schema_type is None and len(any_of) == 1:
+        return {**gemini_schema(any_of[0]), **result}
+    if schema_type is not None:
+        result["type"] = schema_type.upper()
+    elif any_of:
+        result["any_of"] = [gemini_schema(option) for option in any_of]
+    else:
+        result["type"] = "STRING"
+    for key, gemini_key in _SCHEMA_KEYS.items():
+        if key in schema:
+            result[gemini_key] = schema[key]
+    if "properties" in schema:
+        result["properties"] = {name: gemini_schema(prop) for name, prop in schema["properties"].items()}
+    if "items" in schema:
+        result["items"] = gemini_schema(schema["items"] or {"type": "string"})
+    return result
+
+
+def function_declarations(tools) -> list[dict]:
+    """One function declaration per MCP tool"""
+    declarations = []
+    for tool in tools:
+        declaration = {"name": tool.name, "description": getattr(tool, "description", "") or ""}
+        schema = getattr(tool, "inputSchema", None) or {}
+        # Gemini rejects OBJECT parameters without properties; parameterless tools omit them
+        if schema.get("properties"):
+            declaration["parameters"] = gemini_schema(schema)
+        declarations.append(declaration)
+    return declarations
+
+
+def response_calls(response) -> list[tuple[str, dict]]:
+    """(name, arguments) of the function_call parts in a generate_content response"""
+    calls = getattr(response, "function_calls", None) or []
+    return [(call.name, dict(call.args or {})) for call in calls]
+
+
+def response_text(response) -> str:
+    """Plain text parts of a response, without the SDK's warning about non-text parts"""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return getattr(response, "text", None) or ""
+    parts = getattr(candidates[0].content, "parts", None) or []
+    return "".join(part.text for part in parts if getattr(part, "text", None))
+
+
+def calls_to_text(calls) -> str:
+    """Canonical FUNCTION_CALL: lines for structured calls"""
+    return "\n".join(
+        f"FUNCTION_CALL: {json.dumps({'function': name, 'parameters': arguments}, default=str)}"
+        for name, arguments in calls
+    )
+
+
+def model_call_parts(calls) -> list[dict]:
+    return [{"function_call": {"name": name, "args": arguments}} for name, arguments in calls]
+
+
+def function_response_parts(names, texts, note: str | None = None) -> list[dict]:
+    """Tool results as function_response parts, optionally followed by a text note"""
+    parts = [{"function_response": {"name": name, "response": {"result": text}}} for name, text in zip(names, texts)]
+    if note:
+        parts.append({"text": note})
+    return parts
+
+
+class StructuredResponse:
+    """A native function-calling response seen through the text protocol
+
+    `text` holds the canonical FUNCTION_CALL: lines when the model called
+    functions, otherwise its text (e.g. FINAL_ANSWER: [..]).
+    """
+
+    def __init__(self, response):
+        self.function_calls = response_calls(response)
+        self.text = calls_to_text(self.function_calls) if self.function_calls else response_text(response)
+        self.usage_metadata = getattr(response, "usage_metadata", None)
@@ -0,0 +1,238 @@
+"""Append-only per-run journal of LLM responses and tool results, for resuming crashed runs
+
+Each agent run writes one JSON line per event to <dir>/<run_id>.jsonl: a
+start record with the query, every model response (with a hash of the
+prompt it answered) and every tool result, and an end record. Lines are
+flushed to the OS as they are written, so a crashed process loses nothing;
+fsync is batched to at most one per `fsync_interval` seconds and runs off
+the event loop.
+
+Resuming loads the journal and replays it: model responses whose prompt
+hash still matches, and tool results for the same call, are served from the
+journal instead of being requested again. The first miss ends the replay,
+and the run continues live, appending to the same file.
+
+Journals only matter until their run has completed: callers discard them
+then, and `create` prunes the directory to the newest `max_runs` journals
+so crashed or kept runs cannot fill the disk.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from collections import defaultdict, deque
+
+from mcp import types
+
+
+def new_run_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+
+
+def prompt_hash(contents, system_instruction=None) -> str:
+    """Fingerprint of a full request, to check a replayed response still answers the same prompt"""
+    payload = json.dumps([system_instruction, contents], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def prune_journals(directory: str, keep: int) -> int:
+    """Delete all but the `keep` most recently written journals in `directory`; returns how many went"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".jsonl") and entry.is_file()]
+    except FileNotFoundError:
+        return 0
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    removed = 0
+    for entry in entries[max(keep, 0):]:
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _call_key(iteration: int, function: str, arguments) -> str:
+    return f"{iteration}:{function}:{json.dumps(arguments, sort_keys=True, default=str)}"
+
+
+class ReplayedResponse:
+    """Stands in for a model response read back from the journal"""
+
+    cached = False
+    replayed = True
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class RunJournal:
+    def __init__(self, path: str, run_id: str, fsync_interval: float = 0.5):
+        self.path = path
+        self.run_id = run_id
+        self.fsync_interval = fsync_interval
+        self.header = {}
+        self.records = 0
+        self.syncs = 0
+        self._file = None
+        self._sync_handle = None
+        # Recorded steps still to be replayed
+        self.responses: dict[int, dict] = {}
+        self.tool_results: dict[str, deque] = defaultdict(deque)
+        self.replaying = False
+        self.replayed_responses = 0
+        self.replayed_tools = 0
+        self.discarded = False
+
+    @classmethod
+    def create(cls, directory: str, query: str, mode: str, max_runs: int = 0, **kwargs) -> "RunJournal":
+        """Start a new run's journal; with max_runs > 0, older journals beyond that many are deleted"""
+        os.makedirs(directory, exist_ok=True)
+        if max_runs > 0:
+            prune_journals(directory, max_runs - 1)
+        run_id = new_run_id()
+        journal = cls(os.path.join(directory, f"{run_id}.jsonl"), run_id, **kwargs)
+        journal.header = {"type": "start", "run_id": run_id, "query": query, "mode": mode, "time": time.time()}
+        journal.append(journal.header)
+        return journal
+
+    @classmethod
+    def load(cls, directory: str, run_id: str, **kwargs) -> "RunJournal":
+        """Open an existing run's journal for replay; later records are appended to it"""
+        journal = cls(os.path.join(directory, f"{run_id}.jsonl"), run_id, **kwargs)
+        if not os.path.exists(journal.path):
+            raise FileNotFoundError(f"No journal for run {run_id} in {directory}")
+        with open(journal.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by the crash; everything before it is intact
+                    break
+                kind = record.get("type")
+                if kind == "start" and not journal.header:
+                    journal.header = record
+                elif kind == "llm":
+                    journal.responses[record["iteration"]] = record
+                elif kind == "tool":
+                    key = _call_key(record["iteration"], record["function"], record["arguments"])
+                    journal.tool_results[key].append(record["result"])
+        if not journal.header:
+            raise ValueError(f"Journal {journal.path} has no start record")
+        journal.replaying = bool(journal.responses or journal.tool_results)
+        return journal
+
+    @property
+    def query(self) -> str:
+        return self.header.get("query")
+
+    @property
+    def mode(self) -> str:
+        return self.header.get("mode", "loop")
+
+    def append(self, record: dict) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        self.records += 1
+        self._schedule_sync()
+
+    def _schedule_sync(self) -> None:
+        if self._sync_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or self.fsync_interval <= 0:
+            self._fsync()
+            return
+        self._sync_handle = loop.call_later(self.fsync_interval, self._sync_in_background, loop)
+
+    def _sync_in_background(self, loop) -> None:
+        self._sync_handle = None
+        if self._file is not None:
+            future = loop.run_in_executor(None, self._fsync)
+            # A sync racing with close() fails harmlessly; close() syncs itself
+            future.add_done_callback(lambda f: f.exception())
+
+    def _fsync(self) -> None:
+        file = self._file
+        if file is not None:
+            os.fsync(file.fileno())
+            self.syncs += 1
+
+    def record_response(self, iteration: int, contents, system_instruction, text: str, step_type: str) -> None:
+        self.append({
+            "type": "llm",
+            "iteration": iteration,
+            "step_type": step_type,
+            "prompt_hash": prompt_hash(contents, system_instruction),
+            "response": text,
+        })
+
+    def record_tool(self, iteration: int, function: str, arguments, result) -> None:
+        self.append({
+            "type": "tool",
+            "iteration": iteration,
+            "function": function,
+            "arguments": arguments,
+            "result": result.model_dump(mode="json") if hasattr(result, "model_dump") else str(result),
+        })
+
+    def replayed_response(self, iteration: int, contents, system_instruction) -> ReplayedResponse | None:
+        """The recorded response for this step, or None (ending the replay) if there is none or the prompt changed"""
+        if not self.replaying:
+            return None
+        record = self.responses.pop(iteration, None)
+        if record is None or record["prompt_hash"] != prompt_hash(contents, system_instruction):
+            self.replaying = False
+            return None
+        self.replayed_responses += 1
+        return ReplayedResponse(record["response"])
+
+    def replayed_tool(self, iteration: int, function: str, arguments):
+        """The recorded result of this exact call in this step, or None to run it live"""
+        if not self.replaying:
+            return None
+        recorded = self.tool_results.get(_call_key(iteration, function, arguments))
+        if not recorded:
+            return None
+        self.replayed_tools += 1
+        result = recorded.popleft()
+        if isinstance(result, dict):
+            return types.CallToolResult.model_validate(result)
+        return types.CallToolResult(content=[types.TextContent(type="text", text=result)])
+
+    def finish(self, final_answer=None, error=None, llm_calls=0) -> None:
+        self.append({"type": "end", "final_answer": final_answer, "error": error, "llm_calls": llm_calls,
+                     "replayed": self.replayed_responses, "time": time.time()})
+        self.close()
+
+    def discard(self) -> None:
+        """Close and delete the journal, once its run has completed and needs no resuming"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.discarded = True
+
+    def close(self) -> None:
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self._file is not None:
+            self._file.flush()
+            self._fsync()
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> str:
+        replayed = (f", replayed {self.replayed_responses} responses and {self.replayed_tools} tool results"
+                    if self.replayed_responses or self.replayed_tools else "")
+        deleted = ", deleted after completing" if self.discarded else ""
+        return f"{self.records} records, {self.syncs} fsyncs{replayed}{deleted}"
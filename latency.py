@@ -0,0 +1,79 @@
+"""Latency tracking, retry/hedge budgets and backoff for LLM requests"""
+import math
+import random
+from collections import deque
+
+from google.genai import errors as genai_errors
+
+
+def percentile(values, pct: float) -> float | None:
+    """Nearest-rank percentile of a collection of numbers, None when it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class LatencyWindow:
+    """Rolling window of recent request latencies with percentile lookups"""
+
+    def __init__(self, size: int = 200, min_samples: int = 10):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    @property
+    def ready(self) -> bool:
+        """Whether there are enough samples for percentiles to mean anything"""
+        return len(self.samples) >= self.min_samples
+
+    def percentile(self, pct: float) -> float | None:
+        return percentile(self.samples, pct)
+
+    def histogram(self, edges=(0.25, 0.5, 1, 2, 4, 8)) -> dict[str, int]:
+        """Counts per latency bucket, e.g. {"<=0.5s": 12, ">8s": 1}"""
+        counts = {f"<={edge}s": 0 for edge in edges}
+        counts[f">{edges[-1]}s"] = 0
+        for sample in self.samples:
+            bucket = next((f"<={edge}s" for edge in edges if sample <= edge), f">{edges[-1]}s")
+            counts[bucket] += 1
+        return counts
+
+
+class RequestBudget:
+    """Retries and hedged duplicates one agent run may spend"""
+
+    def __init__(self, max_retries: int = 2, max_hedges: int = 2):
+        self.max_retries = max_retries
+        self.max_hedges = max_hedges
+        self.retries = 0
+        self.hedges = 0
+
+    def take_retry(self) -> bool:
+        if self.retries >= self.max_retries:
+            return False
+        self.retries += 1
+        return True
+
+    def take_hedge(self) -> bool:
+        if self.hedges >= self.max_hedges:
+            return False
+        self.hedges += 1
+        return True
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, dropped connections, rate limits and server errors are worth another try"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, genai_errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return False
@@ -0,0 +1,347 @@
+"""LLM generation helpers for the agent loop"""
+import asyncio
+import json
+import time
+
+from function_calling import StructuredResponse
+from latency import LatencyWindow, backoff_delay, is_retryable
+from llm_cache import CacheMissError, CachedResponse, request_key
+from scheduler import current_request_context, estimate_request_tokens
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+ACTION_PREFIXES = ("FUNCTION_CALL:", "FINAL_ANSWER:")
+
+
+class ActionLineParser:
+    """Incrementally find the first complete FUNCTION_CALL:/FINAL_ANSWER: line in a stream"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.action = None
+
+    def feed(self, chunk: str) -> str | None:
+        """Add a chunk of model output, returning the action line once it is complete"""
+        if self.action is not None:
+            return self.action
+        self.buffer += chunk
+        lines = self.buffer.split("\n")
+        # Every line but the last is terminated by a newline and therefore complete
+        for line in lines[:-1]:
+            line = line.strip()
+            if line.startswith(ACTION_PREFIXES):
+                self.action = line
+                return self.action
+        # The last line is still open; it may already be complete though
+        tail = lines[-1].strip()
+        if self._is_complete(tail):
+            self.action = tail
+        return self.action
+
+    def finish(self) -> str | None:
+        """Flush at end of stream, accepting an unterminated action line"""
+        if self.action is None:
+            for line in self.buffer.split("\n"):
+                line = line.strip()
+                if line.startswith(ACTION_PREFIXES):
+                    self.action = line
+                    break
+        return self.action
+
+    @staticmethod
+    def _is_complete(line: str) -> bool:
+        if line.startswith("FUNCTION_CALL:"):
+            payload = line[len("FUNCTION_CALL:"):].strip()
+            if not payload.endswith("}"):
+                return False
+            try:
+                json.loads(payload)
+                return True
+            except json.JSONDecodeError:
+                return False
+        if line.startswith("FINAL_ANSWER:"):
+            return _brackets_closed(line[len("FINAL_ANSWER:"):].strip())
+        return False
+
+
+def _brackets_closed(answer: str) -> bool:
+    """True when the answer's opening "[" is closed by its last character
+
+    A "]" inside the answer (e.g. a nested list) arriving at a chunk boundary
+    does not end it early.
+    """
+    if not answer.startswith("[") or not answer.endswith("]"):
+        return False
+    depth = 0
+    for i, char in enumerate(answer):
+        depth += {"[": 1, "]": -1}.get(char, 0)
+        if depth == 0:
+            return i == len(answer) - 1
+    return False
+
+
+class StreamedResponse:
+    """Result of a streamed generation, shaped like a generate_content response"""
+
+    def __init__(self, text: str, full_text: str, chunks: int, cut_off: bool, time_to_action: float | None):
+        # `text` is the action line when one was found, otherwise everything streamed
+        self.text = text
+        self.full_text = full_text
+        self.chunks = chunks
+        self.cut_off = cut_off
+        self.time_to_action = time_to_action
+
+
+def generation_config(system_instruction=None, tools=None):
+    """Build the generate_content config for a request; `tools` are function declarations"""
+    config = {}
+    if system_instruction:
+        config["system_instruction"] = system_instruction
+    if tools:
+        config["tools"] = [{"function_declarations": tools}]
+        config["tool_config"] = {"function_calling_config": {"mode": "AUTO"}}
+    return config or None
+
+
+async def generate_streaming(client, contents, system_instruction=None, model=DEFAULT_MODEL):
+    """Stream a generation and stop as soon as one complete action line has arrived"""
+    start = time.perf_counter()
+    parser = ActionLineParser()
+    stream = await client.aio.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=generation_config(system_instruction)
+    )
+    chunks = 0
+    cut_off = False
+    try:
+        async for chunk in stream:
+            chunks += 1
+            if parser.feed(chunk.text or "") is not None:
+                cut_off = True
+                break
+    finally:
+        # Cancel the rest of the stream; nothing after the action line is used
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+
+    action = parser.finish()
+    time_to_action = time.perf_counter() - start if action is not None else None
+    if cut_off:
+        print(f"Action line received after {chunks} chunks ({time_to_action:.2f}s), stream cancelled")
+    return StreamedResponse(action or parser.buffer, parser.buffer, chunks, cut_off, time_to_action)
+
+
+class AsyncLLM:
+    """Async generation layer with bounded concurrency and per-call deadlines
+
+    Calls go through the native async client (`client.aio`), so a timed-out
+    request is cancelled instead of leaving a worker thread blocked on it.
+
+    With `adaptive=True` the timeout follows each model's observed latency (p99 times
+    `timeout_multiplier`, between `min_timeout` and `timeout`), and calls
+    made with a latency.RequestBudget fire a hedged duplicate once they run
+    past the p95 and retry retryable failures with jittered backoff.
+    """
+
+    def __init__(self, client, model: str = DEFAULT_MODEL, max_concurrency: int = 8, timeout: float = 10.0,
+                 cache=None, scheduler=None, adaptive: bool = True, min_timeout: float = 1.0, timeout_multiplier: float = 3.0,
+                 hedge_percentile: float = 95):
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.min_timeout = min_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge_percentile = hedge_percentile
+        # Rolling latency window per model name
+        self.latencies: dict[str, LatencyWindow] = {}
+        # Optional llm_cache.ResponseCache consulted before any request is made
+        self.cache = cache
+        # Optional scheduler.RequestScheduler every actual request (hedges and retries too) goes through
+        self.scheduler = scheduler
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives belong to one event loop; make a fresh one per loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def latency(self, model=None) -> LatencyWindow:
+        model = model or self.model
+        if model not in self.latencies:
+            self.latencies[model] = LatencyWindow()
+        return self.latencies[model]
+
+    def current_timeout(self, model=None) -> float:
+        """Per-attempt timeout: fixed until enough latencies are known, then from the p99"""
+        window = self.latency(model)
+        if not self.adaptive or not window.ready:
+            return self.timeout
+        return max(self.min_timeout, min(self.timeout, window.percentile(99) * self.timeout_multiplier))
+
+    def hedge_delay(self, model=None) -> float | None:
+        window = self.latency(model)
+        if not self.adaptive or not window.ready:
+            return None
+        return window.percentile(self.hedge_percentile)
+
+    def stats(self) -> str:
+        parts = []
+        for model, window in self.latencies.items():
+            p50, p95, p99 = (window.percentile(p) for p in (50, 95, 99))
+            if p50 is not None:
+                parts.append(f"{model} p50 {p50:.2f}s, p95 {p95:.2f}s, p99 {p99:.2f}s, "
+                             f"timeout {self.current_timeout(model):.2f}s; ")
+        return (f"{''.join(parts)}{self.timeouts} timeouts, "
+                f"{self.retries} retries, {self.hedges} hedges ({self.hedge_wins} won)")
+
+    async def generate(self, contents, system_instruction=None, timeout=None, deadline=None, stream=False, model=None,
+                       budget=None, use_cache=True, tools=None):
+        """Generate a response, raising TimeoutError once the call's time is up
+
+        `timeout` bounds each attempt (adaptive when None); `deadline` is an
+        absolute event-loop time that also covers waiting for a concurrency
+        slot, retries and backoff. `budget` (a latency.RequestBudget shared by
+        one agent run) enables hedging and retries. `use_cache=False` skips
+        the response cache for this call. With `tools` (function declarations)
+        the model may answer with native function calls; the response is a
+        function_calling.StructuredResponse and is never streamed.
+        """
+        loop = asyncio.get_running_loop()
+        model = model or self.model
+        if tools:
+            stream = False
+
+        key = None
+        if use_cache and self.cache is not None and self.cache.enabled:
+            key = request_key(model, contents, system_instruction, tools, stream)
+            text = self.cache.get(key)
+            if text is not None:
+                return CachedResponse(text)
+            if self.cache.mode == "replay":
+                raise CacheMissError(f"No recorded response for request {key[:12]} (replay mode)")
+
+        attempt = 0
+        while True:
+            attempt_timeout = self.current_timeout(model) if timeout is None else timeout
+            try:
+                response = await self._hedged(
+                    contents, system_instruction, attempt_timeout, deadline, stream, model, loop, budget, tools
+                )
+                break
+            except Exception as e:
+                if budget is None or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                if deadline is not None and loop.time() + delay >= deadline:
+                    raise
+                if not budget.take_retry():
+                    raise
+                attempt += 1
+                self.retries += 1
+                print(f"LLM request failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        if key is not None and response.text is not None:
+            self.cache.put(key, response.text, model=model)
+        return response
+
+    async def _hedged(self, contents, system_instruction, timeout, deadline, stream, model, loop, budget, tools=None):
+        """Run one request; past the hedge delay, race a duplicate and keep the first success"""
+        args = (contents, system_instruction, timeout, deadline, stream, model, loop, tools)
+        hedge_after = self.hedge_delay(model) if budget is not None else None
+        if hedge_after is None or hedge_after >= timeout:
+            return await self._generate(*args)
+
+        sent = asyncio.Event()
+        primary = asyncio.create_task(self._generate(*args, sent=sent))
+        tasks = {primary}
+        try:
+            # The hedge clock starts once the request is actually sent, not while it
+            # is queued for a rate-limit or concurrency slot
+            waiting_to_send = asyncio.create_task(sent.wait())
+            await asyncio.wait({primary, waiting_to_send}, return_when=asyncio.FIRST_COMPLETED)
+            waiting_to_send.cancel()
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done or not budget.take_hedge():
+                return await primary
+            self.hedges += 1
+            print(f"LLM request slower than p{self.hedge_percentile:g} ({hedge_after:.2f}s), sending a hedged request")
+            hedge = asyncio.create_task(self._generate(*args))
+            tasks.add(hedge)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _generate(self, contents, system_instruction, timeout, deadline, stream, model, loop, tools=None,
+                        sent=None):
+        """Make the actual request under the rate limit, concurrency limit and deadline"""
+        self.waiting += 1
+        estimated = None
+        try:
+            async with asyncio.timeout_at(deadline):
+                if self.scheduler is not None:
+                    context = current_request_context()
+                    estimated = estimate_request_tokens(contents, system_instruction)
+                    context.queue_wait += await self.scheduler.acquire(
+                        estimated, agent=context.agent, priority=context.priority
+                    )
+                await self.semaphore.acquire()
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        if sent is not None:
+            sent.set()
+        started = loop.time()
+        try:
+            when = started + timeout
+            if deadline is not None:
+                when = min(when, deadline)
+            async with asyncio.timeout_at(when):
+                if stream:
+                    response = await generate_streaming(self.client, contents, system_instruction, model=model)
+                else:
+                    response = await self.client.aio.models.generate_content(
+                        model=model,
+                        contents=contents,
+                        config=generation_config(system_instruction, tools)
+                    )
+                    if tools:
+                        response = StructuredResponse(response)
+            self.latency(model).record(loop.time() - started)
+            if estimated is not None:
+                usage = getattr(response, "usage_metadata", None)
+                self.scheduler.settle(estimated, getattr(usage, "total_token_count", None))
+            return response
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
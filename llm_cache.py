@@ -0,0 +1,100 @@
+"""Content-addressed cache of LLM responses with record/replay modes"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+CACHE_MODES = ("off", "record", "replay")
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a request has no recorded response"""
+
+
+class CachedResponse:
+    """A response served from the cache, shaped like a generate_content response"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.cached = True
+
+
+def request_key(model: str, contents, system_instruction=None, tools=None, stream=False) -> str:
+    """Hash of everything that determines the model's answer"""
+    request = {"model": model, "system_instruction": system_instruction, "contents": contents}
+    if tools:
+        # Only present with native function calling, so text-mode keys stay unchanged
+        request["tools"] = tools
+    if stream:
+        # A streamed response is stored as its first action line only, so it must
+        # never answer a non-streamed request that expects every line
+        request["stream"] = True
+    payload = json.dumps(
+        request,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Bounded in-memory LRU in front of an optional on-disk store
+
+    Modes:
+      off     - never consulted
+      record  - serve hits, call the model on a miss and store the response
+      replay  - serve hits only; a miss raises CacheMissError (zero API calls)
+    """
+
+    def __init__(self, mode: str = "off", max_entries: int = 256, path: str | None = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode} (expected one of {CACHE_MODES})")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.path = path
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, text: str) -> None:
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        text = self.entries.get(key)
+        if text is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+        if self.path is not None:
+            try:
+                with open(self._file(key)) as f:
+                    text = json.load(f)["text"]
+            except (OSError, ValueError, KeyError):
+                text = None
+            if text is not None:
+                self._remember(key, text)
+                self.hits += 1
+                return text
+        self.misses += 1
+        return None
+
+    def put(self, key: str, text: str, model: str | None = None) -> None:
+        self._remember(key, text)
+        if self.path is None:
+            return
+        file_path = self._file(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": model, "text": text}, f)
+        os.replace(tmp_path, file_path)
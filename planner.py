@@ -0,0 +1,244 @@
+"""Plan-then-execute: run a model-authored DAG of tool calls without per-step LLM round trips
+
+A plan is one line from the model:
+
+    PLAN: {"steps": [{"id": "ascii", "function": "strings_to_chars_to_int", "parameters": {"string": "INDIA"}},
+                     {"id": "total", "function": "int_list_to_exponential_sum", "parameters": {"int_list": "$ascii"}},
+                     {"id": "check", "function": "verify", "parameters": {"expression": "...", "expected": "$total"}}],
+           "final_answer": "$total"}
+
+A parameter that is exactly "$id" is replaced by that step's output value;
+"${id}" inside a longer string is replaced by its text. Steps run as soon as
+the steps they reference have finished, so independent steps run in parallel.
+"""
+import asyncio
+import json
+import re
+
+_WHOLE_REF = re.compile(r"^\$([A-Za-z_][\w-]*)$")
+_INLINE_REF = re.compile(r"\$\{([A-Za-z_][\w-]*)\}")
+
+
+class PlanError(ValueError):
+    """The plan itself is malformed: bad JSON, unknown references or a cycle"""
+
+
+class PlanStep:
+    def __init__(self, step_id: str, function: str, parameters: dict):
+        self.id = step_id
+        self.function = function
+        self.parameters = parameters
+        self.depends_on = sorted(_references(parameters))
+
+
+class Plan:
+    def __init__(self, steps: list[PlanStep], final_answer=None):
+        self.steps = steps
+        self.by_id = {step.id: step for step in steps}
+        self.final_answer = final_answer
+        self._validate()
+
+    def dependents(self, step_id: str) -> set[str]:
+        """Ids of every step that (transitively) consumes the given step's output"""
+        found, frontier = set(), [step_id]
+        while frontier:
+            current = frontier.pop()
+            for step in self.steps:
+                if current in step.depends_on and step.id not in found:
+                    found.add(step.id)
+                    frontier.append(step.id)
+        return found
+
+    def _validate(self) -> None:
+        if len(self.by_id) != len(self.steps):
+            raise PlanError("Duplicate step ids in plan")
+        for step in self.steps:
+            unknown = [ref for ref in step.depends_on if ref not in self.by_id]
+            if unknown:
+                raise PlanError(f"Step {step.id} references unknown steps {unknown}")
+        unknown = [ref for ref in _references(self.final_answer) if ref not in self.by_id]
+        if unknown:
+            raise PlanError(f"final_answer references unknown steps {unknown}")
+        # Kahn's algorithm; anything left over sits on a cycle
+        remaining = {step.id: set(step.depends_on) for step in self.steps}
+        while remaining:
+            ready = [step_id for step_id, deps in remaining.items() if not deps]
+            if not ready:
+                raise PlanError(f"Plan has a dependency cycle between {sorted(remaining)}")
+            for step_id in ready:
+                del remaining[step_id]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+
+class StepOutcome:
+    def __init__(self, step: PlanStep, arguments=None, value=None, text=None, error=None):
+        self.step = step
+        self.arguments = arguments
+        self.value = value
+        self.text = text
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class PlanResult:
+    def __init__(self, plan: Plan, outcomes: dict[str, StepOutcome]):
+        self.plan = plan
+        self.outcomes = outcomes
+        self.failed = [o for o in outcomes.values() if not o.ok]
+        self.final_answer = None
+        if not self.failed and plan.final_answer is not None:
+            values = {step_id: o.value for step_id, o in outcomes.items()}
+            self.final_answer = resolve(plan.final_answer, values)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def describe(self, render=None) -> str:
+        """Summary of every step for the model when asking for a revised plan
+
+        `render(value, text)` may shorten arguments and results before they go
+        into the prompt (see result_store.ResultStore.render).
+        """
+        render = render or (lambda value, text: text)
+        lines = []
+        for step in self.plan.steps:
+            outcome = self.outcomes.get(step.id)
+            if outcome is None:
+                lines.append(f"- {step.id} ({step.function}): not run, an earlier step failed")
+            elif outcome.ok:
+                arguments = render(outcome.arguments, str(outcome.arguments))
+                lines.append(f"- {step.id} ({step.function} with {arguments}): "
+                             f"returned {render(outcome.value, outcome.text)}")
+            else:
+                lines.append(f"- {step.id} ({step.function}): FAILED - {outcome.error}")
+        return "\n".join(lines)
+
+
+def _references(value) -> set[str]:
+    if isinstance(value, str):
+        whole = _WHOLE_REF.match(value)
+        if whole:
+            return {whole.group(1)}
+        return set(_INLINE_REF.findall(value))
+    if isinstance(value, list):
+        return set().union(*(_references(v) for v in value)) if value else set()
+    if isinstance(value, dict):
+        return set().union(*(_references(v) for v in value.values())) if value else set()
+    return set()
+
+
+def resolve(value, values: dict):
+    """Substitute step outputs into a parameter value"""
+    if isinstance(value, str):
+        whole = _WHOLE_REF.match(value)
+        if whole:
+            return values[whole.group(1)]
+        return _INLINE_REF.sub(lambda m: _as_text(values[m.group(1)]), value)
+    if isinstance(value, list):
+        return [resolve(v, values) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve(v, values) for k, v in value.items()}
+    return value
+
+
+def _as_text(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def parse_plan(line: str) -> Plan:
+    """Parse a `PLAN: {...}` line"""
+    payload = line.strip()
+    if payload.startswith("PLAN:"):
+        payload = payload[len("PLAN:"):]
+    try:
+        parsed = json.loads(payload)
+    except json.JSONDecodeError as e:
+        raise PlanError(f"Invalid JSON in plan: {e}")
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("steps"), list):
+        raise PlanError('Plan must be a JSON object with a "steps" list')
+    steps = []
+    for i, raw in enumerate(parsed["steps"]):
+        if not isinstance(raw, dict) or "function" not in raw:
+            raise PlanError(f"Step {i + 1} must be an object with a \"function\"")
+        parameters = raw.get("parameters", {})
+        if not isinstance(parameters, dict):
+            raise PlanError(f"Parameters of step {i + 1} must be a JSON object")
+        steps.append(PlanStep(str(raw.get("id", f"s{i + 1}")), raw["function"], parameters))
+    return Plan(steps, parsed.get("final_answer"))
+
+
+def tool_value(result):
+    """Turn a CallToolResult into (python value, display text)"""
+    items = [item.text if hasattr(item, "text") else str(item) for item in getattr(result, "content", [])]
+
+    def decode(text):
+        try:
+            return json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            return text
+
+    if len(items) == 1:
+        return decode(items[0]), items[0]
+    # FastMCP returns list results as one content item per element
+    return [decode(item) for item in items], f"[{', '.join(items)}]"
+
+
+def verification_failed(step: PlanStep, value) -> str | None:
+    """Error message if a verify step did not confirm its expectation"""
+    if step.function != "verify":
+        return None
+    if value is True or (isinstance(value, str) and value.lower() == "true"):
+        return None
+    return f"verification did not pass: {value}"
+
+
+async def execute_plan(plan: Plan, run_step, has_side_effects=None) -> PlanResult:
+    """Run every step once its dependencies are done
+
+    `run_step(step, arguments)` performs the tool call and returns the raw
+    CallToolResult. Steps depending on a failed step are not run. Steps for
+    which `has_side_effects(step)` is true (sending an email, say) also wait
+    for every verify step in the plan, so a failed check stops them too.
+    """
+    done: dict[str, asyncio.Future] = {
+        step.id: asyncio.get_running_loop().create_future() for step in plan.steps
+    }
+    outcomes: dict[str, StepOutcome] = {}
+    values: dict[str, object] = {}
+
+    verify_ids = [step.id for step in plan.steps if step.function == "verify"]
+
+    def waits_on(step: PlanStep) -> list[str]:
+        if has_side_effects is None or not has_side_effects(step):
+            return step.depends_on
+        # A verify step checking this step's own output cannot gate it
+        downstream = plan.dependents(step.id)
+        gates = [v for v in verify_ids if v != step.id and v not in downstream]
+        return sorted(set(step.depends_on).union(gates))
+
+    async def run(step: PlanStep):
+        try:
+            for dep in waits_on(step):
+                if not await done[dep]:
+                    return
+            arguments = resolve(step.parameters, values)
+            try:
+                result = await run_step(step, arguments)
+                value, text = tool_value(result)
+                error = text if getattr(result, "isError", False) else verification_failed(step, value)
+            except Exception as e:
+                value, text, error = None, None, str(e)
+            outcomes[step.id] = StepOutcome(step, arguments, value, text, error)
+            values[step.id] = value
+        finally:
+            succeeded = step.id in outcomes and outcomes[step.id].ok
+            if not done[step.id].done():
+                done[step.id].set_result(succeeded)
+
+    await asyncio.gather(*(run(step) for step in plan.steps))
+    return PlanResult(plan, outcomes)
@@ -0,0 +1,121 @@
+"""Keep large tool results out of the prompt, behind short reference IDs
+
+A result whose text is longer than `inline_chars` is stored here and the
+model sees only a summary: reference, type, length, head and tail, and a
+checksum. Writing the reference ("@r1") as a parameter value passes the full
+stored value to a later tool call; a reference inside a longer string is
+replaced by the stored text. Prompt size stays bounded however large
+intermediate results get.
+"""
+import hashlib
+import json
+import re
+
+_WHOLE_REF = re.compile(r"^\s*(@r\d+)\s*$")
+# Not preceded by a word character or dot, so "me@r2.example" is an address, not a reference
+_INLINE_REF = re.compile(r"(?<![\w.])@r\d+\b")
+
+
+def _clip(text: str, limit: int) -> str:
+    """Shorten one long item, keeping both ends and its length"""
+    if len(text) <= limit:
+        return text
+    keep = max(4, limit // 2)
+    return f"{text[:keep]}...{text[-8:]} ({len(text)} chars)"
+
+
+class StoredResult:
+    def __init__(self, ref: str, value, text: str, source: str | None):
+        self.ref = ref
+        self.value = value
+        self.text = text
+        self.source = source
+        self.checksum = hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+class ResultStore:
+    """Per-run store of oversized tool results, addressed by "@r<n>" references"""
+
+    def __init__(self, inline_chars: int = 1000, preview_items: int = 5, preview_chars: int = 160):
+        self.inline_chars = inline_chars
+        self.preview_items = preview_items
+        self.preview_chars = preview_chars
+        self.results: dict[str, StoredResult] = {}
+        # Characters kept out of the prompt by storing results instead of inlining them
+        self.chars_saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.inline_chars > 0
+
+    def render(self, value, text: str, source: str | None = None) -> str:
+        """Text to show the model for a result: the result itself, or a reference and summary if too long"""
+        if not self.enabled or len(text) <= self.inline_chars:
+            return text
+        stored = StoredResult(f"@r{len(self.results) + 1}", value, text, source)
+        self.results[stored.ref] = stored
+        summary = self.summary(stored)
+        self.chars_saved += len(text) - len(summary)
+        return summary
+
+    def summary(self, stored: StoredResult) -> str:
+        value, n = stored.value, self.preview_items
+        if isinstance(value, list):
+            items = [_clip(json.dumps(item, default=str), 40) for item in value]
+            head = ", ".join(items[:n])
+            tail = f", tail [{', '.join(items[-n:])}]" if len(items) > n else ""
+            shape = f"list of {len(items)} items, head [{head}]{tail}"
+        elif isinstance(value, dict):
+            keys = ", ".join(_clip(str(key), 40) for key in list(value)[:n * 2])
+            shape = f"object with {len(value)} keys ({keys}{', ...' if len(value) > n * 2 else ''})"
+        elif isinstance(value, int) and not isinstance(value, bool):
+            digits = str(abs(value))
+            shape = f"integer with {len(digits)} digits, {_clip(str(value), self.preview_chars)}"
+        else:
+            text, half = stored.text, self.preview_chars // 2
+            shape = f"text, head {json.dumps(text[:half])}, tail {json.dumps(text[-half:])}"
+        return (f"<{stored.ref}: {shape}, {len(stored.text)} chars, sha256 {stored.checksum}; "
+                f'pass "{stored.ref}" as a parameter to use the full value>')
+
+    def get(self, ref: str) -> StoredResult:
+        stored = self.results.get(ref)
+        if stored is None:
+            raise ValueError(f"Unknown result reference {ref} (known: {', '.join(self.results) or 'none'})")
+        return stored
+
+    def has_references(self, value) -> bool:
+        if isinstance(value, str):
+            return bool(_INLINE_REF.search(value))
+        if isinstance(value, list):
+            return any(self.has_references(item) for item in value)
+        if isinstance(value, dict):
+            return any(self.has_references(item) for item in value.values())
+        return False
+
+    def resolve(self, value):
+        """Replace references in tool arguments with the stored values"""
+        if not self.results:
+            return value
+        if isinstance(value, str):
+            whole = _WHOLE_REF.match(value)
+            if whole:
+                return self.get(whole.group(1)).value
+            return self.expand(value)
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        return value
+
+    def expand(self, text: str) -> str:
+        """Replace known references in free text (e.g. a final answer) with the full results
+
+        Unknown ones are left alone, so an address like "me@r2.example" survives.
+        """
+        if not self.results or not text:
+            return text
+        return _INLINE_REF.sub(lambda m: self.results[m.group(0)].text if m.group(0) in self.results else m.group(0), text)
+
+    def stats(self) -> str:
+        kept = sum(len(stored.text) for stored in self.results.values())
+        return f"{len(self.results)} stored ({kept} chars), {self.chars_saved} chars kept out of prompts"
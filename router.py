@@ -0,0 +1,90 @@
+"""Per-step model routing: the model, timeout and cache policy follow the step type"""
+import time
+
+from latency import LatencyWindow
+
+# planning - the first step, replanning after an error, plan-mode plans
+# routine  - deciding the next tool call after a tool result (e.g. verify after arithmetic)
+# final    - wrapping up once the side-effecting work is done or iterations run out
+STEP_TYPES = ("planning", "routine", "final")
+
+
+class Route:
+    """Where one step type goes: a model, an optional fixed timeout and whether to use the response cache"""
+
+    def __init__(self, model: str, timeout: float | None = None, cache: bool = True):
+        self.model = model
+        # None leaves the timeout to the adaptive per-model policy in AsyncLLM
+        self.timeout = timeout
+        self.cache = cache
+
+
+class ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.cached = 0
+        self.errors = 0
+        self.latency = LatencyWindow(size=1000, min_samples=1)
+
+
+class ModelRouter:
+    """Sends each generation to the model configured for its step type
+
+    Wraps a shared AsyncLLM, so concurrency limits, retries and hedging
+    still apply across all models; this layer only chooses per call and
+    keeps per-route and per-model statistics.
+    """
+
+    def __init__(self, llm, routes: dict[str, Route]):
+        unknown = set(routes) - set(STEP_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown step types: {sorted(unknown)} (expected {STEP_TYPES})")
+        self.llm = llm
+        self.routes = routes
+        self.route_calls = {step_type: 0 for step_type in STEP_TYPES}
+        self.models: dict[str, ModelStats] = {}
+
+    def route(self, step_type: str) -> Route:
+        return self.routes[step_type]
+
+    async def generate(self, contents, system_instruction=None, timeout=None, stream=False, budget=None,
+                       step_type="routine", tools=None, deadline=None):
+        route = self.route(step_type)
+        stats = self.models.setdefault(route.model, ModelStats())
+        self.route_calls[step_type] += 1
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            response = await self.llm.generate(
+                contents,
+                system_instruction=system_instruction,
+                timeout=timeout if timeout is not None else route.timeout,
+                deadline=deadline,
+                stream=stream,
+                model=route.model,
+                budget=budget,
+                use_cache=route.cache,
+                tools=tools
+            )
+        except Exception:
+            stats.errors += 1
+            raise
+        if getattr(response, "cached", False):
+            stats.cached += 1
+        else:
+            stats.latency.record(time.perf_counter() - start)
+        return response
+
+    def report(self) -> list[str]:
+        """One line per route and per model"""
+        lines = [
+            f"{step_type}: {route.model} ({self.route_calls[step_type]} calls, "
+            f"timeout {'adaptive' if route.timeout is None else f'{route.timeout:g}s'}, "
+            f"cache {'on' if route.cache else 'off'})"
+            for step_type, route in self.routes.items()
+        ]
+        for model, stats in self.models.items():
+            p50, p95 = stats.latency.percentile(50), stats.latency.percentile(95)
+            latency = f", p50 {p50:.2f}s, p95 {p95:.2f}s" if p50 is not None else ""
+            lines.append(f"{model}: {stats.calls} calls, {stats.cached} cached, {stats.errors} errors{latency}")
+        return lines
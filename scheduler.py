@@ -0,0 +1,204 @@
+"""Process-wide rate limiting and fair scheduling of LLM requests
+
+Every request to the model first takes one request from a requests-per-minute
+bucket and its estimated tokens from a tokens-per-minute bucket. While the
+buckets are empty, requests wait in one queue. When budget frees up, the
+waiter with the highest priority goes first (agents further along their run
+ask with a higher priority). Waiters with equal priority are served in
+round-robin order across agents.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import time
+from contextlib import contextmanager
+
+from conversation import estimate_tokens
+from latency import LatencyWindow
+
+# Allowance for the response when estimating a request's tokens up front
+EXPECTED_OUTPUT_TOKENS = 256
+
+
+class RequestContext:
+    """Who is asking and how urgently; also collects the time spent queued"""
+
+    __slots__ = ("agent", "priority", "queue_wait")
+
+    def __init__(self, agent=None, priority: float = 0):
+        self.agent = agent
+        self.priority = priority
+        self.queue_wait = 0.0
+
+
+_request_context = contextvars.ContextVar("llm_request_context", default=None)
+
+
+@contextmanager
+def request_context(agent=None, priority: float = 0):
+    """Tag the LLM requests made inside the block (hedges and retries included)"""
+    context = RequestContext(agent, priority)
+    token = _request_context.set(context)
+    try:
+        yield context
+    finally:
+        _request_context.reset(token)
+
+
+def current_request_context() -> RequestContext:
+    return _request_context.get() or RequestContext()
+
+
+def estimate_request_tokens(contents, system_instruction=None) -> int:
+    """Prompt tokens of a request plus an allowance for the response"""
+    if isinstance(contents, str):
+        prompt = contents
+    else:
+        prompt = json.dumps(contents, default=str)
+    return estimate_tokens(prompt) + estimate_tokens(system_instruction or "") + EXPECTED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding at most one minute's budget"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the bucket need a full bucket)"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        """Correct an estimate once the real usage is known (negative amounts charge more)"""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("agent", "priority", "tokens", "seq", "enqueued", "future")
+
+    def __init__(self, agent, priority, tokens, seq, future):
+        self.agent = agent
+        self.priority = priority
+        self.tokens = tokens
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class RequestScheduler:
+    """Shared RPM/TPM gate in front of model requests
+
+    `rpm` or `tpm` of 0 disables that limit; with both 0, `acquire` returns
+    immediately and only counts requests.
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.waiters: list[_Waiter] = []
+        self.seq = itertools.count()
+        # Requests granted per agent, for round-robin among equal priorities
+        self.served: dict[str, int] = {}
+        self.queue_wait = LatencyWindow(size=1000, min_samples=1)
+        self.granted = 0
+        self._timer = None
+        self._timer_loop = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.waiters)
+
+    def _wait_time(self, tokens: int) -> float:
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens))
+        return max(waits)
+
+    def _grant(self, agent, tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        self.served[agent] = self.served.get(agent, 0) + 1
+        self.granted += 1
+
+    def _next_waiter(self) -> _Waiter:
+        return min(self.waiters, key=lambda w: (-w.priority, self.served.get(w.agent, 0), w.seq))
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self.waiters:
+            waiter = self._next_waiter()
+            if waiter.future.done():
+                # Cancelled while queued
+                self.waiters.remove(waiter)
+                continue
+            wait = self._wait_time(waiter.tokens)
+            if wait > 0:
+                self._timer_loop = asyncio.get_running_loop()
+                self._timer = self._timer_loop.call_later(wait, self._dispatch)
+                return
+            self.waiters.remove(waiter)
+            self._grant(waiter.agent, waiter.tokens)
+            waiter.future.set_result(None)
+
+    async def acquire(self, tokens: int, agent=None, priority: float = 0) -> float:
+        """Wait for budget for one request of about `tokens` tokens; returns the queue wait in seconds"""
+        if not self.enabled:
+            self.granted += 1
+            return 0.0
+        if not self.waiters and self._wait_time(tokens) == 0:
+            self._grant(agent, tokens)
+            self.queue_wait.record(0.0)
+            return 0.0
+
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is not loop:
+            # Left over from an event loop that has since finished
+            self._timer = None
+            self.waiters = [w for w in self.waiters if w.future.get_loop() is loop]
+        waiter = _Waiter(agent, priority, tokens, next(self.seq), loop.create_future())
+        self.waiters.append(waiter)
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+        wait = time.monotonic() - waiter.enqueued
+        self.queue_wait.record(wait)
+        return wait
+
+    def settle(self, estimated: int, actual: int | None) -> None:
+        """Charge the token bucket for the real usage once a response reports it"""
+        if self.tokens is not None and actual is not None:
+            self.tokens.refund(estimated - actual)
+
+    def stats(self) -> str:
+        p50, p95 = self.queue_wait.percentile(50), self.queue_wait.percentile(95)
+        waits = f", queue wait p50 {p50:.2f}s p95 {p95:.2f}s" if p50 is not None else ""
+        return f"{self.granted} requests granted, {self.queue_depth} queued{waits}"
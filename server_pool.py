@@ -0,0 +1,190 @@
+"""Pool of identical MCP server processes behind one session-like object
+
+Sync tools in a FastMCP server run one at a time on its event loop, so a
+single slow call (say `factorial(200000)`) stalls every agent sharing that
+server. A ServerPool launches N copies of the server and spreads calls
+to stateless tools across them by least outstanding requests. Other tools
+always go to the first member, so any state they keep stays in one place.
+
+Each member runs under its own supervisor task. The stdio transport's task
+groups must be entered and exited by the same task, so a member can be torn
+down and relaunched without touching the others. A member is restarted when
+its process exits (its stdout reaches EOF), when its pipe breaks during a
+call, or when it is idle and stops answering periodic pings. Calls pending
+on a restarted member fail, and stateless ones are retried on another member.
+"""
+import asyncio
+import time
+
+import anyio
+from mcp import ClientSession
+from mcp.client.stdio import stdio_client
+
+# Errors meaning the member's process or pipe is gone
+CONNECTION_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    ConnectionError,
+)
+
+
+class PoolMember:
+    """One server process of a pool and its load counters"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.outstanding = 0
+        self.calls = 0
+        self.restarts = 0
+        self.last_error = None
+        self.ready = asyncio.Event()
+        self.restart = asyncio.Event()
+        # Resolved when the first launch succeeds or fails, for initialize()
+        self.first_start = asyncio.get_running_loop().create_future()
+
+
+class ServerPool:
+    """N copies of one stdio server, exposing initialize / list_tools / call_tool like a ClientSession"""
+
+    def __init__(self, config, size: int, stateless_tools=(), health_interval: float = 5.0,
+                 ping_timeout: float = 2.0, max_backoff: float = 10.0):
+        self.config = config
+        self.size = size
+        self.stateless_tools = set(stateless_tools)
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.max_backoff = max_backoff
+        self.members: list[PoolMember] = []
+        self.closing = False
+        self._tasks = []
+
+    async def __aenter__(self) -> "ServerPool":
+        self.members = [PoolMember(i) for i in range(self.size)]
+        self._tasks = [asyncio.create_task(self._supervise(member)) for member in self.members]
+        self._tasks.append(asyncio.create_task(self._health_loop()))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closing = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        return False
+
+    async def _supervise(self, member: PoolMember) -> None:
+        failures = 0
+        while not self.closing:
+            launched_at = time.perf_counter()
+            try:
+                async with stdio_client(self.config.params()) as (read, write):
+                    relay_send, relay_receive = anyio.create_memory_object_stream(0)
+                    async with anyio.create_task_group() as tg:
+                        tg.start_soon(self._relay, read, relay_send, member)
+                        async with ClientSession(relay_receive, write) as session:
+                            await session.initialize()
+                            member.session = session
+                            member.last_error = None
+                            member.ready.set()
+                            if not member.first_start.done():
+                                member.first_start.set_result(None)
+                            failures = 0
+                            await member.restart.wait()
+                        tg.cancel_scope.cancel()
+            except Exception as e:
+                # Keep the reason recorded when the restart was requested over teardown noise
+                member.last_error = member.last_error or f"{type(e).__name__}: {e}"
+                if not member.first_start.done():
+                    member.first_start.set_exception(e)
+                    return
+            finally:
+                member.ready.clear()
+                member.session = None
+                member.restart.clear()
+            if self.closing:
+                return
+            failures += 1
+            member.restarts += 1
+            delay = min(self.max_backoff, 0.5 * 2 ** (failures - 1)) if time.perf_counter() - launched_at < 5 else 0
+            print(f"Restarting {self.config.name}[{member.index}]"
+                  f"{f' ({member.last_error})' if member.last_error else ''}"
+                  f"{f' in {delay:.1f}s' if delay else ''}")
+            await asyncio.sleep(delay)
+
+    async def _relay(self, read, send, member: PoolMember) -> None:
+        """Pass server messages to the session and notice when the process goes away"""
+        async with send:
+            async for message in read:
+                await send.send(message)
+        member.last_error = member.last_error or "server process exited"
+        member.restart.set()
+
+    async def _health_loop(self) -> None:
+        while not self.closing:
+            await asyncio.sleep(self.health_interval)
+            # Busy members are skipped: a long sync tool blocks their event loop
+            # and would make a healthy server miss the ping
+            idle = [m for m in self.members if m.ready.is_set() and m.outstanding == 0]
+            await asyncio.gather(*(self._check(member) for member in idle))
+
+    async def _check(self, member: PoolMember) -> None:
+        session = member.session
+        try:
+            await asyncio.wait_for(session.send_ping(), self.ping_timeout)
+        except Exception as e:
+            if member.session is session and member.outstanding == 0:
+                member.last_error = f"health check failed: {type(e).__name__} {e}".strip()
+                member.restart.set()
+
+    async def initialize(self):
+        """Wait until every member has started once, raising if any failed to"""
+        await asyncio.gather(*(member.first_start for member in self.members))
+
+    async def list_tools(self):
+        member = await self._pick(stateless=False)
+        return await member.session.list_tools()
+
+    async def _pick(self, stateless: bool) -> PoolMember:
+        while True:
+            if not stateless:
+                member = self.members[0]
+                if member.ready.is_set():
+                    return member
+                await member.ready.wait()
+                continue
+            ready = [m for m in self.members if m.ready.is_set()]
+            if ready:
+                return min(ready, key=lambda m: (m.outstanding, m.calls))
+            waiters = [asyncio.create_task(m.ready.wait()) for m in self.members]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    async def call_tool(self, name: str, arguments: dict | None = None):
+        stateless = name in self.stateless_tools
+        # A stateless call whose member died mid-call is retried once on another member
+        attempts = 2 if stateless and self.size > 1 else 1
+        for attempt in range(attempts):
+            member = await self._pick(stateless)
+            member.outstanding += 1
+            member.calls += 1
+            try:
+                return await member.session.call_tool(name, arguments=arguments)
+            except CONNECTION_ERRORS as e:
+                member.last_error = f"{type(e).__name__} during {name}"
+                member.restart.set()
+                if attempt == attempts - 1:
+                    raise
+            finally:
+                member.outstanding -= 1
+
+    def report(self) -> str:
+        members = ", ".join(
+            f"[{m.index}] {m.calls} calls, {m.outstanding} outstanding, {m.restarts} restarts"
+            f"{'' if m.ready.is_set() else ' (down)'}"
+            for m in self.members
+        )
+        return f"{self.config.name} pool of {self.size}: {members}"
@@ -1,13 +1,29 @@
 import os
 from dotenv import load_dotenv
-from mcp import ClientSession, StdioServerParameters, types
-from mcp.client.stdio import stdio_client
 import asyncio
 from google import genai
-from concurrent.futures import TimeoutError
-from functools import partial
 import json
-from pdb import set_trace
+import argparse
+import time
+from contextlib import contextmanager
+from conversation import ConversationState, CompactionPolicy
+from llm import AsyncLLM, DEFAULT_MODEL
+from router import ModelRouter, Route, STEP_TYPES
+from scheduler import RequestScheduler, request_context
+from latency import RequestBudget, percentile
+from llm_cache import ResponseCache
+from tool_dispatch import ToolDispatcher, ToolMemo
+from connections import ConnectionManager, ServerConfig
+from server_pool import ServerPool
+from tracing import tracer, exporter_from_setting
+from catalog_cache import CatalogCache, server_fingerprint, prompt_key, tools_equal
+from planner import PlanError, parse_plan, execute_plan, tool_value
+from result_store import ResultStore
+from journal import RunJournal
+from convergence import ConvergenceMonitor
+from function_calling import function_declarations, model_call_parts, function_response_parts
+from daemon import AgentDaemon, DEFAULT_SOCKET
+from tool_index import ToolIndex
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,152 +34,335 @@ client = genai.Client(api_key=api_key)
 email_address = os.getenv("EMAIL_ADDRESS")
 
 max_iterations = 10
-last_response = None
-iteration = 0
-iteration_response = []
 
-async def generate_with_timeout(client, prompt, timeout=10):
-    """Generate content with a timeout"""
+# "loop" asks the model for one step at a time; "plan" asks once for a DAG of tool
+# calls and only goes back to the model when a step or verification fails
+agent_mode = os.getenv("AGENT_MODE", "loop")
+max_replans = int(os.getenv("PLAN_MAX_REPLANS", "2"))
+
+# Tools without side effects whose results are memoized client-side; repeated calls
+# with identical arguments never reach the server. Gmail tools are never listed here.
+pure_tools = {
+    "add", "add_list", "subtract", "multiply", "divide", "power", "sqrt", "cbrt",
+    "factorial", "log", "remainder", "sin", "cos", "tan", "mine",
+    "strings_to_chars_to_int", "int_list_to_exponential_sum", "fibonacci_numbers", "verify",
+    "batch_apply",
+}
+tool_memo = ToolMemo(max_entries=int(os.getenv("TOOL_MEMO_SIZE", "1024"))) if os.getenv("TOOL_MEMO", "1") == "1" else None
+
+# MCP servers started for every run; all are launched and initialized concurrently.
+# MATH_TRANSPORT=memory serves the calculator in-process instead of over stdio;
+# MATH_POOL_SIZE=N runs N calculator processes and spreads pure tool calls across them
+server_configs = [
+    ServerConfig("math", "python", ["example2-3.py"], transport=os.getenv("MATH_TRANSPORT", "stdio"),
+                 pool_size=int(os.getenv("MATH_POOL_SIZE", "1")), stateless_tools=pure_tools),
+    ServerConfig("gmail", "python", ["server.py"]),
+]
+
+
+# GUI tools that cannot run on our Linux hosts; they are left out of every prompt
+excluded_tools = set(filter(None, os.getenv(
+    "EXCLUDED_TOOLS",
+    "draw_rectangle,add_text_in_paint,open_paint,open_freeform,create_board_in_freeform,"
+    "create_square_in_freeform,write_text_in_square_in_freeform"
+).split(",")))
+
+# With k > 0 each query's prompt lists only the k most relevant tools (BM25 over names,
+# descriptions and parameters) plus always_tools; calling a tool outside the set widens it
+tool_retrieval_k = int(os.getenv("TOOL_RETRIEVAL_K", "0"))
+always_tools = {"show_reasoning", "verify"}
+
+# Tool catalogs and the rendered system prompt are cached on disk, keyed by server fingerprint
+use_catalog_cache = os.getenv("TOOL_CATALOG_CACHE", "1") == "1"
+catalog_cache = CatalogCache(os.getenv("TOOL_CATALOG_CACHE_PATH", os.path.join(".cache", "tool_catalog.json")))
+
+# Old tool results get summarized (and eventually dropped) past this budget
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# When the model repeats the same calls with the same results or stops producing actions,
+# LOOP_ACTION decides what happens: "hint" (corrective note, then abort if it persists),
+# "plan" (redo the task in plan mode), "abort" or "off"
+loop_action = os.getenv("LOOP_ACTION", "hint")
+loop_max_stall = int(os.getenv("LOOP_MAX_STALL", "3"))
+max_loop_hints = 1
+
+# Pass the MCP tool schemas to the model as native function declarations and read structured
+# function calls back; FUNCTION_CALL: text lines are still understood as a fallback
+native_tools = os.getenv("LLM_NATIVE_TOOLS", "0") == "1"
+
+# Every run is journaled to <dir>/<run_id>.jsonl (responses and tool results, fsync batched
+# every AGENT_JOURNAL_FSYNC seconds) so --resume <run_id> can pick up after a crash
+use_journal = os.getenv("AGENT_JOURNAL", "1") == "1"
+journal_dir = os.getenv("AGENT_JOURNAL_DIR", os.path.join(".cache", "runs"))
+journal_fsync_interval = float(os.getenv("AGENT_JOURNAL_FSYNC", "0.5"))
+# Journals of runs that completed with an answer are deleted unless kept; at most this many are
+# kept on disk, oldest first out (0 = no limit)
+journal_keep_completed = os.getenv("AGENT_JOURNAL_KEEP", "0") == "1"
+journal_max_runs = int(os.getenv("AGENT_JOURNAL_MAX", "100"))
+
+# Tool results longer than this many characters are kept client-side under a reference
+# ("@r1") and the prompt gets a summary instead (0 = always inline)
+result_inline_chars = int(os.getenv("RESULT_INLINE_CHARS", "1000"))
+
+# Stream responses and act on the first complete FUNCTION_CALL/FINAL_ANSWER line
+stream_responses = os.getenv("LLM_STREAMING", "0") == "1"
+
+# Responses cached by a hash of model + full request; "record" stores, "replay" never calls the API
+llm_cache = ResponseCache(
+    mode=os.getenv("LLM_CACHE_MODE", "off"),
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "256")),
+    path=os.getenv("LLM_CACHE_DIR", os.path.join(".cache", "llm")) or None
+)
+
+# Span tracing: "" (off, no overhead), "memory", or a .jsonl file to append spans to
+tracer.set_exporter(exporter_from_setting(os.getenv("AGENT_TRACE", "")))
+
+# Process-wide requests- and tokens-per-minute budgets (0 = unlimited); requests beyond them
+# queue, agents nearer to finishing first and round-robin across agents otherwise
+scheduler = RequestScheduler(rpm=float(os.getenv("LLM_RPM", "0")), tpm=float(os.getenv("LLM_TPM", "0")))
+
+# Shared async generation layer; bounds concurrent requests across agents. With adaptive
+# timeouts the per-attempt timeout follows the observed p99 (capped at LLM_TIMEOUT), slow
+# requests are hedged past the p95 and failures retried with jittered backoff
+llm = AsyncLLM(
+    client,
+    model=os.getenv("LLM_MODEL", DEFAULT_MODEL),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    timeout=float(os.getenv("LLM_TIMEOUT", "10")),
+    cache=llm_cache,
+    scheduler=scheduler,
+    adaptive=os.getenv("LLM_ADAPTIVE_TIMEOUTS", "1") == "1"
+)
+# Retries and hedged duplicates each agent run may spend
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Deadline for one agent run's LLM calls in seconds, queueing, retries and backoff included (0 = none)
+run_timeout = float(os.getenv("AGENT_RUN_TIMEOUT", "300"))
+llm_max_hedges = int(os.getenv("LLM_MAX_HEDGES", "2"))
+
+# Model per step type: LLM_MODEL_PLANNING / _ROUTINE / _FINAL (default LLM_MODEL), an optional
+# fixed LLM_TIMEOUT_<STEP> and LLM_CACHE_<STEP>=0 to bypass the response cache for that step
+router = ModelRouter(llm, {
+    step_type: Route(
+        os.getenv(f"LLM_MODEL_{step_type.upper()}", llm.model),
+        timeout=float(os.environ[f"LLM_TIMEOUT_{step_type.upper()}"]) if os.getenv(f"LLM_TIMEOUT_{step_type.upper()}") else None,
+        cache=os.getenv(f"LLM_CACHE_{step_type.upper()}", "1") == "1"
+    )
+    for step_type in STEP_TYPES
+})
+# Tools that usually complete the task, so the step after them is routed as "final"
+final_tools = {"send_email"}
+
+default_query = f"""Find the ASCII values of characters in INDIA, calculate the sum of exponentials of those values, and send the result as an email to {email_address}. """
+
+async def generate_with_timeout(llm, prompt, timeout=None, system_instruction=None, stream=None, budget=None,
+                                step_type="routine", tools=None, deadline=None):
+    """Generate content on the model routed for `step_type`, with a timeout (adaptive when None)
+    and an optional absolute event-loop deadline"""
     print("Starting LLM generation...")
+    if stream is None:
+        stream = stream_responses
     try:
-        # Convert the synchronous generate_content call to run in a thread
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None, 
-                lambda: client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=prompt
-                )
-            ),
-            timeout=timeout
+        response = await llm.generate(
+            prompt,
+            system_instruction=system_instruction,
+            timeout=timeout,
+            deadline=deadline,
+            stream=stream,
+            budget=budget,
+            step_type=step_type,
+            tools=tools
         )
         print("LLM generation completed")
         return response
-    except TimeoutError:
+    except asyncio.TimeoutError:
         print("LLM generation timed out!")
         raise
     except Exception as e:
         print(f"Error in LLM generation: {e}")
         raise
 
-def reset_state():
-    """Reset all global variables to their initial state"""
-    global last_response, iteration, iteration_response
-    last_response = None
-    iteration = 0
-    iteration_response = []
+class AgentState:
+    """Loop state of a single agent run"""
+
+    def __init__(self, query, agent_id=None):
+        self.query = query
+        self.agent_id = agent_id
+        self.iteration = 0
+        self.last_response = None
+        self.conversation = None
+        self.final_answer = None
+        self.error = None
+        self.llm_calls = 0
+        self.started_at = None
+        self.finished_at = None
+        # Per-iteration phase timings in seconds, e.g. {"generation": 0.8, "tool_call": 0.01}
+        self.timings = []
+        self.phase_times = {}
+        # Optional callback(event, **data) receiving progress events, e.g. from the daemon
+        self.listener = None
+        # Tools listed in this agent's prompt; None means the full catalog
+        self.tool_names = None
+        self.llm_budget = RequestBudget(max_retries=llm_max_retries, max_hedges=llm_max_hedges)
+        # Event-loop time by which every LLM call of this run must be done (None = no limit)
+        self.deadline = None
+        # Tools called in the previous iteration, used to route the next step
+        self.last_tools = set()
+        # Large tool results, referenced from the prompt as "@r1", "@r2", ...
+        self.results = ResultStore(inline_chars=result_inline_chars)
+        # Append-only record of this run; a resumed run starts with a loaded one
+        self.journal = None
+        self.monitor = ConvergenceMonitor(max_stall=loop_max_stall) if loop_action != "off" else None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def add_timing(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0.0) + seconds
+
+    def end_iteration(self, iteration):
+        if self.phase_times:
+            self.timings.append({"iteration": iteration + 1, **self.phase_times})
+        self.phase_times = {}
+
+    def emit(self, event, **data):
+        if self.listener is not None:
+            self.listener(event, **data)
+
+    def log(self, message):
+        if self.agent_id is None:
+            print(message)
+        else:
+            print(f"[{self.agent_id}] {message}")
+
+class AgentContext:
+    """Connected MCP sessions and the tool catalog, shared by all agents"""
+
+    def __init__(self, servers, catalogs=None, system_prompt=None):
+        self.servers = servers
+        # Tool calls wait on this until the catalog is known to match the live servers
+        self.catalog_checked = asyncio.Event()
+        self.catalog_task = None
+        self.load_catalog(catalogs or {conn.name: conn.tools for conn in servers}, system_prompt)
+
+    def load_catalog(self, catalogs, system_prompt=None):
+        """(Re)build the tool list, dispatch table and system prompt from per-server catalogs"""
+        self.all_tools = [tool for conn in self.servers for tool in catalogs[conn.name]]
+        self.prompt_tools = [tool for tool in self.all_tools if tool.name not in excluded_tools]
+        self.tool_index = ToolIndex(self.prompt_tools)
+        # Compiled once here so every call is a dict lookup plus precompiled coercion
+        self.dispatcher = ToolDispatcher(memo=tool_memo, pure_tools=pure_tools)
+        for conn in self.servers:
+            self.dispatcher.add_server(conn.name, conn.session, catalogs[conn.name], ready=self.catalog_checked)
+        self.system_prompt = system_prompt or build_system_prompt(build_tools_description(self.prompt_tools))
+        self._plan_prompt = None
+        # Prompts for retrieved tool subsets, keyed by (frozenset of names, plan mode)
+        self._subset_prompts = {}
+        self.declarations = function_declarations(self.prompt_tools)
+        self._subset_declarations = {}
+
+    @property
+    def plan_prompt(self):
+        if self._plan_prompt is None:
+            self._plan_prompt = build_plan_prompt(build_tools_description(self.prompt_tools))
+        return self._plan_prompt
+
+    def select_tools(self, query):
+        """Tool names to show for a query, or None for the full catalog"""
+        if tool_retrieval_k <= 0:
+            return None
+        return self.tool_index.select(query, tool_retrieval_k, always=always_tools)
+
+    def prompt_for(self, tool_names, plan=False):
+        """System prompt listing only `tool_names` (all prompt tools when None)"""
+        if native_tools and not plan:
+            # The tools travel as function declarations instead
+            return native_system_prompt
+        if tool_names is None:
+            return self.plan_prompt if plan else self.system_prompt
+        key = (frozenset(tool_names), plan)
+        if key not in self._subset_prompts:
+            description = build_tools_description([t for t in self.prompt_tools if t.name in tool_names])
+            self._subset_prompts[key] = build_plan_prompt(description) if plan else build_system_prompt(description)
+        return self._subset_prompts[key]
+
+    def declarations_for(self, tool_names):
+        """Function declarations for `tool_names` (all prompt tools when None)"""
+        if tool_names is None:
+            return self.declarations
+        key = frozenset(tool_names)
+        if key not in self._subset_declarations:
+            self._subset_declarations[key] = [d for d in self.declarations if d["name"] in tool_names]
+        return self._subset_declarations[key]
 
 def parse_llm_response(response_text):
     try:
-        # Extract the text content from the response
-        #response_text = response.text if hasattr(response, 'text') else response
-        
-        # Strip the "FUNCTION_CALL: " prefix and parse the JSON
-        json_str = response_text.replace("FUNCTION_CALL: ", "").strip()
+        # Strip the "FUNCTION_CALL:" prefix (only the leading one; arguments may contain it) and parse the JSON
+        json_str = response_text.strip().removeprefix("FUNCTION_CALL:").strip()
         parsed = json.loads(json_str)
-        
+        if not isinstance(parsed, dict):
+            raise ValueError(f"Function call must be a JSON object in response: {response_text}")
+
         # Extract function name
         func_name = parsed["function"]
-        
-        # Extract parameter values from the parameters dictionary
+        if not isinstance(func_name, str):
+            raise ValueError(f"Function name must be a string in response: {response_text}")
+
+        # Keep the parameter names so arguments can be bound by name
         params_dict = parsed.get("parameters", {})
-        #print(f"DEBUG: Parameters dictionary: {params_dict}")
-        #print(f"DEBUG: Parameters dictionary type: {type(params_dict)}")
-        
-        params_list = []
-        for value in params_dict.values():
-            params_list.append(value)
-                    
-        return func_name, params_list
-        
+        if not isinstance(params_dict, dict):
+            raise ValueError(f"Parameters must be a JSON object in response: {response_text}")
+
+        return func_name, params_dict
+
     except json.JSONDecodeError:
         raise ValueError(f"Invalid JSON format in response: {response_text}")
     except KeyError as e:
         raise ValueError(f"Missing required key in JSON response: {str(e)}")
 
-async def main():
-    reset_state()  # Reset at the start of main
-    print("Starting main execution...")
+def build_tools_description(all_tools):
+    """Render the numbered tool list embedded in the system prompt"""
+    print("Creating system prompt...")
+    print(f"Number of tools: {len(all_tools)}")
     try:
-        # Create a single MCP server connection
-        print("Establishing connection to Math MCP server...")
-        server_params = StdioServerParameters(
-            command="python",
-            args=["example2-3.py"]
-        )
 
-        print("Establishing connection to GmailMCP server...")
-        gmail_server_params = StdioServerParameters(
-            command="python",
-            args=["server.py"]
-        )
+        tools_description = []
+        for i, tool in enumerate(all_tools):
+            try:
+                # Get tool properties
+                params = tool.inputSchema
+                desc = getattr(tool, 'description', 'No description available')
+                name = getattr(tool, 'name', f'tool_{i}')
+
+                # Format the input schema in a more readable way
+                if 'properties' in params:
+                    param_details = []
+                    for param_name, param_info in params['properties'].items():
+                        param_type = param_info.get('type', 'unknown')
+                        param_details.append(f"{param_name}: {param_type}")
+                    params_str = ', '.join(param_details)
+                else:
+                    params_str = 'no parameters'
 
-        async with stdio_client(server_params) as (read, write):
-            async with stdio_client(gmail_server_params) as (gmail_read, gmail_write):
-                print("Connection established, creating session...")
-                async with ClientSession(read, write) as session:
-                    async with ClientSession(gmail_read, gmail_write) as gmail_session:
-                        print("Session created, initializing...")
-                        await session.initialize()
-                        await gmail_session.initialize()
-                        
-                        # Get available tools
-                        print("Requesting tool list...")
-                        tools_result = await session.list_tools()
-                        gmail_tools_result = await gmail_session.list_tools()
-                        tools = tools_result.tools
-                        gmail_tools = gmail_tools_result.tools
-                        print(f"Successfully retrieved {len(tools)} tools")
-                        print(f"Successfully retrieved {len(gmail_tools)} gmail tools")
-                        #set_trace()
-                        math_tool_names = {tool.name for tool in tools}
-                        #print(f"Math tool names: {math_tool_names}")
-                        gmail_tool_names = {tool.name for tool in gmail_tools}
-                        #print(f"Gmail tool names: {gmail_tool_names}")
-                        #set_trace()
-                        all_tools = tools + gmail_tools
-                        #print(f"All tools: {all_tools}")
-                        # Create system prompt with available tools
-                        print("Creating system prompt...")
-                        print(f"Number of tools: {len(all_tools)}")
-                        
-                        try:
-                            
-                            tools_description = []
-                            for i, tool in enumerate(all_tools):
-                                try:
-                                    # Get tool properties
-                                    params = tool.inputSchema
-                                    desc = getattr(tool, 'description', 'No description available')
-                                    name = getattr(tool, 'name', f'tool_{i}')
-                                    
-                                    # Format the input schema in a more readable way
-                                    if 'properties' in params:
-                                        param_details = []
-                                        for param_name, param_info in params['properties'].items():
-                                            param_type = param_info.get('type', 'unknown')
-                                            param_details.append(f"{param_name}: {param_type}")
-                                        params_str = ', '.join(param_details)
-                                    else:
-                                        params_str = 'no parameters'
-
-                                    tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
-                                    tools_description.append(tool_desc)
-                                    print(f"Added description for tool: {tool_desc}")
-                                except Exception as e:
-                                    print(f"Error processing tool {i}: {e}")
-                                    tools_description.append(f"{i+1}. Error processing tool")
-                            
-                            tools_description = "\n".join(tools_description)
-                            print("Successfully created tools description")
-                        except Exception as e:
-                            print(f"Error creating tools description: {e}")
-                            tools_description = "Error loading tools"
-                        
-                        print("Created system prompt...")
-                        
-                        system_prompt = f"""You are a maths agent solving problems, capable of using gmail to send emails, in iterations. You have access to various mathematical and gmail related tools.
+                tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
+                tools_description.append(tool_desc)
+                print(f"Added description for tool: {tool_desc}")
+            except Exception as e:
+                print(f"Error processing tool {i}: {e}")
+                tools_description.append(f"{i+1}. Error processing tool")
+
+        tools_description = "\n".join(tools_description)
+        print("Successfully created tools description")
+    except Exception as e:
+        print(f"Error creating tools description: {e}")
+        tools_description = "Error loading tools"
+    return tools_description
+
+def build_system_prompt(tools_description):
+    """Build the agent system prompt around the tool list"""
+    system_prompt = f"""You are a maths agent solving problems, capable of using gmail to send emails, in iterations. You have access to various mathematical and gmail related tools.
 
                         Available tools:
                         {tools_description}
@@ -173,7 +372,8 @@ async def main():
                         You must respond with EXACTLY ONE line in one of these formats (no additional text):
                         1. For function calls:
                         FUNCTION_CALL: {{"function": "function_name", "parameters": {{"param1": value1, "param2": value2}}}}
-                        
+                        If several function calls do not depend on each other's results, put each on its own FUNCTION_CALL line in the same response; they run in parallel.
+
                         2. For final answers:
                         FINAL_ANSWER: [number]
 
@@ -181,6 +381,7 @@ async def main():
                         - When a function returns multiple values, you need to process all of them
                         - Only give FINAL_ANSWER when you have completed all necessary calculations
                         - Do not repeat function calls with the same parameters
+                        - A long result is shown as a summary with a reference such as @r1; pass "@r1" as a parameter value to use the full result
                         - After each mathematical operation, verify the result using the verify function
                         - If you are not sure about the result, just stop the process and say "I am not sure about the result"
 
@@ -193,200 +394,764 @@ async def main():
                         - FINAL_ANSWER: [12]
 
                         DO NOT include any explanations or additional text.
-                        Your entire response should be a single line starting with either FUNCTION_CALL: or FINAL_ANSWER:"""
-
-                        query = f"""Find the ASCII values of characters in INDIA, calculate the sum of exponentials of those values, and send the result as an email to {email_address}. """
-                        print("Starting iteration loop...")
-                        
-                        # Use global iteration variables
-                        global iteration, last_response
-                        
-                        while iteration < max_iterations:
-                            print(f"\n--- Iteration {iteration + 1} ---")
-                            if last_response is None:
-                                current_query = query
-                            else:
-                                current_query = current_query + "\n\n" + " ".join(iteration_response)
-                                current_query = current_query + "  What should I do next?"
-
-                            # Get model's response with timeout
-                            print("Preparing to generate LLM response...")
-                            prompt = f"{system_prompt}\n\nQuery: {current_query}"
-                            try:
-                                response = await generate_with_timeout(client, prompt)
-                                response_text = response.text.strip()
-                                print(f"LLM Response: {response_text}")
-                                
-                                # Find the FUNCTION_CALL line in the response
-                                for line in response_text.split('\n'):
-                                    line = line.strip()
-                                    if line.startswith("FUNCTION_CALL:"):
-                                        response_text = line
-                                        break
-                                
-                            except Exception as e:
-                                print(f"Failed to get LLM response: {e}")
-                                break
-
-
-                            if response_text.startswith("FUNCTION_CALL:"):
-                                # _, function_info = response_text.split(":", 1)
-                                # parts = [p.strip() for p in function_info.split("|")]
-                                # func_name, params = parts[0], parts[1:]
-                                #print(f"DEBUG: LLM Response: {response_text}")
-                                func_name, params = parse_llm_response(response_text)
-                                
-                                # print(f"\nDEBUG: Raw function info: {function_info}")
-                                # print(f"DEBUG: Split parts: {parts}")
-                                # print(f"DEBUG: Function name: {func_name}")
-                                # print(f"DEBUG: Raw parameters: {params}")
-                                
-                                try:
-                                    # Find the matching tool to get its input schema
-                                    tool = next((t for t in all_tools if t.name == func_name), None)
-                                    if not tool:
-                                        #print(f"DEBUG: Available tools: {[t.name for t in all_tools]}")
-                                        raise ValueError(f"Unknown tool: {func_name}")
-
-                                    # print(f"DEBUG: Found tool: {tool.name}")
-                                    # print(f"DEBUG: Tool schema: {tool.inputSchema}")
-
-                                    # Prepare arguments according to the tool's input schema
-                                    arguments = {}
-                                    schema_properties = tool.inputSchema.get('properties', {})
-                                    #print(f"DEBUG: Schema properties: {schema_properties}")
-
-                                    for param_name, param_info in schema_properties.items():
-                                        if not params:  # Check if we have enough parameters
-                                            raise ValueError(f"Not enough parameters provided for {func_name}")
-
-                                        #print(f"DEBUG: Parameters: {params}")    
-                                        value = params.pop(0)  # Get and remove the first parameter
-                                        param_type = param_info.get('type', 'string')
-                                        
-                                        #print(f"DEBUG: Converting parameter {param_name} with value {value} to type {param_type}")
-                                        
-                                        # Convert the value to the correct type based on the schema
-                                        if param_type == 'integer':
-                                            arguments[param_name] = int(value)
-                                        elif param_type == 'number':
-                                            # If the value is a list, convert it to a string first
-                                            if isinstance(value, list):
-                                                arguments[param_name] = str(value)  # This will be evaluated by the verify function
-                                            else:
-                                                arguments[param_name] = float(value)
-                                        elif param_type == 'array':
-                                            # Handle array input
-                                            if isinstance(value, str):
-                                                value = value.strip('[]').split(',')
-                                            # # Check array item type from schema
-                                            # items_type = param_info.get('items', {}).get('type', 'string')
-                                            # print(f"DEBUG: Array item type: {items_type}")
-                                            # print(f"DEBUG: param_info: {param_info}")
-
-                                            # if items_type == 'integer':
-                                            #     arguments[param_name] = [int(x.strip()) for x in value]
-                                            # elif items_type == 'number':
-                                            #     arguments[param_name] = [float(x.strip()) for x in value]
-                                            # else:
-                                            #     # Default to string array if type not specified or is string
-                                            #     arguments[param_name] = [x.strip() for x in value]
-                                            # #arguments[param_name] = [int(x.strip()) for x in value]
-
-                                            # Check if it's an integer array based on title or items
-                                            is_integer_array = 'Int List' in param_info.get('title', '')
-                                            #print(f"DEBUG: param_info: {param_info}")
-                                            #print(f"DEBUG: Is integer array: {is_integer_array}")
-                                            
-                                            if is_integer_array:
-                                                arguments[param_name] = [int(x) if not isinstance(x, int) else x for x in value]
-                                            else:
-                                                # Default to string array if not integer array
-                                                arguments[param_name] = [str(x) for x in value]
-
-                                        else:
-                                            arguments[param_name] = str(value)
-
-                                    # print(f"DEBUG: Final arguments: {arguments}")
-                                    # print(f"DEBUG: Calling tool {func_name}")
-                                    
-                                    if func_name in math_tool_names:
-                                        result = await session.call_tool(func_name, arguments=arguments)
-                                    else:
-                                        result = await gmail_session.call_tool(func_name, arguments=arguments)
-                                    #print(f"Result error variable {result.isError}")
-                                    #print(f"DEBUG: Raw result: {result}")
-                                    if func_name == "verify":
-                                        print("\n=== Verification Results ===")
-                                        print(f"Expression: {arguments['expression']}")
-                                        print(f"Expected: {arguments['expected']}")
-                                        if hasattr(result, 'content'):
-                                            result_text = result.content[0].text if isinstance(result.content, list) else result.content.text
-                                            
-                                           
-                                            if result_text.lower() == 'true':
-                                                print("✅ VERIFICATION PASSED!")
-                                                print("========================")
-                                                print(f"✨ Verified that {arguments['expression']} equals {arguments['expected']}")
-                                            elif result_text.lower() == 'false':
-                                                print("❌ VERIFICATION FAILED!")
-                                            else:
-                                                print(f"❌ Error: {result_text}")
-                                            
-                                        print("==========================\n")
-
-                                    # Get the full result content
-                                    if hasattr(result, 'content'):
-                                        #print(f"DEBUG: Result has content attribute")
-                                        # Handle multiple content items
-                                        if isinstance(result.content, list):
-                                            iteration_result = [
-                                                item.text if hasattr(item, 'text') else str(item)
-                                                for item in result.content
-                                            ]
-                                        else:
-                                            iteration_result = str(result.content)
-                                    else:
-                                        #print(f"DEBUG: Result has no content attribute")
-                                        iteration_result = str(result)
-                                        
-                                    #print(f"DEBUG: Final iteration result: {iteration_result}")
-                                    
-                                    # Format the response based on result type
-                                    if isinstance(iteration_result, list):
-                                        result_str = f"[{', '.join(iteration_result)}]"
-                                    else:
-                                        result_str = str(iteration_result)
-                                    
-                                    iteration_response.append(
-                                        f"In the {iteration + 1} iteration you called {func_name} with {arguments} parameters, "
-                                        f"and the function returned {result_str}."
-                                    )
-                                    last_response = iteration_result
-
-                                except Exception as e:
-                                    # print(f"DEBUG: Error details: {str(e)}")
-                                    # print(f"DEBUG: Error type: {type(e)}")
-                                    import traceback
-                                    traceback.print_exc()
-                                    iteration_response.append(f"Error in iteration {iteration + 1}: {str(e)}")
-                                    break
-
-                            elif response_text.startswith("FINAL_ANSWER:"):
-                                print("\n=== Agent Execution Complete ===")
-
-                                break
-
-                            iteration += 1
+                        Your entire response should be a single line starting with either FUNCTION_CALL: or FINAL_ANSWER:, or several FUNCTION_CALL: lines for independent calls"""
+    print("Created system prompt...")
+    return system_prompt
+
+# System prompt for native function calling: the tool list and call format come from the
+# function declarations, so only the working method and the final answer format remain
+native_system_prompt = """You are a maths agent solving problems in iterations, capable of using gmail to send emails. Use the provided functions for the mathematical and gmail steps.
+
+First, show reasoning with show_reasoning, breaking the problem into steps tagged with the type of reasoning used (e.g. "Arithmetic", "Logical", "Entity lookup"). Then process the steps. After each mathematical operation, verify the result with the verify function before moving on. Calls that do not depend on each other's results may be made together; they run in parallel. Do not repeat a call with the same parameters.
+
+A long result is shown as a summary with a reference such as @r1; pass "@r1" as a parameter value to use the full result.
+
+When all calculations are done, reply with exactly one line: FINAL_ANSWER: [number]. If you are not sure about the result, stop and say "I am not sure about the result"."""
+
+def build_plan_prompt(tools_description):
+    """Build the plan-mode system prompt: the whole task as one DAG of tool calls"""
+    system_prompt = f"""You are a maths agent solving problems, capable of using gmail to send emails. You have access to various mathematical and gmail related tools.
+
+                        Available tools:
+                        {tools_description}
+
+                        Plan the whole task up front. Break it into steps, and after each mathematical step add a verify step that checks it. The steps are run for you without asking you again; you only hear back if a step fails or a verification does not pass.
+
+                        You must respond with EXACTLY ONE line in one of these formats (no additional text):
+                        1. For a plan:
+                        PLAN: {{"steps": [{{"id": "step_id", "function": "function_name", "parameters": {{"param1": value1}}}}, ...], "final_answer": "$step_id"}}
+                        A parameter written as "$step_id" is replaced by the full output of that earlier step; "${{step_id}}" inside a longer string is replaced by its text. Steps that do not reference each other run in parallel. Long results from earlier attempts are shown as summaries with a reference such as @r1, which can be passed as a parameter value the same way.
+
+                        2. For final answers, when no tool calls are needed:
+                        FINAL_ANSWER: [number]
+
+                        Example:
+                        PLAN: {{"steps": [{{"id": "ascii", "function": "strings_to_chars_to_int", "parameters": {{"string": "INDIA"}}}}, {{"id": "check_ascii", "function": "verify", "parameters": {{"expression": "[ord(c) for c in 'INDIA']", "expected": "$ascii"}}}}, {{"id": "total", "function": "int_list_to_exponential_sum", "parameters": {{"int_list": "$ascii"}}}}, {{"id": "check_total", "function": "verify", "parameters": {{"expression": "sum(math.exp(x) for x in [73, 78, 68, 73, 65])", "expected": "$total"}}}}], "final_answer": "$total"}}
+
+                        DO NOT include any explanations or additional text."""
+    print("Created plan prompt...")
+    return system_prompt
+
+@contextmanager
+def phase(state, name, span_name, **attributes):
+    """Time one phase of an iteration and trace it as a span"""
+    start = time.perf_counter()
+    try:
+        with tracer.span(span_name, **attributes) as span:
+            yield span
+    finally:
+        state.add_timing(name, time.perf_counter() - start)
+
+async def generate_step(state, iteration, contents, step_type, tools=None):
+    """Next model response for this step, replayed from the run journal while resuming"""
+    journal = state.journal
+    system_instruction = state.conversation.system_prompt
+    if journal is not None and journal.replaying:
+        response = journal.replayed_response(iteration, contents, system_instruction)
+        if response is not None:
+            state.log("Replayed the LLM response from the journal")
+            return response
+        state.log("Journal replay ends here; continuing live")
+    state.llm_calls += 1
+    response = await generate_with_timeout(
+        router,
+        contents,
+        system_instruction=system_instruction,
+        budget=state.llm_budget,
+        step_type=step_type,
+        tools=tools,
+        deadline=state.deadline
+    )
+    if journal is not None:
+        journal.record_response(iteration, contents, system_instruction, response.text, step_type)
+    return response
+
+async def call_tool_step(state, binding, func_name, arguments, iteration):
+    """Call a tool, or take its recorded result from the run journal while resuming"""
+    journal = state.journal
+    if journal is not None:
+        result = journal.replayed_tool(iteration, func_name, arguments)
+        if result is not None:
+            return result
+    result = await binding.call(arguments)
+    if journal is not None:
+        journal.record_tool(iteration, func_name, arguments, result)
+    return result
+
+async def execute_tool_call(ctx, state, func_name, params, iteration):
+    """Coerce the arguments, call the tool on its server and format the result"""
+    # O(1) lookup of the precompiled tool; arguments are bound by name
+    with phase(state, "coerce", "tool.coerce", tool=func_name):
+        binding = ctx.dispatcher.get(func_name)
+        arguments = binding.bind(state.results.resolve(params))
+
+    with phase(state, "tool_call", "mcp.call_tool", tool=func_name, server=binding.server, pure=binding.pure) as span:
+        result = await call_tool_step(state, binding, func_name, arguments, iteration)
+        span.set_attribute("is_error", bool(getattr(result, "isError", False)))
 
+    with phase(state, "format", "tool.format", tool=func_name) as span:
+        if func_name == "verify":
+            state.log("\n=== Verification Results ===")
+            state.log(f"Expression: {arguments['expression']}")
+            state.log(f"Expected: {arguments['expected']}")
+            if hasattr(result, 'content'):
+                result_text = result.content[0].text if isinstance(result.content, list) else result.content.text
+
+
+                if result_text.lower() == 'true':
+                    state.log("✅ VERIFICATION PASSED!")
+                    state.log("========================")
+                    state.log(f"✨ Verified that {arguments['expression']} equals {arguments['expected']}")
+                elif result_text.lower() == 'false':
+                    state.log("❌ VERIFICATION FAILED!")
+                else:
+                    state.log(f"❌ Error: {result_text}")
+
+            state.log("==========================\n")
+
+        # Get the full result content
+        if hasattr(result, 'content'):
+            # Handle multiple content items
+            if isinstance(result.content, list):
+                iteration_result = [
+                    item.text if hasattr(item, 'text') else str(item)
+                    for item in result.content
+                ]
+            else:
+                iteration_result = str(result.content)
+        else:
+            iteration_result = str(result)
+
+        # Format the response based on result type
+        if isinstance(iteration_result, list):
+            result_str = f"[{', '.join(iteration_result)}]"
+        else:
+            result_str = str(iteration_result)
+
+        # Stored results stay referenced in the echoed call instead of being spelled out
+        shown = params if state.results.has_references(params) else arguments
+        call_str = f"In the {iteration + 1} iteration you called {func_name} with {shown} parameters"
+        span.set_attribute("result_size", len(result_str))
+        result_str = state.results.render(tool_value(result)[0], result_str, source=func_name)
+        span.set_attribute("prompt_result_size", len(result_str))
+    return call_str, result_str, iteration_result
+
+async def run_agent(ctx, state):
+    """Run the iteration loop for one query until a final answer or max_iterations"""
+    if run_timeout > 0 and state.deadline is None:
+        state.deadline = asyncio.get_running_loop().time() + run_timeout
+    if state.journal is None and use_journal:
+        state.journal = RunJournal.create(journal_dir, state.query, agent_mode, max_runs=journal_max_runs,
+                                          fsync_interval=journal_fsync_interval)
+    if state.journal is not None:
+        state.log(f"Run {state.journal.run_id} (journal {state.journal.path})")
+    mode = state.journal.mode if state.journal is not None else agent_mode
+    with tracer.span("agent.run", agent_id=state.agent_id, query=state.query) as run_span:
+        try:
+            if mode == "plan":
+                return await _run_plan_loop(ctx, state)
+            await _run_agent_loop(ctx, state)
+            monitor = state.monitor
+            if monitor is not None and monitor.switched:
+                state.log("Switching to plan mode")
+                state.iteration += 1
+                calls_before = state.llm_calls
+                await _run_plan_loop(ctx, state)
+                monitor.calls_saved = max(0, monitor.calls_saved - (state.llm_calls - calls_before))
+            return state
+        finally:
+            if state.monitor is not None and state.monitor.tripped:
+                state.log(f"Convergence: {state.monitor.stats()}")
+            if state.journal is not None:
+                state.journal.finish(state.final_answer, state.error, state.llm_calls)
+                if state.final_answer is not None and state.error is None and not journal_keep_completed:
+                    state.journal.discard()
+                state.log(f"Journal: {state.journal.stats()}")
+            run_span.set_attribute("iterations", state.iteration + 1)
+            run_span.set_attribute("llm_calls", state.llm_calls)
+            run_span.set_attribute("final_answer", state.final_answer)
+            tracer.flush()
+
+def expand_tools(ctx, state, names, plan=False):
+    """Widen the agent's tool set to cover `names`; returns False if some tool does not exist
+
+    Known tools are added to the prompt. An unknown name means the model is
+    missing something, so the prompt falls back to the full catalog.
+    """
+    if state.tool_names is None:
+        return True
+    missing = set(names) - state.tool_names
+    if not missing:
+        return True
+    if missing <= ctx.dispatcher.bindings.keys():
+        state.log(f"Adding tools outside the retrieved set: {', '.join(sorted(missing))}")
+        state.tool_names = state.tool_names | missing
+        state.conversation.set_system_prompt(ctx.prompt_for(state.tool_names, plan))
+        return True
+    state.log(f"Unknown tools {', '.join(sorted(missing))}, expanding to the full tool list")
+    state.tool_names = None
+    state.conversation.set_system_prompt(ctx.prompt_for(None, plan))
+    return False
+
+def classify_step(state, iteration):
+    """Step type of the next generation, which picks its model route"""
+    last_turn = state.conversation.turns[-1]
+    if iteration == 0 or last_turn.kind in ("error", "note"):
+        return "planning"
+    if iteration >= max_iterations - 1 or state.last_tools & final_tools:
+        return "final"
+    return "routine"
+
+def handle_no_progress(state, verdict, iteration):
+    """Apply loop_action to a tripped convergence monitor; returns a hint for the model, or None to stop the loop"""
+    monitor = state.monitor
+    state.log(f"⚠️ No progress: {verdict}")
+    state.emit("stall", iteration=iteration + 1, kind=verdict.kind, detail=verdict.detail)
+    if loop_action == "hint" and monitor.hints < max_loop_hints:
+        monitor.hints += 1
+        monitor.reset()
+        return (f"{verdict}. Repeating this will not change the result: use the results you already have to give "
+                "FINAL_ANSWER, or take a different step.")
+    # A run that keeps cycling would otherwise spend every remaining iteration
+    monitor.calls_saved += max_iterations - (iteration + 1)
+    if loop_action == "plan":
+        monitor.switched = True
+    else:
+        monitor.aborted = True
+        state.error = f"Stopped after {iteration + 1} iterations: {verdict}"
+    return None
+
+def ask_again(state, message, reason, iteration):
+    """Answer a response without a usable action with a corrective note; returns False once the run should stop"""
+    verdict = state.monitor.observe_stall(reason) if state.monitor is not None else None
+    if verdict is not None:
+        hint = handle_no_progress(state, verdict, iteration)
+        if hint is None:
+            return False
+        message = f"{hint} {message}"
+    state.conversation.add_user_message(message)
+    return True
+
+def scheduling_priority(state, step_type):
+    """Rate-limit queue priority: agents closer to finishing go first"""
+    if step_type == "final":
+        return 1.0
+    return min(1.0, state.llm_calls / max_iterations)
+
+async def _run_agent_loop(ctx, state):
+    state.started_at = time.perf_counter()
+    state.tool_names = ctx.select_tools(state.query)
+    if state.tool_names is not None:
+        state.log(f"Retrieved {len(state.tool_names)} tools: {', '.join(sorted(state.tool_names))}")
+    state.conversation = ConversationState(
+        ctx.prompt_for(state.tool_names),
+        state.query,
+        compaction=CompactionPolicy(max_tokens=context_token_budget)
+    )
+    state.log("Starting iteration loop...")
+    try:
+        while state.iteration < max_iterations:
+            iteration = state.iteration
+            with tracer.span("agent.iteration", iteration=iteration + 1):
+                if not await run_iteration(ctx, state, iteration):
+                    break
+            state.end_iteration(iteration)
+            state.iteration += 1
+    finally:
+        state.end_iteration(state.iteration)
+        state.finished_at = time.perf_counter()
+    return state
+
+async def run_iteration(ctx, state, iteration):
+    """One generate -> parse -> dispatch round; returns False once the run should stop"""
+    conversation = state.conversation
+    state.log(f"\n--- Iteration {iteration + 1} ---")
+
+    # Get model's response with timeout
+    state.log("Preparing to generate LLM response...")
+    state.log(f"Conversation: {len(conversation)} turns, ~{conversation.total_tokens} tokens")
+    try:
+        with phase(state, "prompt_build", "agent.prompt_build") as span:
+            contents = conversation.to_contents()
+            span.set_attribute("prompt_turns", len(contents))
+            span.set_attribute("prompt_tokens", conversation.total_tokens)
+        step_type = classify_step(state, iteration)
+        with phase(state, "generation", "llm.generate", prompt_tokens=conversation.total_tokens,
+                   step_type=step_type, model=router.route(step_type).model) as span, \
+                request_context(state.agent_id, scheduling_priority(state, step_type)) as request:
+            tools = ctx.declarations_for(state.tool_names) if native_tools else None
+            response = await generate_step(state, iteration, contents, step_type, tools=tools)
+            span.set_attribute("response_chars", len(response.text or ""))
+            span.set_attribute("replayed", getattr(response, "replayed", False))
+            span.set_attribute("cached", getattr(response, "cached", False))
+            span.set_attribute("queue_wait", request.queue_wait)
+        state.add_timing("queue_wait", request.queue_wait)
+        with phase(state, "parse", "llm.parse") as span:
+            response_text = response.text.strip()
+            state.log(f"LLM Response: {response_text}")
+            state.emit("llm_response", iteration=iteration + 1, text=response_text)
+
+            # Find the FUNCTION_CALL lines in the response (native calls arrive as canonical lines)
+            function_calls = [
+                line.strip() for line in response_text.split('\n')
+                if line.strip().startswith("FUNCTION_CALL:")
+            ]
+            calls = []
+            parse_error = None
+            try:
+                calls = [parse_llm_response(line) for line in function_calls]
+            except ValueError as e:
+                parse_error = e
+            # With native function calling, calls and their results go back as structured parts
+            native = native_tools and bool(calls)
+            conversation.add_model_response(response_text, parts=model_call_parts(calls) if native else None)
+            if function_calls:
+                response_text = function_calls[0]
+            span.set_attribute("function_calls", len(function_calls))
+
+    except Exception as e:
+        state.log(f"Failed to get LLM response: {e}")
+        state.error = str(e) or type(e).__name__
+        return False
+
+
+    if parse_error is not None:
+        state.log(f"Could not parse the function call: {parse_error}")
+        return ask_again(state, f"{parse_error}. Respond with valid FUNCTION_CALL: lines or a FINAL_ANSWER: line.",
+                         "unparseable FUNCTION_CALL line", iteration)
+
+    if calls:
+        names = [func_name for func_name, _ in calls]
+        if not expand_tools(ctx, state, names):
+            message = "That tool does not exist. The full tool list is now available; choose from it."
+            conversation.add_user_message(
+                message,
+                parts=function_response_parts(names, [message] * len(names)) if native else None
+            )
+            return True
+        if len(calls) > 1:
+            state.log(f"Running {len(calls)} independent function calls in parallel")
+        state.last_tools = {func_name for func_name, _ in calls}
+
+        # Independent calls run concurrently across both sessions; results
+        # are fed back in the order the model emitted the calls
+        with phase(state, "tools_wall", "agent.tools", calls=len(calls)):
+            outcomes = await asyncio.gather(
+                *(execute_tool_call(ctx, state, func_name, params, iteration) for func_name, params in calls),
+                return_exceptions=True
+            )
+
+        results = []
+        summaries = []
+        observed = []
+        failed = None
+        for (func_name, params), outcome in zip(calls, outcomes):
+            if isinstance(outcome, BaseException):
+                import traceback
+                traceback.print_exception(outcome)
+                results.append(f"Error in iteration {iteration + 1}: {str(outcome)}")
+                summaries.append(results[-1])
+                failed = failed or outcome
+                continue
+            call_str, result_str, iteration_result = outcome
+            results.append(f"{call_str}, and the function returned {result_str}.")
+            state.emit("tool_result", iteration=iteration + 1, text=results[-1])
+            summaries.append(f"{call_str} (result omitted to save space).")
+            observed.append((func_name, params, result_str))
+            state.last_response = iteration_result
+
+        if failed is not None:
+            conversation.add_error(" ".join(results))
+            state.error = str(failed)
+            return False
+        next_step = "What should I do next?"
+        verdict = state.monitor.observe_calls(observed) if state.monitor is not None else None
+        if verdict is not None:
+            next_step = handle_no_progress(state, verdict, iteration)
+            if next_step is None:
+                return False
+        parts = summary_parts = None
+        if native:
+            parts = function_response_parts(names, [result for _, _, result in observed], note=next_step)
+            summary_parts = function_response_parts(names, ["(result omitted to save space)"] * len(names), note=next_step)
+        conversation.add_tool_result(
+            " ".join(results) + " " + next_step,
+            summary=" ".join(summaries) + " " + next_step,
+            parts=parts,
+            summary_parts=summary_parts
+        )
+
+    elif response_text.startswith("FINAL_ANSWER:"):
+        state.log("\n=== Agent Execution Complete ===")
+        state.final_answer = state.results.expand(response_text.replace("FINAL_ANSWER:", "", 1).strip())
+        return False
+
+    else:
+        # Keep the roles alternating so the next turn is well formed
+        return ask_again(state, "Respond with a single FUNCTION_CALL: or FINAL_ANSWER: line.",
+                         "no FUNCTION_CALL or FINAL_ANSWER line", iteration)
+    return True
+
+async def _run_plan_loop(ctx, state):
+    # Also entered after a stalled loop run, whose iterations keep counting
+    state.started_at = state.started_at or time.perf_counter()
+    first = state.iteration
+    state.tool_names = ctx.select_tools(state.query)
+    if state.tool_names is not None:
+        state.log(f"Retrieved {len(state.tool_names)} tools: {', '.join(sorted(state.tool_names))}")
+    state.conversation = ConversationState(
+        ctx.prompt_for(state.tool_names, plan=True),
+        state.query,
+        compaction=CompactionPolicy(max_tokens=context_token_budget)
+    )
+    state.log("Starting plan-then-execute...")
+    try:
+        # One planning call, plus one more per failed attempt
+        while state.iteration - first <= max_replans:
+            iteration = state.iteration
+            with tracer.span("agent.plan", attempt=iteration + 1):
+                if not await run_plan_attempt(ctx, state, iteration):
+                    break
+            state.end_iteration(iteration)
+            state.iteration += 1
+        else:
+            state.iteration -= 1
+            state.error = state.error or f"No working plan after {max_replans} replans"
+    finally:
+        state.end_iteration(state.iteration)
+        state.finished_at = time.perf_counter()
+    return state
+
+async def run_plan_attempt(ctx, state, iteration):
+    """Ask for a plan and run it; returns True when the model should be asked to replan"""
+    conversation = state.conversation
+    state.log(f"\n--- Plan attempt {iteration + 1} ---")
+    try:
+        with phase(state, "prompt_build", "agent.prompt_build") as span:
+            contents = conversation.to_contents()
+            span.set_attribute("prompt_tokens", conversation.total_tokens)
+        with phase(state, "generation", "llm.generate", prompt_tokens=conversation.total_tokens,
+                   step_type="planning", model=router.route("planning").model) as span, \
+                request_context(state.agent_id, scheduling_priority(state, "planning")) as request:
+            response = await generate_step(state, iteration, contents, "planning")
+            span.set_attribute("replayed", getattr(response, "replayed", False))
+            span.set_attribute("cached", getattr(response, "cached", False))
+            span.set_attribute("queue_wait", request.queue_wait)
+        state.add_timing("queue_wait", request.queue_wait)
+    except Exception as e:
+        state.log(f"Failed to get LLM response: {e}")
+        state.error = str(e) or type(e).__name__
+        return False
+
+    response_text = response.text.strip()
+    state.log(f"LLM Response: {response_text}")
+    state.emit("llm_response", iteration=iteration + 1, text=response_text)
+    conversation.add_model_response(response_text)
+    lines = [line.strip() for line in response_text.split("\n")]
+    plan_line = next((line for line in lines if line.startswith("PLAN:")), None)
+    answer_line = next((line for line in lines if line.startswith("FINAL_ANSWER:")), None)
+
+    if plan_line is None:
+        if answer_line is not None:
+            state.final_answer = state.results.expand(answer_line.replace("FINAL_ANSWER:", "", 1).strip())
+            return False
+        conversation.add_user_message("Respond with a single PLAN: or FINAL_ANSWER: line.")
+        return True
+
+    with phase(state, "parse", "plan.parse") as span:
+        try:
+            plan = parse_plan(plan_line)
+        except PlanError as e:
+            state.log(f"Invalid plan: {e}")
+            conversation.add_error(f"Your plan could not be used: {e}. Respond with a corrected PLAN: line.")
+            return True
+        span.set_attribute("steps", len(plan.steps))
+    if not expand_tools(ctx, state, [step.function for step in plan.steps], plan=True):
+        conversation.add_user_message(
+            "Your plan uses a tool that does not exist. The full tool list is now available; respond with a revised PLAN: line."
+        )
+        return True
+    state.log(f"Executing plan with {len(plan.steps)} steps")
+
+    async def run_step(step, arguments):
+        with tracer.span("plan.step", step=step.id, tool=step.function):
+            binding = ctx.dispatcher.get(step.function)
+            result = await call_tool_step(state, binding, step.function,
+                                          binding.bind(state.results.resolve(arguments)), iteration)
+            output = [getattr(item, 'text', item) for item in getattr(result, 'content', [])]
+            state.log(f"  {step.id}: {step.function}({arguments}) -> {output}")
+            state.emit("tool_result", iteration=iteration + 1, step=step.id, tool=step.function,
+                       text=f"{step.id}: {step.function} returned {output}")
+            return result
+
+    with phase(state, "tools_wall", "plan.execute", steps=len(plan.steps)) as span:
+        result = await execute_plan(plan, run_step, has_side_effects=lambda step: step.function not in pure_tools)
+        span.set_attribute("failed", len(result.failed))
+
+    if result.ok:
+        state.log("\n=== Agent Execution Complete ===")
+        state.last_response = result.final_answer
+        state.final_answer = f"[{result.final_answer}]" if result.final_answer is not None else "[done]"
+        return False
+
+    for outcome in result.failed:
+        state.log(f"Step {outcome.step.id} failed: {outcome.error}")
+    conversation.add_tool_result(
+        f"The plan was run with these results:\n{result.describe(render=state.results.render)}\n"
+        "Respond with a revised PLAN: for the remaining work (you may use the returned values directly), "
+        "or FINAL_ANSWER: if the task is already done."
+    )
+    return True
+
+async def build_context(servers):
+    """Build the agent context, from the catalog cache when every server is a hit"""
+    fingerprints = {conn.name: server_fingerprint(conn.config) for conn in servers}
+    key = prompt_key(list(fingerprints.values()), build_system_prompt("") + ",".join(sorted(excluded_tools)))
+    cached = {name: catalog_cache.get_tools(fp) for name, fp in fingerprints.items()} if use_catalog_cache else {}
+
+    if use_catalog_cache and all(tools is not None for tools in cached.values()):
+        # Cache hit: the prompt is ready before the servers finish starting, and the
+        # live catalogs are checked in the background
+        print("Using cached tool catalogs")
+        cached_prompt = catalog_cache.get_prompt(key)
+        ctx = AgentContext(servers, cached, system_prompt=cached_prompt)
+        if cached_prompt is None:
+            catalog_cache.put_prompt(key, ctx.system_prompt)
+            catalog_cache.save()
+        ctx.catalog_task = asyncio.create_task(check_catalog(ctx, servers, cached, fingerprints, key))
+        return ctx
+
+    await servers.wait_ready()
+    servers.print_report()
+    ctx = AgentContext(servers)
+    ctx.catalog_checked.set()
+    if use_catalog_cache:
+        for conn in servers:
+            catalog_cache.put_tools(fingerprints[conn.name], conn.tools)
+        catalog_cache.put_prompt(key, ctx.system_prompt)
+        catalog_cache.save()
+    return ctx
+
+async def check_catalog(ctx, servers, cached, fingerprints, key):
+    """Compare the cached catalogs with the live list_tools() results once servers are up"""
+    await servers.wait_ready()
+    servers.print_report()
+    live = {conn.name: conn.tools for conn in servers}
+    stale = [name for name in live if not tools_equal(cached[name], live[name])]
+    if stale:
+        print(f"Tool catalog changed for {', '.join(stale)}, refreshing cache")
+        ctx.load_catalog(live)
+        for name in stale:
+            catalog_cache.put_tools(fingerprints[name], live[name])
+        catalog_cache.put_prompt(key, ctx.system_prompt)
+        catalog_cache.save()
+    ctx.catalog_checked.set()
+
+async def connect_and_run(handler):
+    """Start all MCP servers concurrently, build the shared context and hand it to `handler`"""
+    async with ConnectionManager(server_configs, wait_for_ready=False) as servers:
+        ctx = await build_context(servers)
+        if ctx.catalog_task is None:
+            return await handler(ctx)
+
+        # Agents may already be generating while the servers finish starting; a
+        # startup failure has to stop them instead of leaving tool calls waiting
+        handler_task = asyncio.create_task(handler(ctx))
+        ctx.catalog_task.add_done_callback(
+            lambda task: handler_task.cancel() if not task.cancelled() and task.exception() else None
+        )
+        try:
+            return await handler_task
+        except asyncio.CancelledError:
+            if ctx.catalog_task.done() and not ctx.catalog_task.cancelled() and ctx.catalog_task.exception():
+                raise ctx.catalog_task.exception()
+            raise
+        finally:
+            if not ctx.catalog_task.done():
+                ctx.catalog_task.cancel()
+
+async def main(query=None, resume_run=None):
+    print("Starting main execution...")
+    try:
+        if resume_run is not None:
+            journal = RunJournal.load(journal_dir, resume_run, fsync_interval=journal_fsync_interval)
+            print(f"Resuming run {resume_run} ({journal.mode} mode): {journal.query}")
+            state = AgentState(journal.query)
+            state.journal = journal
+        else:
+            state = AgentState(query or default_query)
+        return await connect_and_run(lambda ctx: run_agent(ctx, state))
     except Exception as e:
         print(f"Error in main execution: {e}")
         import traceback
         traceback.print_exc()
-    finally:
-        reset_state()  # Reset at the end of main
+
+def load_queries(path):
+    """Read one query per line, skipping blank lines and # comments"""
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            queries.append(line.replace("{email_address}", email_address or ""))
+    return queries
+
+def print_batch_report(states, wall_time, servers=()):
+    """Print throughput and latency figures for a finished batch"""
+    latencies = [s.elapsed for s in states if s.elapsed is not None]
+    completed = [s for s in states if s.final_answer is not None]
+    print("\n=== Batch Report ===")
+    print(f"Queries: {len(states)} ({len(completed)} answered, {len(states) - len(completed)} failed or unfinished)")
+    print(f"Wall time: {wall_time:.2f}s")
+    print(f"Throughput: {len(states) / wall_time:.2f} queries/s" if wall_time > 0 else "Throughput: n/a")
+    print(f"LLM calls: {sum(s.llm_calls for s in states)}")
+    print(f"LLM latency: {llm.stats()}")
+    if scheduler.enabled:
+        print(f"LLM rate limit: {scheduler.stats()}")
+    for line in router.report():
+        print(f"  {line}")
+    if llm_cache.enabled:
+        print(f"LLM cache ({llm_cache.mode}): {llm_cache.hits} hits, {llm_cache.misses} misses")
+    if tool_memo is not None:
+        print(f"Tool memo: {tool_memo.stats()}")
+    tripped = [s.monitor for s in states if s.monitor is not None and s.monitor.tripped]
+    if tripped:
+        print(f"Loop detection: {len(tripped)} runs cycled or stalled "
+              f"({sum(m.switched for m in tripped)} switched to plan mode, {sum(m.aborted for m in tripped)} aborted), "
+              f"{sum(m.calls_saved for m in tripped)} LLM calls saved")
+    stored = [s.results for s in states if s.results.results]
+    if stored:
+        print(f"Large results: {sum(len(r.results) for r in stored)} stored, "
+              f"{sum(r.chars_saved for r in stored)} chars kept out of prompts")
+    for conn in servers:
+        if isinstance(conn.session, ServerPool):
+            print(f"Server {conn.session.report()}")
+    if latencies:
+        print(f"Latency p50: {percentile(latencies, 50):.2f}s  p95: {percentile(latencies, 95):.2f}s  max: {max(latencies):.2f}s")
+    for s in states:
+        outcome = s.final_answer if s.final_answer is not None else f"error: {s.error}" if s.error else "no answer"
+        elapsed = f"{s.elapsed:.2f}s" if s.elapsed is not None else "n/a"
+        print(f"  [{s.agent_id}] {s.iteration + 1} iterations, {elapsed} -> {outcome}")
+    print("====================")
+
+async def run_batch(queries, parallelism=4):
+    """Run each query as an independent agent over one shared pair of sessions"""
+    semaphore = asyncio.Semaphore(parallelism)
+    states = [AgentState(query, agent_id=f"agent-{i + 1}") for i, query in enumerate(queries)]
+
+    async def run_one(ctx, state):
+        async with semaphore:
+            try:
+                await run_agent(ctx, state)
+            except Exception as e:
+                # One failing agent must not take the rest of the batch down
+                state.log(f"Agent failed: {e}")
+                state.error = str(e)
+
+    async def handler(ctx):
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one(ctx, state) for state in states))
+        print_batch_report(states, time.perf_counter() - start, ctx.servers)
+        return states
+
+    print(f"Running {len(queries)} queries with parallelism {parallelism}...")
+    return await connect_and_run(handler)
+
+async def serve(socket_path=DEFAULT_SOCKET, parallelism=4):
+    """Keep the servers, sessions and LLM client warm and answer queries from the daemon socket"""
+    async def handler(ctx):
+        async def run_query(query, agent_id, emit):
+            state = AgentState(query, agent_id=agent_id)
+            state.listener = emit
+            await run_agent(ctx, state)
+            return {
+                "final_answer": state.final_answer,
+                "error": state.error,
+                "iterations": state.iteration + 1,
+                "llm_calls": state.llm_calls,
+                "elapsed": state.elapsed,
+            }
+
+        def health():
+            info = {
+                "servers": {conn.name: conn.ready.is_set() for conn in ctx.servers},
+                "pools": [conn.session.report() for conn in ctx.servers if isinstance(conn.session, ServerPool)],
+                "catalog_checked": ctx.catalog_checked.is_set(),
+                "llm_in_flight": llm.in_flight,
+                "llm_waiting": llm.waiting,
+                "llm_latency": llm.stats(),
+                "llm_latency_histogram": {model: window.histogram() for model, window in llm.latencies.items()},
+                "models": router.report(),
+                "llm_queue_depth": scheduler.queue_depth,
+                "llm_scheduler": scheduler.stats(),
+            }
+            if tool_memo is not None:
+                info["tool_memo"] = tool_memo.stats()
+            return info
+
+        daemon = AgentDaemon(run_query, socket_path=socket_path, max_concurrent=parallelism, health=health)
+        await daemon.serve_forever()
+
+    return await connect_and_run(handler)
 
 if __name__ == "__main__":
-    asyncio.run(main())
-    
-    
+    parser = argparse.ArgumentParser(description="Maths agent talking to MCP servers")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream LLM output and dispatch as soon as an action line arrives")
+    parser.add_argument("--llm-cache", choices=["off", "record", "replay"],
+                        help="LLM response cache mode (overrides LLM_CACHE_MODE)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="append per-iteration spans to FILE as JSON lines (overrides AGENT_TRACE)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="serve the calculator in-process over memory streams (MATH_TRANSPORT=memory)")
+    parser.add_argument("--top-k-tools", type=int, metavar="K",
+                        help="list only the K most relevant tools in each query's prompt (TOOL_RETRIEVAL_K)")
+    parser.add_argument("--math-pool", type=int, metavar="N",
+                        help="run N calculator server processes and load-balance pure tools (MATH_POOL_SIZE)")
+    parser.add_argument("--native-tools", action="store_true",
+                        help="use the model's native function calling instead of FUNCTION_CALL: lines (LLM_NATIVE_TOOLS=1)")
+    parser.add_argument("--plan", action="store_true",
+                        help="plan the whole task in one LLM call and run it as a DAG (AGENT_MODE=plan)")
+    parser.add_argument("--on-loop", choices=["hint", "plan", "abort", "off"],
+                        help="what to do when the model cycles or stalls (overrides LOOP_ACTION)")
+    parser.add_argument("--run-timeout", type=float, metavar="SECONDS",
+                        help="deadline for each agent run's LLM calls, 0 for none (overrides AGENT_RUN_TIMEOUT)")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="replay a journaled run's completed steps and continue it live")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run every query in FILE (one per line) as an independent agent")
+    parser.add_argument("--parallel", type=int, default=4,
+                        help="maximum number of agents running at once in batch and daemon mode")
+    parser.add_argument("--serve", nargs="?", const=DEFAULT_SOCKET, metavar="SOCKET",
+                        help="run as a long-lived daemon answering queries on a Unix socket (see daemon.py)")
+    args = parser.parse_args()
+    if args.stream:
+        stream_responses = True
+    if args.in_process:
+        server_configs[0].transport = "memory"
+    if args.math_pool:
+        server_configs[0].pool_size = args.math_pool
+    if args.top_k_tools is not None:
+        tool_retrieval_k = args.top_k_tools
+    if args.plan:
+        agent_mode = "plan"
+    if args.native_tools:
+        native_tools = True
+    if args.on_loop:
+        loop_action = args.on_loop
+    if args.run_timeout is not None:
+        run_timeout = args.run_timeout
+    if args.llm_cache:
+        llm_cache.mode = args.llm_cache
+    if args.trace:
+        tracer.set_exporter(exporter_from_setting(args.trace))
+    if args.serve:
+        try:
+            asyncio.run(serve(args.serve, parallelism=args.parallel))
+        except KeyboardInterrupt:
+            print("Agent daemon stopped")
+    elif args.batch:
+        asyncio.run(run_batch(load_queries(args.batch), parallelism=args.parallel))
+    else:
+        asyncio.run(main(resume_run=args.resume))
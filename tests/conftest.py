@@ -0,0 +1,10 @@
+import pytest
+
+from bench_agent import load_agent
+from fake_llm import FakeClient
+
+
+@pytest.fixture(scope="session")
+def agent():
+    """talk2mcp-2.py imported with a scripted fake model instead of genai.Client"""
+    return load_agent(FakeClient(["FINAL_ANSWER: [done]"]))
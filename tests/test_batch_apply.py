@@ -0,0 +1,91 @@
+"""batch_apply on the calculator server: broadcasting, typed results and per-element errors"""
+import asyncio
+import json
+
+import pytest
+from mcp.server.fastmcp.exceptions import ToolError
+
+from connections import load_server
+
+
+@pytest.fixture(scope="module")
+def calculator():
+    return load_server("example2-3.py")
+
+
+def batch(calculator, operation, a, b=None):
+    arguments = {"operation": operation, "a": a}
+    if b is not None:
+        arguments["b"] = b
+    content = asyncio.run(calculator.call_tool("batch_apply", arguments))
+    return json.loads(content[0].text)
+
+
+def errors(result):
+    return {error["index"]: error["error"] for error in result["errors"]}
+
+
+def test_element_wise_results(calculator):
+    result = batch(calculator, "add", [1, 2, 3], [10, 20, 30])
+    assert result == {"operation": "add", "dtype": "int", "count": 3, "values": [11, 22, 33], "errors": []}
+    assert batch(calculator, "mine", [10, 20], [1, 2])["values"] == [8, 16]
+    result = batch(calculator, "sqrt", [4, 9.0, 2.25])
+    assert (result["dtype"], result["values"]) == ("float", [2.0, 3.0, 1.5])
+
+
+def test_single_number_is_broadcast(calculator):
+    assert batch(calculator, "multiply", [1, 2, 3], 2)["values"] == [2, 4, 6]
+    assert batch(calculator, "subtract", 10, [1, 2])["values"] == [9, 8]
+
+
+def test_shape_mismatch_fails_the_call(calculator):
+    with pytest.raises(ToolError, match="Cannot broadcast lists of lengths \\[3, 2\\]"):
+        batch(calculator, "add", [1, 2, 3], [1, 2])
+
+
+@pytest.mark.parametrize("operation, a, b, message", [
+    ("frobnicate", [1], None, "Unknown operation"),
+    ("add", [1], None, "needs two arguments"),
+    ("sqrt", [1], [1], "takes only a"),
+])
+def test_invalid_calls_fail_the_call(calculator, operation, a, b, message):
+    with pytest.raises(ToolError, match=message):
+        batch(calculator, operation, a, b)
+
+
+def test_divide_by_zero_fails_only_that_element(calculator):
+    result = batch(calculator, "divide", [1, 2, 3], [2, 0, 4])
+    assert result["values"] == [0.5, None, 0.75]
+    assert errors(result) == {1: "division by zero"}
+    assert errors(batch(calculator, "remainder", [7, 8], [0, 3])) == {0: "division by zero"}
+
+
+@pytest.mark.parametrize("operation, a, bad", [
+    ("log", [1, 0, -1, 10], {1, 2}),
+    ("sqrt", [4, -4, 0], {1}),
+])
+def test_domain_errors_fail_only_those_elements(calculator, operation, a, bad):
+    result = batch(calculator, operation, a)
+    assert errors(result) == {index: "math domain error" for index in bad}
+    assert all((value is None) == (index in bad) for index, value in enumerate(result["values"]))
+
+
+def test_float_errors_are_told_apart(calculator):
+    result = batch(calculator, "power", [0, -8.0, 10.0, 2], [-1, 0.5, 400, 0.5])
+    assert errors(result) == {0: "division by zero", 1: "math domain error", 2: "overflow"}
+    assert result["values"][3] == pytest.approx(2 ** 0.5)
+    assert errors(batch(calculator, "exp", [1, 1000])) == {1: "overflow"}
+
+
+def test_int64_overflow_falls_back_to_exact_integers(calculator):
+    result = batch(calculator, "multiply", [2 ** 40, 3], [2 ** 40, 3])
+    assert result["dtype"] == "int"
+    assert result["values"] == [2 ** 80, 9]
+    assert batch(calculator, "power", [2, 3], 100)["values"] == [2 ** 100, 3 ** 100]
+    assert batch(calculator, "add", [2 ** 63 - 1], 1)["values"] == [2 ** 63]
+
+
+def test_integers_too_large_for_a_float(calculator):
+    result = batch(calculator, "sqrt", [10 ** 400, 16])
+    assert result["values"] == [None, 4.0]
+    assert errors(result) == {0: "integer too large to convert to float"}
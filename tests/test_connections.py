@@ -0,0 +1,57 @@
+"""In-process (memory transport) MCP servers"""
+import asyncio
+import textwrap
+import time
+
+from mcp import ClientSession
+
+from connections import ServerConfig
+
+SLOW_SERVER = textwrap.dedent('''
+    import time
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("Slow")
+    running = []
+
+    @mcp.tool()
+    def slow(seconds: float) -> int:
+        """Block for a while, reporting how many calls overlapped"""
+        running.append(1)
+        overlap = len(running)
+        time.sleep(seconds)
+        running.pop()
+        return overlap
+''')
+
+
+def test_sync_tools_do_not_block_the_event_loop(tmp_path):
+    script = tmp_path / "slow_server.py"
+    script.write_text(SLOW_SERVER)
+    config = ServerConfig("slow", "python", [str(script)], transport="memory")
+
+    async def main():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async with config.client() as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                beat = asyncio.create_task(heartbeat())
+                started = time.perf_counter()
+                results = await asyncio.gather(*(session.call_tool("slow", {"seconds": 0.2}) for _ in range(2)))
+                elapsed = time.perf_counter() - started
+                beat.cancel()
+        return ticks, elapsed, [result.content[0].text for result in results]
+
+    ticks, elapsed, overlaps = asyncio.run(main())
+    # The loop kept running while the tools slept in a worker thread
+    assert ticks >= 20
+    # Calls still run one at a time, as in a stdio server
+    assert overlaps == ["1", "1"]
+    assert elapsed >= 0.4
@@ -0,0 +1,96 @@
+"""ConvergenceMonitor: repeats, short cycles and no-progress streaks"""
+import asyncio
+import os
+
+from convergence import ConvergenceMonitor, call_fingerprint
+
+
+def call(function, result, **arguments):
+    return [(function, arguments, result)]
+
+
+def test_fingerprint_depends_on_call_and_result_not_argument_order():
+    assert call_fingerprint("add", {"a": 1, "b": 2}, "3") == call_fingerprint("add", {"b": 2, "a": 1}, "3")
+    assert call_fingerprint("add", {"a": 1, "b": 2}, "3") != call_fingerprint("add", {"a": 1, "b": 2}, "4")
+
+
+def test_progressing_run_never_trips():
+    monitor = ConvergenceMonitor()
+    for i in range(10):
+        assert monitor.observe_calls(call("add", str(i + 1), a=i, b=1)) is None
+    assert not monitor.tripped
+
+
+def test_repeating_one_call_is_a_cycle():
+    monitor = ConvergenceMonitor(min_repeats=2)
+    assert monitor.observe_calls(call("sqrt", "2.0", a=4)) is None
+    verdict = monitor.observe_calls(call("sqrt", "2.0", a=4))
+    assert verdict.kind == "cycle"
+    assert "sqrt" in str(verdict)
+    assert monitor.cycles == 1
+
+
+def test_alternating_calls_are_a_cycle_of_period_two():
+    monitor = ConvergenceMonitor(max_period=3, min_repeats=2)
+    steps = [call("add", "3", a=1, b=2), call("verify", "False", expression="1+2", expected=4)] * 2
+    verdicts = [monitor.observe_calls(s) for s in steps]
+    assert verdicts[:3] == [None, None, None]
+    assert verdicts[3].kind == "cycle"
+    assert str(verdicts[3]).count("->") == 1
+
+
+def test_same_call_with_a_new_result_is_progress():
+    monitor = ConvergenceMonitor()
+    for i in range(5):
+        assert monitor.observe_calls(call("get_time", f"12:0{i}")) is None
+
+
+def test_no_progress_streak_is_a_stall():
+    monitor = ConvergenceMonitor(max_stall=3)
+    assert monitor.observe_stall("no FUNCTION_CALL or FINAL_ANSWER") is None
+    assert monitor.observe_stall("no FUNCTION_CALL or FINAL_ANSWER") is None
+    verdict = monitor.observe_stall("unparseable response")
+    assert verdict.kind == "stall"
+    assert "3 iterations without progress" in str(verdict)
+    assert "unparseable response" in str(verdict)
+
+
+def test_progress_resets_the_streak():
+    monitor = ConvergenceMonitor(max_stall=2)
+    monitor.observe_stall("empty")
+    monitor.observe_calls(call("add", "3", a=1, b=2))
+    assert monitor.observe_stall("empty") is None
+
+
+def test_reset_forgets_the_window_but_not_seen_results():
+    monitor = ConvergenceMonitor(max_stall=2, min_repeats=2)
+    monitor.observe_calls(call("add", "3", a=1, b=2))
+    monitor.observe_calls(call("add", "3", a=1, b=2))
+    monitor.reset()
+    # Repeating it once after the hint is not yet a cycle, but it still counts as no progress
+    assert monitor.observe_calls(call("add", "3", a=1, b=2)) is None
+    assert monitor.streak == 1
+
+
+def test_stats_report_the_outcome():
+    monitor = ConvergenceMonitor()
+    monitor.observe_calls(call("add", "3", a=1, b=2))
+    monitor.observe_calls(call("add", "3", a=1, b=2))
+    monitor.hints, monitor.aborted, monitor.calls_saved = 1, True, 6
+    assert monitor.stats() == "1 cycles, 0 stalls, 1 hints, aborted, 6 LLM calls saved"
+
+
+def test_agent_aborts_a_looping_run(agent, monkeypatch):
+    repeat = 'FUNCTION_CALL: {"function": "sqrt", "parameters": {"a": 16}}'
+    monkeypatch.setattr(agent, "server_configs", [agent.ServerConfig("math", "python", ["example2-3.py"], transport="memory")])
+    monkeypatch.setattr(agent, "use_catalog_cache", False)
+    monkeypatch.setattr(agent, "use_journal", False)
+    monkeypatch.setattr(agent, "loop_action", "abort")
+    monkeypatch.setattr(agent.llm.client.models, "script", [repeat])
+    monkeypatch.chdir(os.path.dirname(agent.__file__))
+
+    state = asyncio.run(agent.main("What is the square root of 16?"))
+    assert state.final_answer is None
+    assert state.monitor.aborted
+    assert state.monitor.cycles == 1
+    assert state.llm_calls < agent.max_iterations
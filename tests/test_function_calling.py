@@ -0,0 +1,130 @@
+"""Native function calling: declarations, structured responses and the FUNCTION_CALL text form"""
+import asyncio
+import os
+
+import pytest
+from google.genai import types
+
+from connections import load_server
+from fake_llm import FakeFunctionCall, FakeResponse
+from function_calling import (
+    StructuredResponse, calls_to_text, function_declarations, function_response_parts, gemini_schema,
+    model_call_parts, response_calls, response_text,
+)
+from llm import generation_config
+
+CALLS = [
+    ("add", {"a": 1, "b": 2}),
+    ("verify", {"expression": "sum([math.exp(x) for x in [73, 78]])", "expected": 1.5e33}),
+    ("send_email", {"recipient_id": "a@b.c", "subject": "Ünïcode", "message": 'said "FUNCTION_CALL: {}"\nthen left'}),
+    ("show_reasoning", {"steps": ["step 1", "step 2"]}),
+    ("fibonacci_numbers", {}),
+]
+
+
+@pytest.fixture(scope="module")
+def calculator_tools():
+    return asyncio.run(load_server("example2-3.py").list_tools())
+
+
+def test_schema_translation():
+    schema = {
+        "type": "object",
+        "title": "addArguments",
+        "properties": {
+            "a": {"type": "integer", "title": "A", "default": 0},
+            "items": {"type": "array", "items": {}},
+            "b": {"anyOf": [{"type": "integer"}, {"type": "null"}]},
+            "c": {"anyOf": [{"type": "integer"}, {"type": "array", "items": {"type": "number"}}]},
+        },
+        "required": ["a"],
+    }
+    assert gemini_schema(schema) == {
+        "type": "OBJECT",
+        "required": ["a"],
+        "properties": {
+            "a": {"type": "INTEGER"},
+            "items": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "b": {"type": "INTEGER", "nullable": True},
+            "c": {"any_of": [{"type": "INTEGER"}, {"type": "ARRAY", "items": {"type": "NUMBER"}}]},
+        },
+    }
+
+
+def test_calculator_declarations_are_accepted_by_the_sdk(calculator_tools):
+    declarations = function_declarations(calculator_tools)
+    assert {d["name"] for d in declarations} == {tool.name for tool in calculator_tools}
+    config = types.GenerateContentConfig.model_validate(generation_config("system", declarations))
+    assert len(config.tools[0].function_declarations) == len(calculator_tools)
+    assert config.tool_config.function_calling_config.mode == types.FunctionCallingConfigMode.AUTO
+    # Gemini rejects OBJECT parameters without properties
+    for declaration in declarations:
+        if "parameters" in declaration:
+            assert declaration["parameters"]["properties"]
+
+
+def test_native_calls_become_canonical_text():
+    fake = FakeResponse(None, [FakeFunctionCall(name, args) for name, args in CALLS])
+    response = StructuredResponse(fake)
+    assert response.function_calls == CALLS
+    lines = response.text.split("\n")
+    assert len(lines) == len(CALLS)
+    assert all(line.startswith("FUNCTION_CALL: ") for line in lines)
+
+
+def test_text_answer_passes_through():
+    response = StructuredResponse(FakeResponse("FINAL_ANSWER: [3]"))
+    assert response.function_calls == []
+    assert response.text == "FINAL_ANSWER: [3]"
+
+
+def test_calls_to_text_round_trips_through_the_agent_parser(agent):
+    lines = calls_to_text(CALLS).split("\n")
+    assert [agent.parse_llm_response(line) for line in lines] == CALLS
+
+
+def test_sdk_response_text_and_calls():
+    response = types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[
+        types.Part(text="Adding. "),
+        types.Part(function_call=types.FunctionCall(name="add", args={"a": 1, "b": 2})),
+        types.Part(text="Done."),
+    ]))])
+    assert response_text(response) == "Adding. Done."
+    assert response_calls(response) == [("add", {"a": 1, "b": 2})]
+    assert StructuredResponse(response).text == calls_to_text([("add", {"a": 1, "b": 2})])
+
+
+def test_conversation_parts_are_valid_contents():
+    calls = CALLS[:2]
+    model_turn = types.Content.model_validate({"role": "model", "parts": model_call_parts(calls)})
+    assert [part.function_call.name for part in model_turn.parts] == ["add", "verify"]
+    parts = function_response_parts([name for name, _ in calls], ["3", "True"], note="What next?")
+    user_turn = types.Content.model_validate({"role": "user", "parts": parts})
+    assert user_turn.parts[0].function_response.response == {"result": "3"}
+    assert user_turn.parts[-1].text == "What next?"
+
+
+@pytest.mark.parametrize("line", [
+    'FUNCTION_CALL: ["add", 1, 2]',
+    'FUNCTION_CALL: "add"',
+    'FUNCTION_CALL: {"function": ["add"], "parameters": {"a": 1}}',
+    'FUNCTION_CALL: {"function": 7}',
+])
+def test_malformed_calls_are_value_errors(agent, line):
+    # ValueError makes run_iteration ask the model again instead of ending the run
+    with pytest.raises(ValueError):
+        agent.parse_llm_response(line)
+
+
+def test_agent_recovers_from_a_non_object_call(agent, monkeypatch):
+    monkeypatch.setattr(agent, "server_configs", [agent.ServerConfig("math", "python", ["example2-3.py"], transport="memory")])
+    monkeypatch.setattr(agent, "use_catalog_cache", False)
+    monkeypatch.setattr(agent, "use_journal", False)
+    monkeypatch.setattr(agent.llm.client.models, "script", ['FUNCTION_CALL: ["add", 1, 2]', "FINAL_ANSWER: [3]"])
+    monkeypatch.setattr(agent.llm.client.models, "calls", 0)
+    monkeypatch.chdir(os.path.dirname(agent.__file__))
+
+    state = asyncio.run(agent.main("Add 1 and 2"))
+    assert state.final_answer == "[3]"
+    assert state.error is None
+    assert state.llm_calls == 2
@@ -0,0 +1,89 @@
+"""Run journals: recording, replay after a crash and retention"""
+import os
+import time
+
+from mcp import types
+
+from journal import RunJournal, prune_journals
+
+CONTENTS = [{"role": "user", "parts": [{"text": "Query: add 1 and 2"}]}]
+SYSTEM = "You are a math agent"
+CALL = 'FUNCTION_CALL: {"function": "add", "parameters": {"a": 1, "b": 2}}'
+
+
+def text_result(text: str) -> types.CallToolResult:
+    return types.CallToolResult(content=[types.TextContent(type="text", text=text)])
+
+
+def crashed_run(directory) -> RunJournal:
+    """A run that recorded one step and then died without finishing"""
+    journal = RunJournal.create(str(directory), "add 1 and 2", "loop", fsync_interval=0)
+    journal.record_response(0, CONTENTS, SYSTEM, CALL, "routine")
+    journal.record_tool(0, "add", {"a": 1, "b": 2}, text_result("3"))
+    journal.close()
+    return journal
+
+
+def test_replays_recorded_steps_after_a_crash(tmp_path):
+    run_id = crashed_run(tmp_path).run_id
+    journal = RunJournal.load(str(tmp_path), run_id)
+    assert journal.query == "add 1 and 2"
+    assert journal.mode == "loop"
+    assert journal.replaying
+
+    response = journal.replayed_response(0, CONTENTS, SYSTEM)
+    assert response.text == CALL
+    result = journal.replayed_tool(0, "add", {"a": 1, "b": 2})
+    assert result.content[0].text == "3"
+    # The same call again was not recorded, so it runs live
+    assert journal.replayed_tool(0, "add", {"a": 1, "b": 2}) is None
+    assert (journal.replayed_responses, journal.replayed_tools) == (1, 1)
+
+
+def test_changed_prompt_ends_the_replay(tmp_path):
+    journal = RunJournal.load(str(tmp_path), crashed_run(tmp_path).run_id)
+    changed = [{"role": "user", "parts": [{"text": "Query: add 1 and 3"}]}]
+    assert journal.replayed_response(0, changed, SYSTEM) is None
+    assert not journal.replaying
+    assert journal.replayed_tool(0, "add", {"a": 1, "b": 2}) is None
+
+
+def test_line_cut_short_by_the_crash_is_ignored(tmp_path):
+    journal = crashed_run(tmp_path)
+    with open(journal.path, "a") as f:
+        f.write('{"type": "llm", "iteration": 1, "resp')
+    loaded = RunJournal.load(str(tmp_path), journal.run_id)
+    assert loaded.replayed_response(0, CONTENTS, SYSTEM).text == CALL
+    assert loaded.replayed_response(1, CONTENTS, SYSTEM) is None
+
+
+def test_resumed_run_appends_to_the_same_journal(tmp_path):
+    journal = RunJournal.load(str(tmp_path), crashed_run(tmp_path).run_id, fsync_interval=0)
+    journal.replayed_response(0, CONTENTS, SYSTEM)
+    journal.record_response(1, CONTENTS, SYSTEM, "FINAL_ANSWER: [3]", "final")
+    journal.finish("[3]", llm_calls=1)
+    with open(journal.path) as f:
+        kinds = [line.split('"type": "')[1].split('"')[0] for line in f]
+    assert kinds == ["start", "llm", "tool", "llm", "end"]
+
+
+def test_discard_deletes_a_completed_runs_journal(tmp_path):
+    journal = RunJournal.create(str(tmp_path), "q", "loop", fsync_interval=0)
+    journal.finish("[3]")
+    journal.discard()
+    assert not os.path.exists(journal.path)
+    assert "deleted" in journal.stats()
+
+
+def test_create_prunes_the_oldest_journals(tmp_path):
+    paths = []
+    for i in range(4):
+        journal = RunJournal.create(str(tmp_path), f"q{i}", "loop", max_runs=3, fsync_interval=0)
+        journal.close()
+        # Distinct modification times, oldest first
+        os.utime(journal.path, (time.time() - 100 + i, time.time() - 100 + i))
+        paths.append(journal.path)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths[1:])
+    assert prune_journals(str(tmp_path), 1) == 2
+    assert os.listdir(tmp_path) == [os.path.basename(paths[-1])]
+    assert prune_journals(str(tmp_path / "missing"), 1) == 0
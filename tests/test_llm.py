@@ -0,0 +1,105 @@
+"""Streaming action-line detection, driven through FakeClient chunk streams"""
+import asyncio
+
+import pytest
+
+from fake_llm import FakeClient
+from latency import percentile
+from llm import ActionLineParser, AsyncLLM, generate_streaming
+from router import ModelRouter, Route
+
+CALL = 'FUNCTION_CALL: {"function": "add", "parameters": {"a": 1, "b": 2}}'
+# "}" inside a string value, so a prefix ending in "}" is not the whole payload
+BRACED_CALL = 'FUNCTION_CALL: {"function": "verify", "parameters": {"expression": "{x}", "expected": 1}}'
+NESTED_ANSWER = "FINAL_ANSWER: [[1, 2], [3, 4]]"
+
+
+def stream(text: str, chunk_size: int):
+    client = FakeClient([text], chunk_size=chunk_size)
+    return asyncio.run(generate_streaming(client, "query")), client
+
+
+def every_chunk_size(text: str):
+    return range(1, len(text) + 1)
+
+
+@pytest.mark.parametrize("text, action", [
+    (f"Let me add.\n{CALL}\nFINAL_ANSWER: [3]", CALL),
+    (f"{BRACED_CALL}\n{CALL}", BRACED_CALL),
+    (f"{NESTED_ANSWER}\nDone", NESTED_ANSWER),
+])
+def test_action_line_split_across_chunks(text, action):
+    for chunk_size in every_chunk_size(text):
+        response, _ = stream(text, chunk_size)
+        assert response.text == action, chunk_size
+
+
+def test_stream_is_cut_off_after_the_action_line():
+    text = f"{CALL}\n" + "padding " * 50
+    response, _ = stream(text, chunk_size=8)
+    assert response.cut_off
+    assert response.text == CALL
+    assert len(response.full_text) < len(text)
+
+
+@pytest.mark.parametrize("text", ["FINAL_ANSWER: [42", 'FUNCTION_CALL: {"function": "add"'])
+def test_unterminated_final_line_is_accepted_at_end_of_stream(text):
+    response, _ = stream(text, chunk_size=5)
+    assert not response.cut_off
+    assert response.text == text
+
+
+def test_no_action_line_returns_everything_streamed():
+    response, _ = stream("I am not sure what to do.", chunk_size=4)
+    assert response.text == "I am not sure what to do."
+    assert response.time_to_action is None
+
+
+@pytest.mark.parametrize("split", range(1, len(NESTED_ANSWER)))
+def test_closing_bracket_inside_answer_does_not_end_it(split):
+    parser = ActionLineParser()
+    assert parser.feed(NESTED_ANSWER[:split]) is None
+    assert parser.feed(NESTED_ANSWER[split:]) == NESTED_ANSWER
+
+
+@pytest.mark.parametrize("split", range(1, len(BRACED_CALL)))
+def test_brace_inside_payload_does_not_end_it(split):
+    parser = ActionLineParser()
+    assert parser.feed(BRACED_CALL[:split]) is None
+    assert parser.feed(BRACED_CALL[split:]) == BRACED_CALL
+
+
+def test_finish_flushes_an_answer_with_trailing_text():
+    parser = ActionLineParser()
+    assert parser.feed("FINAL_ANSWER: [1] [2]") is None
+    assert parser.finish() == "FINAL_ANSWER: [1] [2]"
+
+
+def test_deadline_is_forwarded_by_the_router_and_covers_queueing():
+    async def main():
+        llm = AsyncLLM(FakeClient(["FINAL_ANSWER: [1]"], latency=0.3), max_concurrency=1, timeout=5, adaptive=False)
+        router = ModelRouter(llm, {"routine": Route(llm.model)})
+        loop = asyncio.get_running_loop()
+        # Holds the only concurrency slot, so the second call spends its time queueing
+        first = asyncio.create_task(router.generate("first"))
+        await asyncio.sleep(0)
+        started = loop.time()
+        with pytest.raises(TimeoutError):
+            await router.generate("second", deadline=started + 0.1)
+        waited = loop.time() - started
+        return waited, (await first).text
+
+    waited, first = asyncio.run(main())
+    assert waited < 0.25
+    assert first == "FINAL_ANSWER: [1]"
+
+
+@pytest.mark.parametrize("values, pct, expected", [
+    ([], 50, None),
+    ([5], 99, 5),
+    ([4, 1, 3, 2], 50, 2),
+    ([4, 1, 3, 2], 95, 4),
+    (list(range(1, 101)), 95, 95),
+])
+def test_nearest_rank_percentile(values, pct, expected):
+    assert percentile(values, pct) == expected
@@ -0,0 +1,129 @@
+"""Plan parsing, DAG validation and execution order"""
+import asyncio
+import json
+
+import pytest
+from mcp import types
+
+from planner import PlanError, execute_plan, parse_plan, resolve
+
+
+def plan_line(steps, final_answer=None) -> str:
+    return "PLAN: " + json.dumps({"steps": steps, "final_answer": final_answer})
+
+
+def step(step_id, function, **parameters):
+    return {"id": step_id, "function": function, "parameters": parameters}
+
+
+def test_parse_plan_and_dependencies():
+    plan = parse_plan(plan_line([
+        step("ascii", "strings_to_chars_to_int", string="INDIA"),
+        step("total", "int_list_to_exponential_sum", int_list="$ascii"),
+        step("email", "send_email", message="Total: ${total} from ${ascii}"),
+        {"function": "add", "parameters": {"a": 1, "b": 2}},
+    ], "$total"))
+    assert [s.id for s in plan.steps] == ["ascii", "total", "email", "s4"]
+    assert plan.by_id["total"].depends_on == ["ascii"]
+    assert plan.by_id["email"].depends_on == ["ascii", "total"]
+    assert plan.dependents("ascii") == {"total", "email"}
+
+
+@pytest.mark.parametrize("line, message", [
+    ("PLAN: {not json", "Invalid JSON"),
+    ('PLAN: {"final_answer": 1}', '"steps" list'),
+    ('PLAN: {"steps": [{"id": "a"}]}', 'must be an object with a "function"'),
+    ('PLAN: {"steps": [{"function": "f", "parameters": [1]}]}', "must be a JSON object"),
+    (plan_line([step("a", "f"), step("a", "g")]), "Duplicate step ids"),
+    (plan_line([step("a", "f", x="$missing")]), "references unknown steps ['missing']"),
+    (plan_line([step("a", "f")], "$b"), "final_answer references unknown steps"),
+    (plan_line([step("a", "f", x="$b"), step("b", "g", x="${a}")]), "dependency cycle between ['a', 'b']"),
+    (plan_line([step("a", "f", x="$a")]), "dependency cycle"),
+])
+def test_malformed_plans_are_rejected(line, message):
+    with pytest.raises(PlanError, match=message.replace("[", r"\[").replace("]", r"\]")):
+        parse_plan(line)
+
+
+def test_resolve_whole_and_inline_references():
+    values = {"ascii": [73, 78], "name": "INDIA"}
+    assert resolve({"l": "$ascii", "s": "${name}: ${ascii}", "n": [1, "$name"]}, values) == {
+        "l": [73, 78], "s": "INDIA: [73, 78]", "n": [1, "INDIA"]
+    }
+
+
+class FakeTools:
+    """run_step stand-in: answers from a table, recording start order and overlap"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, plan_step, arguments):
+        self.started.append(plan_step.id)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        answer = self.answers[plan_step.function]
+        if isinstance(answer, Exception):
+            raise answer
+        text = answer(arguments) if callable(answer) else answer
+        return types.CallToolResult(content=[types.TextContent(type="text", text=text)])
+
+
+def run_plan(line, answers, has_side_effects=None):
+    tools = FakeTools(answers)
+    result = asyncio.run(execute_plan(parse_plan(line), tools, has_side_effects))
+    return result, tools
+
+
+def test_independent_steps_run_in_parallel_and_dependents_wait():
+    line = plan_line([
+        step("a", "add", a=1, b=2),
+        step("b", "add", a=3, b=4),
+        step("c", "multiply", a="$a", b="$b"),
+    ], "$c")
+    answers = {
+        "add": lambda args: str(args["a"] + args["b"]),
+        "multiply": lambda args: str(args["a"] * args["b"]),
+    }
+    result, tools = run_plan(line, answers)
+    assert result.ok
+    assert result.final_answer == 21
+    assert tools.max_running == 2
+    assert tools.started[-1] == "c"
+
+
+def test_failed_step_skips_its_dependents():
+    line = plan_line([
+        step("a", "sqrt", a=-1),
+        step("b", "add", a="$a", b=1),
+        step("c", "add", a=1, b=1),
+    ], "$b")
+    result, tools = run_plan(line, {"sqrt": ValueError("math domain error"), "add": "2"})
+    assert not result.ok
+    assert [outcome.step.id for outcome in result.failed] == ["a"]
+    assert "b" not in tools.started and "c" in tools.started
+    assert result.final_answer is None
+    described = result.describe()
+    assert "- a (sqrt): FAILED - math domain error" in described
+    assert "- b (add): not run, an earlier step failed" in described
+
+
+@pytest.mark.parametrize("verified, sent", [("True", True), ("False", False)])
+def test_side_effects_wait_for_every_verification(verified, sent):
+    line = plan_line([
+        step("total", "add", a=1, b=2),
+        step("check", "verify", expression="1 + 2", expected="$total"),
+        step("email", "send_email", message="${total}"),
+    ], "$total")
+    answers = {"add": "3", "verify": verified, "send_email": "sent"}
+    result, tools = run_plan(line, answers, has_side_effects=lambda s: s.function == "send_email")
+    assert ("email" in tools.started) == sent
+    if sent:
+        assert tools.started.index("email") > tools.started.index("check")
+    else:
+        assert result.failed[0].error == "verification did not pass: False"
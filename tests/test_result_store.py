@@ -0,0 +1,56 @@
+"""ResultStore: summaries and @r references for large tool results"""
+import pytest
+
+from result_store import ResultStore
+
+FIBONACCI = [0, 1]
+while len(FIBONACCI) < 200:
+    FIBONACCI.append(FIBONACCI[-1] + FIBONACCI[-2])
+
+
+@pytest.fixture
+def store():
+    """A store holding @r1 (a long list) and @r2 (a long text)"""
+    store = ResultStore(inline_chars=100)
+    store.render(FIBONACCI, str(FIBONACCI), source="fibonacci_numbers")
+    store.render("x" * 500, "x" * 500, source="strings")
+    return store
+
+
+def test_short_results_stay_inline():
+    store = ResultStore(inline_chars=100)
+    assert store.render(3, "3") == "3"
+    assert not store.results
+
+
+def test_long_results_become_summaries(store):
+    summary = store.render(list(range(300)), str(list(range(300))))
+    assert summary.startswith("<@r3: list of 300 items, head [0, 1, 2, 3, 4]")
+    assert 'pass "@r3" as a parameter' in summary
+    assert len(summary) < 300
+    assert store.chars_saved > 0
+
+
+def test_whole_value_reference_passes_the_stored_value(store):
+    assert store.resolve({"int_list": "@r1"}) == {"int_list": FIBONACCI}
+    assert store.resolve({"int_list": " @r1 "}) == {"int_list": FIBONACCI}
+
+
+def test_inline_reference_is_replaced_by_the_text(store):
+    assert store.resolve({"message": "Result: @r2."}) == {"message": "Result: " + "x" * 500 + "."}
+    assert store.expand("[@r2]") == "[" + "x" * 500 + "]"
+    assert store.has_references(["a", {"b": "see @r1"}])
+
+
+def test_unknown_references(store):
+    with pytest.raises(ValueError, match="Unknown result reference @r9"):
+        store.resolve({"int_list": "@r9"})
+    # Inside free text an unknown reference is left alone
+    assert store.expand("see @r9") == "see @r9"
+
+
+@pytest.mark.parametrize("text", ["x@r2.example", "me@r2", "mail a.b@r1.org now", "x.@r2"])
+def test_email_addresses_are_not_references(store, text):
+    assert not store.has_references(text)
+    assert store.resolve({"recipient_id": text}) == {"recipient_id": text}
+    assert store.expand(text) == text
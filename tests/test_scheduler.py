@@ -0,0 +1,101 @@
+"""RPM/TPM scheduling: priority and round-robin order, cancellation and token accounting"""
+import asyncio
+import time
+
+from scheduler import RequestScheduler, estimate_request_tokens
+
+
+def drained(rpm=1200, tpm=0) -> RequestScheduler:
+    """A scheduler whose request bucket is empty, so every request queues (1200 rpm = one per 50ms)"""
+    scheduler = RequestScheduler(rpm=rpm, tpm=tpm)
+    scheduler.requests.level = 0
+    return scheduler
+
+
+async def grant_order(scheduler, requests):
+    """Queue (agent, priority) requests in the given order; return the order they were granted in"""
+    order = []
+
+    async def ask(agent, priority, label):
+        await scheduler.acquire(10, agent=agent, priority=priority)
+        order.append(label)
+
+    tasks = []
+    for i, (agent, priority) in enumerate(requests):
+        tasks.append(asyncio.create_task(ask(agent, priority, f"{agent}{i}")))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_unlimited_scheduler_does_not_wait():
+    async def main():
+        scheduler = RequestScheduler()
+        waits = [await scheduler.acquire(1000) for _ in range(5)]
+        return scheduler, waits
+
+    scheduler, waits = asyncio.run(main())
+    assert not scheduler.enabled
+    assert waits == [0.0] * 5
+    assert scheduler.granted == 5
+
+
+def test_higher_priority_goes_first():
+    order = asyncio.run(grant_order(drained(), [("a", 0), ("a", 0), ("b", 2), ("c", 1)]))
+    assert order == ["b2", "c3", "a0", "a1"]
+
+
+def test_equal_priorities_are_served_round_robin():
+    order = asyncio.run(grant_order(drained(), [("a", 0)] * 3 + [("b", 0)] * 3))
+    assert order == ["a0", "b3", "a1", "b4", "a2", "b5"]
+
+
+def test_requests_are_paced_by_the_rpm_budget():
+    async def main():
+        scheduler = drained()
+        started = time.monotonic()
+        await grant_order(scheduler, [("a", 0)] * 4)
+        return scheduler, time.monotonic() - started
+
+    scheduler, elapsed = asyncio.run(main())
+    assert 0.18 <= elapsed < 1.0
+    assert scheduler.granted == 4
+    assert scheduler.queue_depth == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        scheduler = drained()
+        first = asyncio.create_task(scheduler.acquire(10, agent="a"))
+        second = asyncio.create_task(scheduler.acquire(10, agent="b"))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 2
+        first.cancel()
+        await asyncio.sleep(0)
+        await second
+        return scheduler, first
+
+    scheduler, first = asyncio.run(main())
+    assert first.cancelled()
+    assert scheduler.queue_depth == 0
+    assert scheduler.served == {"b": 1}
+
+
+def test_token_budget_is_charged_by_estimate_and_settled_by_usage():
+    async def main():
+        scheduler = RequestScheduler(tpm=6000)
+        await scheduler.acquire(4000)
+        after_estimate = scheduler.tokens.level
+        scheduler.settle(4000, 1000)
+        return after_estimate, scheduler.tokens.level
+
+    after_estimate, after_settle = asyncio.run(main())
+    assert 2000 <= after_estimate < 2010
+    assert 5000 <= after_settle <= 6000
+
+
+def test_request_estimate_includes_prompt_and_response_allowance():
+    short = estimate_request_tokens("hi")
+    longer = estimate_request_tokens([{"role": "user", "parts": [{"text": "word " * 400}]}], "system prompt")
+    assert short > 0
+    assert longer > short + 300
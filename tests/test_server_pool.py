@@ -0,0 +1,81 @@
+"""ServerPool over small stdio servers: load spreading and replacing dead members"""
+import asyncio
+import sys
+import textwrap
+
+from connections import ServerConfig
+from server_pool import ServerPool
+
+FAKE_SERVER = textwrap.dedent('''
+    import asyncio
+    import os
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("Fake")
+
+    @mcp.tool()
+    async def pid(seconds: float = 0) -> int:
+        """Return this process id after a pause"""
+        await asyncio.sleep(seconds)
+        return os.getpid()
+
+    @mcp.tool()
+    def crash() -> None:
+        """Exit without answering"""
+        os._exit(1)
+
+    if __name__ == "__main__":
+        mcp.run()
+''')
+
+
+def fake_pool(tmp_path, size=2, **kwargs):
+    script = tmp_path / "fake_server.py"
+    script.write_text(FAKE_SERVER)
+    config = ServerConfig("fake", sys.executable, [str(script)], pool_size=size, stateless_tools=["pid"])
+    return ServerPool(config, size, stateless_tools=config.stateless_tools, **kwargs)
+
+
+async def pid_of(pool, seconds=0):
+    result = await pool.call_tool("pid", {"seconds": seconds})
+    return int(result.content[0].text)
+
+
+def test_concurrent_calls_are_spread_across_members(tmp_path):
+    async def main():
+        async with fake_pool(tmp_path, size=2) as pool:
+            await pool.initialize()
+            pids = await asyncio.gather(*(pid_of(pool, 0.2) for _ in range(4)))
+            return pids, [member.calls for member in pool.members]
+
+    pids, calls = asyncio.run(main())
+    assert len(set(pids)) == 2
+    assert calls == [2, 2]
+
+
+def test_dead_member_is_replaced(tmp_path):
+    async def member_pid(member):
+        result = await member.session.call_tool("pid")
+        return int(result.content[0].text)
+
+    async def main():
+        async with fake_pool(tmp_path, size=2) as pool:
+            await pool.initialize()
+            first, second = pool.members
+            before = [await member_pid(first), await member_pid(second)]
+            # crash is not stateless, so it goes to the first member and is not retried
+            try:
+                await pool.call_tool("crash")
+            except Exception:
+                pass
+            while first.restarts == 0 or not first.ready.is_set():
+                await asyncio.sleep(0.05)
+            after = [await member_pid(first), await member_pid(second)]
+            spread = await asyncio.gather(*(pid_of(pool, 0.2) for _ in range(2)))
+            return before, after, spread, second.restarts, pool.report()
+
+    before, after, spread, second_restarts, report = asyncio.run(asyncio.wait_for(main(), 30))
+    assert after[0] not in before
+    assert after[1] == before[1] and second_restarts == 0
+    assert sorted(spread) == sorted(after)
+    assert "1 restarts" in report and "(down)" not in report
@@ -0,0 +1,111 @@
+"""ToolMemo: memoized and shared in-flight calls to pure tools"""
+import asyncio
+
+import pytest
+
+from tool_dispatch import ToolMemo
+
+
+class Result:
+    def __init__(self, value, isError=False):
+        self.value = value
+        self.isError = isError
+
+
+class SlowTool:
+    """fetch() stand-in that counts calls and finishes when released"""
+
+    def __init__(self, result=None):
+        self.calls = 0
+        self.result = result or Result(42)
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.result
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_identical_calls_share_one_request_and_are_memoized():
+    async def main():
+        memo, tool = ToolMemo(), SlowTool()
+        first = asyncio.create_task(memo.call("add", {"a": 1}, tool))
+        second = asyncio.create_task(memo.call("add", {"a": 1}, tool))
+        await asyncio.sleep(0)
+        tool.release.set()
+        results = await asyncio.gather(first, second)
+        third = await memo.call("add", {"a": 1}, tool)
+        return memo, tool, results, third
+
+    memo, tool, results, third = run(main())
+    assert tool.calls == 1
+    assert results[0] is results[1] is third
+    assert (memo.misses, memo.shared, memo.hits) == (1, 1, 1)
+
+
+def test_cancelled_leader_does_not_cancel_sharers():
+    async def main():
+        memo, tool = ToolMemo(), SlowTool()
+        leader = asyncio.create_task(memo.call("factorial", {"a": 5}, tool))
+        await asyncio.sleep(0)
+        sharer = asyncio.create_task(memo.call("factorial", {"a": 5}, tool))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        tool.release.set()
+        result = await sharer
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return memo, tool, result
+
+    memo, tool, result = run(main())
+    assert result.value == 42
+    # The sharer re-issued the call the cancelled leader had started
+    assert tool.calls == 2
+    assert memo.reissued == 1
+    assert not memo.inflight
+
+
+def test_cancelled_sharer_does_not_cancel_leader():
+    async def main():
+        memo, tool = ToolMemo(), SlowTool()
+        leader = asyncio.create_task(memo.call("factorial", {"a": 5}, tool))
+        await asyncio.sleep(0)
+        sharer = asyncio.create_task(memo.call("factorial", {"a": 5}, tool))
+        await asyncio.sleep(0)
+        sharer.cancel()
+        await asyncio.sleep(0)
+        tool.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await sharer
+        return memo, tool, await leader
+
+    memo, tool, result = run(main())
+    assert result.value == 42
+    assert tool.calls == 1
+    assert memo.reissued == 0
+
+
+def test_failures_reach_sharers_and_are_not_memoized():
+    async def failing():
+        await asyncio.sleep(0)
+        raise ConnectionError("server gone")
+
+    async def error_result():
+        return Result("math domain error", isError=True)
+
+    async def main():
+        memo = ToolMemo()
+        results = await asyncio.gather(
+            memo.call("sqrt", {"a": 4}, failing), memo.call("sqrt", {"a": 4}, failing), return_exceptions=True
+        )
+        await memo.call("log", {"a": 0}, error_result)
+        return memo, results
+
+    memo, results = run(main())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert not memo.results
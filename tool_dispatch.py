@@ -0,0 +1,245 @@
+"""Precompiled tool dispatch: name -> owning session and argument coercer"""
+import asyncio
+import json
+from collections import OrderedDict
+
+JSON_TYPES = {
+    "integer": int,
+    "number": (int, float),
+    "string": str,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+def _matches(value, schema: dict) -> bool:
+    """True if the value already has the JSON type the schema asks for"""
+    expected = JSON_TYPES.get(schema.get("type"))
+    if expected is None:
+        return False
+    # bool is an int subclass, but never a valid integer/number argument
+    if isinstance(value, bool) and schema.get("type") != "boolean":
+        return False
+    return isinstance(value, expected)
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+            if isinstance(parsed, list):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        return [x.strip() for x in value.strip("[]").split(",") if x.strip()]
+    raise ValueError(f"Expected a list, got {value!r}")
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        if value.lower() in ("true", "1", "yes"):
+            return True
+        if value.lower() in ("false", "0", "no"):
+            return False
+        raise ValueError(f"Expected a boolean, got {value!r}")
+    return bool(value)
+
+
+def _to_int(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Expected an integer, got {value!r}")
+    return int(value)
+
+
+def compile_coercer(schema: dict):
+    """Compile a JSON schema node into a function coercing values to it"""
+    if not schema:
+        # e.g. `items: {}` for an untyped list: pass values through unchanged
+        return lambda value: value
+
+    if "anyOf" in schema:
+        branches = [(branch, compile_coercer(branch)) for branch in schema["anyOf"]]
+
+        def coerce_any(value):
+            # Prefer a branch the value already satisfies, then try converting
+            for branch, _ in branches:
+                if _matches(value, branch):
+                    return value
+            for _, coerce in branches:
+                try:
+                    return coerce(value)
+                except (TypeError, ValueError):
+                    continue
+            raise ValueError(f"{value!r} does not match any of {[b.get('type') for b, _ in branches]}")
+        return coerce_any
+
+    schema_type = schema.get("type")
+    if schema_type == "integer":
+        return _to_int
+    if schema_type == "number":
+        return lambda value: value if _matches(value, schema) else float(value)
+    if schema_type == "string":
+        return lambda value: value if isinstance(value, str) else str(value)
+    if schema_type == "boolean":
+        return _to_bool
+    if schema_type == "array":
+        coerce_item = compile_coercer(schema.get("items", {}))
+        return lambda value: [coerce_item(item) for item in _as_list(value)]
+    if schema_type == "object":
+        properties = {name: compile_coercer(prop) for name, prop in schema.get("properties", {}).items()}
+
+        def coerce_object(value):
+            if isinstance(value, str):
+                value = json.loads(value)
+            return {k: properties[k](v) if k in properties else v for k, v in value.items()}
+        return coerce_object
+    return lambda value: value
+
+
+class ToolMemo:
+    """Results of pure tool calls, answered locally instead of over stdio
+
+    Identical calls already in flight share one request, and only
+    successful results are kept. A sharer is never cancelled on the
+    leader's behalf: if the leader's agent is cancelled, a waiting agent
+    issues the call itself.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.results: OrderedDict[str, object] = OrderedDict()
+        self.inflight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.reissued = 0
+        self.passthrough = 0
+
+    @staticmethod
+    def key(name: str, arguments: dict) -> str:
+        return name + ":" + json.dumps(arguments, sort_keys=True, default=str)
+
+    async def call(self, name: str, arguments: dict, fetch):
+        key = self.key(name, arguments)
+        while True:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+            shared = self.inflight.get(key)
+            if shared is None:
+                break
+            self.shared += 1
+            try:
+                return await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                # The leader's agent was cancelled, not this one: issue the call again
+                if not shared.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                self.reissued += 1
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+        future.set_result(result)
+        if not getattr(result, "isError", False):
+            self.results[key] = result
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
+
+    def stats(self) -> str:
+        return (f"{self.hits} hits, {self.shared} shared in-flight ({self.reissued} reissued), {self.misses} misses, "
+                f"{self.passthrough} side-effecting calls passed through")
+
+
+class ToolBinding:
+    """A tool compiled once: its owning session and per-parameter coercers"""
+
+    def __init__(self, tool, session, server: str, ready=None, memo: ToolMemo | None = None, pure: bool = False):
+        self.tool = tool
+        self.name = tool.name
+        self.session = session
+        self.server = server
+        schema = tool.inputSchema or {}
+        self.coercers = {
+            name: compile_coercer(prop) for name, prop in schema.get("properties", {}).items()
+        }
+        self.required = list(schema.get("required", []))
+        # Optional asyncio.Event gating calls until the server is usable
+        self.ready = ready
+        # Only tools declared pure are memoized; everything else always goes to the server
+        self.memo = memo
+        self.pure = pure
+
+    def bind(self, parameters: dict) -> dict:
+        """Coerce the model's named parameters into call arguments"""
+        unknown = [name for name in parameters if name not in self.coercers]
+        if unknown:
+            raise ValueError(f"Unknown parameters for {self.name}: {unknown} (expected {list(self.coercers)})")
+        missing = [name for name in self.required if name not in parameters]
+        if missing:
+            raise ValueError(f"Not enough parameters provided for {self.name}: missing {missing}")
+        arguments = {}
+        for name, value in parameters.items():
+            try:
+                arguments[name] = self.coercers[name](value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid value for {self.name}.{name}: {e}")
+        return arguments
+
+    async def call(self, arguments: dict):
+        if self.memo is not None:
+            if self.pure:
+                return await self.memo.call(self.name, arguments, lambda: self._call(arguments))
+            self.memo.passthrough += 1
+        return await self._call(arguments)
+
+    async def _call(self, arguments: dict):
+        if self.ready is not None and not self.ready.is_set():
+            await self.ready.wait()
+        return await self.session.call_tool(self.name, arguments=arguments)
+
+
+class ToolDispatcher:
+    """Name-keyed table of compiled tools across all connected servers"""
+
+    def __init__(self, memo: ToolMemo | None = None, pure_tools=()):
+        self.bindings: dict[str, ToolBinding] = {}
+        self.memo = memo
+        self.pure_tools = set(pure_tools)
+
+    def add_server(self, server: str, session, tools, ready=None) -> None:
+        for tool in tools:
+            if tool.name in self.bindings:
+                print(f"Tool {tool.name} from {server} shadows the one from {self.bindings[tool.name].server}")
+            self.bindings[tool.name] = ToolBinding(
+                tool, session, server, ready=ready, memo=self.memo, pure=tool.name in self.pure_tools
+            )
+
+    def get(self, name: str) -> ToolBinding:
+        binding = self.bindings.get(name)
+        if binding is None:
+            raise ValueError(f"Unknown tool: {name}")
+        return binding
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.bindings
+
+    def __len__(self) -> int:
+        return len(self.bindings)
@@ -0,0 +1,70 @@
+"""Keyword (BM25) index over tool catalogs for picking the tools a query needs"""
+import math
+import re
+from collections import Counter
+
+_STOPWORDS = {
+    "a", "an", "and", "the", "of", "in", "to", "for", "on", "with", "as", "by", "is", "it",
+    "its", "that", "this", "then", "those", "these", "from", "into", "me", "my", "all", "each",
+    "find", "calculate", "compute", "get", "return", "result", "value", "values", "number", "numbers",
+}
+
+
+def _stem(word: str) -> str:
+    """Crude suffix stripping so "divided", "divide" and "divides" meet"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    for suffix in ("ing", "ed", "e"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens, split on underscores and camelCase, lightly stemmed"""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "")
+    words = re.findall(r"[a-z0-9]+", text.lower().replace("_", " "))
+    return [_stem(w) for w in words if len(w) > 1 and w not in _STOPWORDS]
+
+
+def tool_text(tool) -> list[str]:
+    """Tokens describing a tool: its name (counted twice), description and parameter names"""
+    properties = (getattr(tool, "inputSchema", None) or {}).get("properties", {})
+    name = tokenize(tool.name)
+    return name + name + tokenize(getattr(tool, "description", "") or "") + tokenize(" ".join(properties))
+
+
+class ToolIndex:
+    """BM25 over tool names, descriptions and parameter names"""
+
+    def __init__(self, tools, k1: float = 1.2, b: float = 0.75):
+        self.tools = list(tools)
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tool_text(tool)) for tool in self.tools]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        frequency = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in frequency.items()}
+
+    def scores(self, query: str) -> list[float]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / self.avg_length)
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, query: str, k: int, always=()) -> set[str]:
+        """Names of the k best-matching tools plus the `always` ones"""
+        ranked = sorted(zip(self.scores(query), range(len(self.tools))), key=lambda pair: (-pair[0], pair[1]))
+        chosen = {self.tools[i].name for score, i in ranked[:k] if score > 0}
+        return chosen | {tool.name for tool in self.tools if tool.name in always}
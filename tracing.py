@@ -0,0 +1,167 @@
+"""Lightweight span tracing for the agent loop
+
+Spans nest through a context variable, so children created inside
+`asyncio.gather` tasks still find their parent. With no exporter the
+tracer hands out one shared no-op span and does no work at all.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import time
+import uuid
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation with attributes, exported when it ends"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start_time", "start", "duration", "error", "_token")
+
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = next(tracer.ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_time = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.export(self)
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": self.duration * 1000,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is disabled"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class InMemoryCollector:
+    """Keeps finished spans in a list, for tests and benchmarks"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlExporter:
+    """Appends finished spans to a JSON-lines file, writing in batches"""
+
+    def __init__(self, path, batch_size=64):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.file = open(path, "a")
+
+    def export(self, span):
+        self.buffer.append(json.dumps(span.to_dict(), default=str))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer and not self.file.closed:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.file.flush()
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Tracer:
+    """Creates spans and hands finished ones to the configured exporter"""
+
+    def __init__(self, exporter=None):
+        self.exporter = None
+        self.ids = itertools.count(1)
+        self.set_exporter(exporter)
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def set_exporter(self, exporter):
+        if self.exporter is not None:
+            self.exporter.close()
+        self.exporter = exporter
+
+    def span(self, name, **attributes):
+        if self.exporter is None:
+            return NOOP_SPAN
+        return Span(self, name, attributes, _current_span.get())
+
+    def export(self, span):
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def flush(self):
+        if self.exporter is not None:
+            self.exporter.flush()
+
+
+def exporter_from_setting(setting):
+    """Map a setting ("", "memory" or a .jsonl path) to an exporter"""
+    if not setting:
+        return None
+    if setting == "memory":
+        return InMemoryCollector()
+    return JsonlExporter(setting)
+
+
+tracer = Tracer()
+atexit.register(lambda: tracer.exporter is not None and tracer.exporter.close())